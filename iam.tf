@@ -27,9 +27,38 @@ data "aws_iam_policy_document" "load_splitter_lambda" {
       "sqs:DeleteMessage",
       "sqs:SendMessage",
     ]
-    resources = [
-      aws_sqs_queue.lambda_invocation_queue.arn
-    ]
+    resources = concat(
+      [aws_sqs_queue.lambda_invocation_queue.arn],
+      [for queue in aws_sqs_queue.lane : queue.arn],
+    )
+  }
+  dynamic "statement" {
+    for_each = aws_s3_bucket.claim_check
+    content {
+      actions   = ["s3:PutObject", "s3:GetObject"]
+      resources = ["${statement.value.arn}/claim-check/*"]
+    }
+  }
+  dynamic "statement" {
+    for_each = aws_dynamodb_table.idempotency
+    content {
+      actions   = ["dynamodb:PutItem", "dynamodb:DeleteItem"]
+      resources = [statement.value.arn]
+    }
+  }
+  dynamic "statement" {
+    for_each = aws_dynamodb_table.jobs
+    content {
+      actions   = ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:UpdateItem"]
+      resources = [statement.value.arn]
+    }
+  }
+  dynamic "statement" {
+    for_each = aws_dynamodb_table.jobs
+    content {
+      actions   = ["events:PutEvents"]
+      resources = ["arn:aws:events:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:event-bus/default"]
+    }
   }
   statement {
     actions   = ["logs:CreateLogGroup"]
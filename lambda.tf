@@ -25,10 +25,22 @@ resource "aws_lambda_function" "load_splitter" {
   role             = aws_iam_role.load_splitter_lambda.arn
   handler          = "load_splitter_lambda.code.main.lambda_handler"
   runtime          = "python3.8"
-  timeout          = "30"
+  timeout          = var.lambda_timeout
   environment {
     variables = {
-      "QUEUE_NAME" = aws_sqs_queue.lambda_invocation_queue.name
+      "QUEUE_NAME"                = aws_sqs_queue.lambda_invocation_queue.name
+      "QUEUE_URL"                 = aws_sqs_queue.lambda_invocation_queue.url
+      "CHUNK_SIZE"                = var.chunk_size
+      "LOCAL_MAX_WORKERS"         = var.local_max_workers
+      "TREE_BRANCHING_FACTOR"     = var.tree_branching_factor
+      "COALESCE_MAX_TAGS"         = var.coalesce_max_tags
+      "CLAIM_CHECK_BUCKET"        = var.claim_check_bucket ? aws_s3_bucket.claim_check[0].id : ""
+      "IDEMPOTENCY_TABLE"         = var.idempotency_table ? aws_dynamodb_table.idempotency[0].name : ""
+      "IDEMPOTENCY_CLAIM_SECONDS" = var.lambda_timeout
+      "LANE_QUEUES"               = jsonencode({ for lane, queue in aws_sqs_queue.lane : lane => queue.name })
+      "LANE_RULES"                = var.lane_rules
+      "JOB_TABLE"                 = var.job_tracking ? aws_dynamodb_table.jobs[0].name : ""
+      "JOB_EVENT_BUS"             = var.job_tracking ? "default" : ""
     }
   }
 }
@@ -40,7 +52,7 @@ data "archive_file" "load_splitter_lambda_zip" {
   output_path = "load_splitter_lambda.zip"
   excludes = [
     "requirements.txt", "requirements_dev.txt",
-    "load_splitter_lambda/tests", "tox.ini", "setup.py",
+    "load_splitter_lambda/tests", "load_splitter_lambda/benchmarks", "load_splitter_lambda/tools", "tox.ini", "setup.py",
     "load_splitter_lambda/__pycache__", "load_splitter_lambda/code/__pycache__",
     "pyproject.toml", ".pytest_cache", ".tox", "UNKNOWN.egg-info",
   ]
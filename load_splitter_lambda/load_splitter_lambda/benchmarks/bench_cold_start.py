@@ -0,0 +1,148 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This benchmark measures the cold start of the Lambda: how long it takes to import the
+# handler (the Lambda init phase) and to handle the first event, for an event with a
+# single tag (which is processed directly, without using SQS) and for an event that is
+# split (which creates the SQS client and sends the messages). Each measurement is made
+# in a fresh python process, both without and with the SQS client being prewarmed during
+# the init phase (see transport.py). No calls are made to AWS: the SQS client is
+# stubbed with botocore's Stubber, which answers before any request is sent, and tags are
+# "processed" instantly.
+#
+# To run this benchmark, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/benchmarks/bench_cold_start.py --repeat 10 --output cold_start.json
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+SPLIT_TAGS = 25
+
+def generate_event(tag_count):
+    return {
+        "detail": {
+            "eventSource": "ec2.amazonaws.com",
+            "eventName": "CreateTags",
+            "awsRegion": "us-west-2",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(tag_count) ] }
+            }
+        }
+    }
+
+def stub_sqs_client(client, message_count):
+    # -*- coding: utf-8 -*-
+    """This method makes the SQS 'client' answer the SendMessageBatch calls for
+    'message_count' messages, without sending any request.
+    """
+    from botocore.stub import Stubber
+    stubber = Stubber(client)
+    for first in range(0, message_count, 10):
+        stubber.add_response("send_message_batch", { "Failed": [], "Successful": [
+            { "Id": str(index), "MessageId": f"message-{index}", "MD5OfMessageBody": "0" * 32 }
+            for index in range(first, min(first + 10, message_count)) ] })
+    stubber.activate()
+    return stubber
+
+def run_child(scenario):
+    # -*- coding: utf-8 -*-
+    """This method runs one cold start in this (fresh) process and prints its
+    measurements as JSON.
+    """
+    started = time.perf_counter()
+    sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+    import main
+    import transport
+    imported = time.perf_counter()
+    boto3_loaded_at_init = "boto3" in sys.modules
+
+    main.process_one_tag = lambda tag: None
+    tag_count = 1 if scenario == "single-tag" else SPLIT_TAGS
+    if scenario == "split":
+        if transport._sqs_client is not None:
+            stub_sqs_client(transport._sqs_client, tag_count)
+        else:
+            get_sqs_client = transport.get_sqs_client
+            def get_stubbed_sqs_client():
+                client_was_created = transport._sqs_client is not None
+                client = get_sqs_client()
+                if not client_was_created:
+                    stub_sqs_client(client, tag_count)
+                return client
+            transport.get_sqs_client = get_stubbed_sqs_client
+    event = generate_event(tag_count)
+
+    invoked = time.perf_counter()
+    out = main.lambda_handler(event, None)
+    handled = time.perf_counter()
+    assert out["statusCode"] in (200, 202), out
+    print(json.dumps({
+        "initMs":              (imported - started) * 1000,
+        "firstInvocationMs":   (handled - invoked) * 1000,
+        "boto3LoadedAtInit":   boto3_loaded_at_init,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the Lambda")
+    parser.add_argument("--repeat", type=int, default=5,  help="number of cold starts per scenario")
+    parser.add_argument("--output", default=None,         help="file to write the results to, as JSON")
+    parser.add_argument("--child",  default=None,         help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child)
+
+    results = []
+    for scenario in ("single-tag", "split"):
+        for prewarm in (False, True):
+            env = dict(os.environ, AWS_DEFAULT_REGION="us-west-2", AWS_ACCESS_KEY_ID="testing",
+                       AWS_SECRET_ACCESS_KEY="testing", QUEUE_NAME="bench",
+                       QUEUE_URL="https://sqs.us-west-2.amazonaws.com/123456789012/bench",
+                       LOG_LEVEL="WARNING", METRICS_NAMESPACE="none")
+            env.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+            env.pop("PREWARM_SQS_CLIENT", None)
+            if prewarm:
+                env["AWS_LAMBDA_FUNCTION_NAME"] = "bench"
+                env["PREWARM_SQS_CLIENT"] = "true"
+            runs = [ json.loads(subprocess.run([ sys.executable, __file__, "--child", scenario ], env=env,
+                                               capture_output=True, text=True, check=True).stdout.splitlines()[-1])
+                     for i in range(args.repeat) ]
+            row = {
+                "scenario":            scenario,
+                "prewarm":             prewarm,
+                "initMs":              statistics.median(run["initMs"] for run in runs),
+                "firstInvocationMs":   statistics.median(run["firstInvocationMs"] for run in runs),
+                "boto3LoadedAtInit":   runs[0]["boto3LoadedAtInit"],
+            }
+            results.append(row)
+            print(f"{scenario:>10} {'prewarmed' if prewarm else 'lazy':>9}: init {row['initMs']:7.1f} ms, "
+                  f"first invocation {row['firstInvocationMs']:7.1f} ms (median of {args.repeat})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({ "benchmark": "cold_start", "python": platform.python_version(),
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "results": results }, output, indent=2)
+        print(f"results written to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
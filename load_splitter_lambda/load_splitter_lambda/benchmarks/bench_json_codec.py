@@ -0,0 +1,64 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This micro-benchmark compares the JSON codecs (see json_codec.py) on the CloudTrail
+# CreateTags events that the Lambda serializes and parses, along with the original way
+# of parsing queued messages, which rewrote every single quote before calling json.loads.
+#
+# To run this benchmark, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/benchmarks/bench_json_codec.py --tags 50 --resources 200
+
+import argparse
+import json
+import sys
+import timeit
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+sys.path.append("load_splitter_lambda/benchmarks")
+import json_codec
+from bench_split_encoder import generate_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the JSON codecs on CloudTrail events")
+    parser.add_argument("--tags",      type=int, default=50,   help="number of tags in the event")
+    parser.add_argument("--resources", type=int, default=200,  help="number of resources in the event")
+    parser.add_argument("--number",    type=int, default=200,  help="number of calls per timed run")
+    parser.add_argument("--repeat",    type=int, default=5,    help="number of timed runs of each codec")
+    args = parser.parse_args()
+
+    event = generate_event(args.tags, args.resources)
+    body = json.dumps(event)
+    print(f"event: {args.tags} tags, {args.resources} resources, {len(body)} bytes")
+
+    def time_it(function):
+        return min(timeit.repeat(function, number=args.number, repeat=args.repeat)) / args.number
+
+    timings = { "original loads": time_it(lambda: json.loads(body.replace("'", '"'))) }
+    names = [ "json" ] + ([ "orjson" ] if json_codec.orjson else [])
+    for name in names:
+        codec = json_codec.get_json_codec(name)
+        timings[f"{name} dumps"] = time_it(lambda: codec.dumps(event))
+        timings[f"{name} loads"] = time_it(lambda: codec.loads(body))
+    for name, seconds in timings.items():
+        print(f"{name:>15}: {seconds * 1e6:10.1f} us")
+    if "orjson" not in names:
+        print("orjson is not installed, so only the standard library was timed")
+
+if __name__ == "__main__":
+    main()
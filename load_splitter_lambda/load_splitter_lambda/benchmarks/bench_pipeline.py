@@ -0,0 +1,228 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This benchmark runs the whole split-and-process pipeline offline, against an in-process
+# stand-in for the SQS queue, for CreateTags events of growing size. For each event it
+# measures:
+#
+#   - split:    the time taken by the first invocation to split the event, and its peak
+#               memory allocation (as traced by tracemalloc)
+#   - enqueue:  the number of SendMessage(Batch) calls, messages and bytes sent, over
+#               the whole run (i.e. including messages queued by range messages)
+#   - makespan: the time from the first invocation until every tag has been processed,
+#               with the queued messages handed to up to '--concurrency' concurrent
+#               invocations in batches of '--batch-size', as Lambda would
+#
+# "Processing" a tag is simulated by sleeping for '--tag-seconds' (rather than the 5
+# seconds of the sample), and the Lambda is configured from the environment as usual
+# (e.g. CHUNK_SIZE, TREE_BRANCHING_FACTOR, MESSAGE_COMPRESSION). The results are written
+# as JSON, so that runs of different releases can be compared.
+#
+# To run this benchmark, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/benchmarks/bench_pipeline.py --tags 1 10 100 1000 10000 --output results.json
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+sys.path.append("load_splitter_lambda/benchmarks")
+import event_queue
+import main as lambda_main
+from bench_split_encoder import generate_event
+from codec import get_message_size
+from idempotency import reset_idempotency_guard
+from jobs import reset_job_tracker
+from scheduler import reset_tag_duration_estimate
+
+
+class InProcessQueue():
+    """A stand-in for an SqsTransport, which keeps the queued messages in memory and
+    counts the calls made and the bytes sent to it.
+    """
+    def __init__(self):
+        self.messages = deque()
+        self.calls = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _put(self, body, attributes):
+        message_id = f"message-{next(self._ids)}"
+        self.messages.append({
+            "messageId": message_id,
+            "eventSource": "aws:sqs",
+            "body": body,
+            "messageAttributes": attributes or {},
+            "attributes": { "SentTimestamp": str(int(time.time() * 1000)) }
+        })
+        self.messages_sent += 1
+        self.bytes_sent += get_message_size(body, attributes)
+        return message_id
+
+    def send_message(self, body, attributes=None):
+        with self._lock:
+            self.calls += 1
+            return { "MessageId": self._put(body, attributes) }
+
+    def send_message_batch(self, entries):
+        with self._lock:
+            self.calls += 1
+            for entry in entries:
+                self._put(entry["MessageBody"], entry.get("MessageAttributes", None))
+        return { "Successful": [ { "Id": entry["Id"] } for entry in entries ], "Failed": [] }
+
+    def receive(self, max_count):
+        with self._lock:
+            return [ self.messages.popleft() for i in range(min(max_count, len(self.messages))) ]
+
+def run_case(tag_count, args):
+    # -*- coding: utf-8 -*-
+    """This method runs the pipeline for one event of 'tag_count' tags, and returns the
+    measurements as a dict. Each case starts afresh: the event has an ID of its own, and
+    what the Lambda remembers between invocations (the tags it processed, the jobs and
+    the time per tag) is forgotten, so that no tag is skipped as a repeat of an earlier
+    case.
+    """
+    reset_idempotency_guard()
+    reset_job_tracker()
+    reset_tag_duration_estimate()
+    queue = InProcessQueue()
+    event_queue.get_transport = lambda queue_name=None: queue
+    processed = itertools.count()
+    def process_one_tag(tag):
+        time.sleep(args.tag_seconds)
+        next(processed)
+    lambda_main.process_one_tag = process_one_tag
+    event = generate_event(tag_count, args.resources)
+    event["id"] = str(uuid.uuid4())
+    if "eventID" in event.get("detail", {}):
+        event["detail"]["eventID"] = str(uuid.uuid4())
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = lambda_main.lambda_handler(event, None)
+    split_seconds = time.perf_counter() - started
+    peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    invocations = 1
+    failures = 0 if result["statusCode"] < 400 else 1
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        running = set()
+        while True:
+            while len(running) < args.concurrency:
+                records = queue.receive(args.batch_size)
+                if not records:
+                    break
+                running.add(pool.submit(lambda_main.lambda_handler, { "Records": records }, None))
+                invocations += 1
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            failures += sum(len(future.result()["batchItemFailures"]) for future in done)
+    makespan_seconds = time.perf_counter() - started
+    tags_processed = next(processed)
+    if tags_processed != tag_count:
+        raise RuntimeError(f"processed '{tags_processed}' of '{tag_count}' tags, so the measurements are not valid")
+
+    return {
+        "tags":              tag_count,
+        "splitSeconds":      split_seconds,
+        "peakMemoryBytes":   peak_memory_bytes,
+        "enqueueCalls":      queue.calls,
+        "messagesSent":      queue.messages_sent,
+        "bytesSent":         queue.bytes_sent,
+        "invocations":       invocations,
+        "tagsProcessed":     tags_processed,
+        "failedMessages":    failures,
+        "makespanSeconds":   makespan_seconds,
+    }
+
+# the measurements compared to the baseline: lower is better for all of them
+COMPARED_MEASUREMENTS = ("splitSeconds", "peakMemoryBytes", "enqueueCalls", "bytesSent", "makespanSeconds")
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    # -*- coding: utf-8 -*-
+    """This method prints the measurements in 'results' that are more than 'tolerance'
+    times those of the same tag count in the baseline results file, and returns how many
+    there are.
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = { row["tags"]: row for row in json.load(baseline_file)["results"] }
+    regressions = 0
+    for row in results:
+        for measurement in COMPARED_MEASUREMENTS:
+            before = baseline.get(row["tags"], {}).get(measurement, None)
+            if before and row[measurement] > before * tolerance:
+                regressions += 1
+                print(f"REGRESSION: {row['tags']} tags: {measurement} went from {before} to {row[measurement]}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the split-and-process pipeline offline")
+    parser.add_argument("--tags",        type=int, nargs="+", default=[ 1, 10, 100, 1000, 10000 ], help="numbers of tags in the events")
+    parser.add_argument("--resources",   type=int, default=1,    help="number of resources in each event")
+    parser.add_argument("--tag-seconds", type=float, default=0.0, help="time taken to process one tag")
+    parser.add_argument("--concurrency", type=int, default=100,  help="maximum number of concurrent invocations")
+    parser.add_argument("--batch-size",  type=int, default=10,   help="maximum number of queued messages per invocation")
+    parser.add_argument("--output",      default=None,           help="file to write the results to, as JSON")
+    parser.add_argument("--baseline",    default=None,           help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance",   type=float, default=1.2, help="ratio to the baseline above which a measurement is a regression")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QUEUE_NAME", "bench")
+    os.environ.setdefault("METRICS_NAMESPACE", "none")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    results = []
+    for tag_count in args.tags:
+        results.append(run_case(tag_count, args))
+        row = results[-1]
+        print(f"{row['tags']:>6} tags: split {row['splitSeconds'] * 1000:9.1f} ms, "
+              f"peak {row['peakMemoryBytes'] / 1024:9.1f} KB, {row['enqueueCalls']:>5} calls, "
+              f"{row['messagesSent']:>6} messages, {row['bytesSent'] / 1024:9.1f} KB, "
+              f"makespan {row['makespanSeconds']:7.2f} s")
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python":    platform.python_version(),
+        "settings":  dict(vars(args), environment={ key: value for key, value in os.environ.items()
+                          if key in ("CHUNK_SIZE", "CHUNK_MAX_COST", "LOCAL_MAX_WORKERS", "TREE_BRANCHING_FACTOR",
+                                     "TREE_MAX_DEPTH", "MESSAGE_PROJECTION", "MESSAGE_COMPRESSION", "JSON_CODEC") }),
+        "results":   results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"results written to '{args.output}'")
+    if args.baseline and compare_to_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
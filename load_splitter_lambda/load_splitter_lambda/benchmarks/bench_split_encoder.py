@@ -0,0 +1,103 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This micro-benchmark compares two ways of encoding the smaller events that a large
+# CreateTags event is split into:
+#
+#   - deepcopy: deep-copy the event once, then for each tag replace the embedded list
+#               and serialize the whole event (the original approach)
+#   - template: serialize the event once with a placeholder for the embedded list, then
+#               splice in each tag's JSON (event_queue.encode_split_events())
+#
+# To run this benchmark, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/benchmarks/bench_split_encoder.py --tags 500 --resources 1000
+
+import argparse
+import copy
+import json
+import sys
+import timeit
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from event_queue import encode_split_events, get_reference_to_embedded_list
+
+
+def generate_event(tag_count, resource_count):
+    # -*- coding: utf-8 -*-
+    """This method generates a CreateTags event with 'tag_count' tags, applied to
+    'resource_count' resources, with matching "resourcesSet" and "responseElements"
+    blocks, as CloudTrail reports for bulk tagging.
+    """
+    resources = [ { "resourceId": f"i-{i:017x}" } for i in range(resource_count) ]
+    return {
+        "version": "0",
+        "id": "6a7e8feb-b491-4cf7-a9f1-bf3703467718",
+        "detail-type": "AWS API Call via CloudTrail",
+        "source": "aws.ec2",
+        "detail": {
+            "eventVersion": "1.08",
+            "eventSource": "ec2.amazonaws.com",
+            "eventName": "CreateTags",
+            "awsRegion": "us-west-2",
+            "userAgent": "aws-cli/2.2.44 Python/3.8.8 Linux/5.4.0 botocore/2.0.0",
+            "requestParameters": {
+                "resourcesSet": { "items": resources },
+                "tagSet": { "items": [ { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(tag_count) ] }
+            },
+            "responseElements": {
+                "requestId": "e1a9b3a5-2b3c-4d5e-8f90-0a1b2c3d4e5f",
+                "_return": True,
+                "resourcesSet": { "items": resources }
+            }
+        }
+    }
+
+def encode_with_deepcopy(event):
+    event_copy = copy.deepcopy(event)
+    list_reference = get_reference_to_embedded_list(event_copy)
+    list_items = list_reference.copy()
+    bodies = []
+    for item in list_items:
+        list_reference.clear()
+        list_reference.append(item)
+        bodies.append(json.dumps(event_copy))
+    return bodies
+
+def encode_with_template(event):
+    chunks = [ [ item ] for item in get_reference_to_embedded_list(event) ]
+    return list(encode_split_events(event, chunks))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the encoders of split events")
+    parser.add_argument("--tags",      type=int, default=200,  help="number of tags in the event")
+    parser.add_argument("--resources", type=int, default=1000, help="number of resources in the event")
+    parser.add_argument("--repeat",    type=int, default=5,    help="number of timed runs of each encoder")
+    args = parser.parse_args()
+
+    event = generate_event(args.tags, args.resources)
+    assert [ json.loads(body) for body in encode_with_deepcopy(event) ] == \
+           [ json.loads(body) for body in encode_with_template(event) ], "Expecting both encoders to agree"
+    print(f"event: {args.tags} tags, {args.resources} resources, {len(json.dumps(event))} bytes")
+    timings = {}
+    for name, encoder in (("deepcopy", encode_with_deepcopy), ("template", encode_with_template)):
+        timings[name] = min(timeit.repeat(lambda: encoder(event), number=1, repeat=args.repeat))
+        print(f"{name:>10}: {timings[name] * 1000:10.2f} ms  ({timings[name] / args.tags * 1e6:8.1f} us per tag)")
+    print(f"   speedup: {timings['deepcopy'] / timings['template']:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# Backpressure spreads the messages of a split event over time, so that the invocations
+# that process them don't all call the downstream (EC2 tagging) APIs at once and get
+# throttled. Each queued message is given a "DelaySeconds", which is the larger of:
+#
+#   - its token bucket delay: messages are queued at no more than
+#     "FANOUT_RATE_PER_SECOND" per second (after a burst of up to "FANOUT_BURST"), with
+#     the bucket kept in module state, so that it also paces the events that a warm
+#     Lambda container splits one after the other
+#   - its stagger delay: the messages of one split are spread evenly over
+#     "STAGGER_WINDOW_SECONDS"
+#
+# Both are turned off by default (0). When processing a tag fails with a throttling error,
+# the rate is halved and the window doubled for the splits that follow, and each tag
+# processed without one recovers a little of the rate (additive increase, multiplicative
+# decrease). This feedback is also kept in module state, so it is per Lambda container.
+#
+# SQS delays messages by at most SQS_MAX_DELAY_SECONDS, so the bucket never goes deeper
+# into debt than that many seconds' worth of tokens, and the stagger window is never
+# longer. Messages that can't be paced within that delay are held back rather than given
+# the maximum delay, which would make them all visible at once: they are not queued, so
+# the split fails and is retried later, once the bucket has refilled.
+
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger()
+
+DEFAULT_FANOUT_RATE_PER_SECOND = 0   # 0 means unlimited
+DEFAULT_STAGGER_WINDOW_SECONDS = 0
+SQS_MAX_DELAY_SECONDS          = 900
+
+MIN_RATE_FACTOR         = 0.05 # the rate is never slowed to less than this fraction
+THROTTLE_DECREASE       = 0.5  # the rate factor is multiplied by this on each throttle
+SUCCESS_INCREASE        = 0.01 # ... and increased by this on each tag without one
+
+# error codes returned by AWS APIs when a request is throttled
+THROTTLING_ERROR_CODES = ("Throttling", "ThrottlingException", "ThrottledException", "RequestLimitExceeded",
+                          "TooManyRequestsException", "RequestThrottled", "SlowDown")
+
+class TokenBucket():
+    """A token bucket that, rather than refusing requests when it is empty, tells how long
+    each request has to wait for its token. The bucket holds up to 'burst' tokens, and
+    is refilled at the rate passed to each reserve() call. Requests that would have to
+    wait more than 'max_delay' seconds are refused, which caps the bucket's debt.
+    """
+    def __init__(self, burst, clock=time.monotonic, max_delay=SQS_MAX_DELAY_SECONDS):
+        self.burst = burst
+        self.max_delay = max_delay
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, count, rate):
+        # -*- coding: utf-8 -*-
+        """This method takes up to 'count' tokens from the bucket, going into debt when it
+        runs out, and returns the seconds to wait before using each token taken. Fewer
+        than 'count' tokens are taken when the others would have to wait more than
+        'max_delay' seconds.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            delays = []
+            for i in range(count):
+                delay = max(0.0, (1 - self.tokens) / rate)
+                if delay > self.max_delay:
+                    break
+                self.tokens -= 1
+                delays.append(delay)
+            return delays
+
+class AdaptiveRate():
+    """The fraction (between MIN_RATE_FACTOR and 1) of the configured rate to use, as
+    adjusted by throttling feedback (see the top of this file).
+    """
+    def __init__(self):
+        self.factor = 1.0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def on_throttle(self):
+        with self._lock:
+            self.factor = max(MIN_RATE_FACTOR, self.factor * THROTTLE_DECREASE)
+            self.throttles += 1
+
+    def on_success(self):
+        with self._lock:
+            self.factor = min(1.0, self.factor + SUCCESS_INCREASE)
+
+_rate = AdaptiveRate()
+_bucket = None
+
+def get_fanout_rate_per_second():
+    # -*- coding: utf-8 -*-
+    """This method returns the configured rate at which messages are queued (0 meaning
+    unlimited), from the "FANOUT_RATE_PER_SECOND" environment variable.
+    """
+    return max(0.0, float(os.environ.get("FANOUT_RATE_PER_SECOND", None) or DEFAULT_FANOUT_RATE_PER_SECOND))
+
+def get_fanout_burst():
+    # -*- coding: utf-8 -*-
+    """This method returns the number of messages that may be queued at once before the
+    rate applies, from the "FANOUT_BURST" environment variable, else 1 second's worth.
+    """
+    return max(1.0, float(os.environ.get("FANOUT_BURST", None) or get_fanout_rate_per_second()))
+
+def get_stagger_window_seconds():
+    # -*- coding: utf-8 -*-
+    """This method returns the configured period over which the messages of a split are
+    spread, from the "STAGGER_WINDOW_SECONDS" environment variable.
+    """
+    return max(0.0, float(os.environ.get("STAGGER_WINDOW_SECONDS", None) or DEFAULT_STAGGER_WINDOW_SECONDS))
+
+def get_rate_factor():
+    # -*- coding: utf-8 -*-
+    """This method returns the fraction of the configured rate currently in use."""
+    return _rate.factor
+
+def is_throttling_error(ex):
+    # -*- coding: utf-8 -*-
+    """This method returns True if the exception 'ex' is an AWS API throttling error."""
+    # botocore is not imported here: if nothing else has imported it, 'ex' can't be one of its errors
+    exceptions = sys.modules.get("botocore.exceptions", None)
+    if exceptions is None or not isinstance(ex, exceptions.ClientError):
+        return False
+    return ex.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+def record_throttle():
+    # -*- coding: utf-8 -*-
+    """This method reports that processing a tag was throttled, slowing later splits."""
+    _rate.on_throttle()
+    logger.warning(f"===> throttled by a downstream API, fan-out rate factor is now '{_rate.factor:.2f}'")
+
+def record_success():
+    # -*- coding: utf-8 -*-
+    """This method reports that a tag was processed without being throttled."""
+    _rate.on_success()
+
+def get_fanout_delays(count):
+    # -*- coding: utf-8 -*-
+    """This method returns the "DelaySeconds" to give each of the 'count' messages of one
+    split, as described at the top of this file.
+
+    Parameters
+    ----------
+    count : int
+        The number of messages about to be queued.
+
+    Returns
+    -------
+    list
+        A list of whole numbers of seconds, between 0 and SQS_MAX_DELAY_SECONDS, for the
+        first messages, or None if no message needs to be delayed. When the list holds
+        fewer than 'count' delays, the other messages can't be paced, and must be held
+        back.
+    """
+    global _bucket
+    factor = get_rate_factor()
+    delays = [ 0.0 ] * count
+    rate = get_fanout_rate_per_second() * factor
+    if rate > 0:
+        if _bucket is None:
+            _bucket = TokenBucket(get_fanout_burst())
+        delays = _bucket.reserve(count, rate)
+    if len(delays) < count:
+        logger.warning(f"===> fan-out rate allows '{len(delays)}' of '{count}' message(s) within '{SQS_MAX_DELAY_SECONDS}' seconds, holding back the others")
+    window = min(SQS_MAX_DELAY_SECONDS, get_stagger_window_seconds() / factor)
+    if window > 0 and count > 1:
+        delays = [ max(delay, window * i / count) for i, delay in enumerate(delays) ]
+    if len(delays) == count and not any(delays):
+        return None
+    return [ min(SQS_MAX_DELAY_SECONDS, int(math.ceil(delay))) for delay in delays ]
+
+def reset_backpressure():
+    # -*- coding: utf-8 -*-
+    """This method forgets the token bucket and the throttling feedback (e.g. between
+    tests).
+    """
+    global _rate, _bucket
+    _rate = AdaptiveRate()
+    _bucket = None
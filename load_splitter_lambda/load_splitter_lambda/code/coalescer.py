@@ -0,0 +1,108 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# Many CreateTags events tag the same resources one tag at a time, within seconds of each
+# other. When "COALESCE_MAX_TAGS" is at least 2, the small events in a batch of queued
+# messages are not processed one by one: their tags are grouped by the resources (and the
+# account and region) that they apply to, and each group of up to COALESCE_MAX_TAGS tags
+# is processed as one unit of work, with one call to a batch-aware processing function.
+# The batch of queued messages is thus the coalescing window, whose size and duration are
+# set by the batch size and batching window of the SQS event source mapping.
+#
+# Only events whose tags fit in one chunk (see split_policy.py), and which are not range
+# messages, are coalesced; other events are handled as they are. Within a unit, each tag
+# key appears at most once, so a later tag with the same key (possibly with a new value)
+# starts a new unit, which keeps the tags of the same resources in their original order.
+
+import logging
+import os
+import sys
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from event_queue import get_reference_to_embedded_list, get_split_metadata
+from split_policy import fits_in_one_chunk
+
+logger = logging.getLogger()
+
+DEFAULT_COALESCE_MAX_TAGS = 0 # 0 (or 1) disables coalescing
+
+def get_coalesce_max_tags(max_tags=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the maximum number of tags per unit of work: the 'max_tags'
+    argument if given, else the "COALESCE_MAX_TAGS" environment variable, else
+    DEFAULT_COALESCE_MAX_TAGS.
+    """
+    if max_tags is None:
+        max_tags = os.environ.get("COALESCE_MAX_TAGS", None) or DEFAULT_COALESCE_MAX_TAGS
+    return max(0, int(max_tags))
+
+def is_coalescible(event):
+    # -*- coding: utf-8 -*-
+    """This method returns True if the tags of the event may be coalesced with those of
+    other events (see the top of this file).
+    """
+    if not isinstance(event, dict) or event.get("detail", {}).get("eventName", None) != "CreateTags":
+        return False
+    if get_split_metadata(event).get("range", False):
+        return False
+    tags = get_reference_to_embedded_list(event)
+    return isinstance(tags, list) and bool(tags) and all(isinstance(tag, dict) for tag in tags) and fits_in_one_chunk(tags)
+
+def get_resource_key(event):
+    # -*- coding: utf-8 -*-
+    """This method returns a key identifying the resources that the event's tags apply to,
+    or None if the event doesn't list any resources.
+    """
+    detail = event.get("detail", {})
+    resources = detail.get("requestParameters", {}).get("resourcesSet", {}).get("items", [])
+    resource_ids = tuple(sorted(resource.get("resourceId", "") for resource in resources if isinstance(resource, dict)))
+    if not resource_ids:
+        return None
+    return (detail.get("recipientAccountId", event.get("account", None)), detail.get("awsRegion", event.get("region", None)), resource_ids)
+
+def coalesce_tag_work(messages, max_tags=None):
+    # -*- coding: utf-8 -*-
+    """This method groups the tags of small events into units of work.
+
+    Parameters
+    ----------
+    messages : list
+        The (message_id, event) tuples of the events to coalesce, each of which must be
+        coalescible (see is_coalescible()), in the order they were received.
+    max_tags : int, optional
+        The maximum number of tags per unit (see get_coalesce_max_tags()).
+
+    Returns
+    -------
+    list
+        A list of units, each a non-empty list of (message_id, event, tag) tuples whose
+        events all apply to the same resources. Events without resources each make
+        units of their own.
+    """
+    max_tags = max(1, get_coalesce_max_tags(max_tags))
+    open_units = {}
+    units = []
+    for message_id, event in messages:
+        key = get_resource_key(event) or ("message", message_id)
+        for tag in get_reference_to_embedded_list(event):
+            unit = open_units.get(key, None)
+            if unit is None or len(unit) >= max_tags or any(item[2].get("key") == tag.get("key") for item in unit):
+                unit = open_units[key] = []
+                units.append(unit)
+            unit.append((message_id, event, tag))
+    return units
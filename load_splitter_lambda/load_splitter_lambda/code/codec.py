@@ -0,0 +1,224 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The message codec controls how the smaller events are encoded in the queued messages.
+# Each of its three parts is optional, and configured from the Lambda environment:
+#
+#   - projection ("MESSAGE_PROJECTION"): keep only the parts of the event that are needed
+#     to process its tags, rather than the whole CloudTrail event
+#   - compression ("MESSAGE_COMPRESSION" of "zlib" or "gzip"): compress message bodies of
+#     at least "MESSAGE_COMPRESSION_MIN_BYTES" bytes and base64 encode them, marking the
+#     message with a "ContentEncoding" message attribute
+#   - claim check ("CLAIM_CHECK_BUCKET" or "CLAIM_CHECK_DIR"): move message bodies that
+#     are larger than "MESSAGE_MAX_BYTES" to a blob store, and queue just the key of the
+#     blob, marking the message with a "ClaimCheck" message attribute
+#
+# SQS bills requests per 64 KB chunk of message, so smaller messages are cheaper to send
+# and faster to parse.
+
+import base64
+import gzip
+import logging
+import os
+import zlib
+
+logger = logging.getLogger()
+
+DEFAULT_COMPRESSION_MIN_BYTES = 1024
+DEFAULT_MESSAGE_MAX_BYTES     = 256 * 1024  # the largest message that SQS accepts
+
+CONTENT_ENCODING_ATTRIBUTE = "ContentEncoding"
+CLAIM_CHECK_ATTRIBUTE      = "ClaimCheck"
+
+COMPRESSORS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "gzip": (gzip.compress, gzip.decompress),
+}
+
+_blob_stores = {}
+
+# the parts of an event that are kept by the projection
+PROJECTED_EVENT_FIELDS   = ("version", "id", "detail-type", "source", "account", "time", "region", "loadSplitter")
+PROJECTED_DETAIL_FIELDS  = ("eventVersion", "eventID", "eventTime", "eventSource", "eventName", "awsRegion")
+PROJECTED_REQUEST_FIELDS = ("resourcesSet", "tagSet")
+
+def project_event(event):
+    # -*- coding: utf-8 -*-
+    """This method returns a copy of the event holding just the fields listed in the
+    PROJECTED_* tuples, which are the ones needed to process the event's tags. Fields
+    that are not found in the event are left out of the copy.
+    """
+    projected = { key: event[key] for key in PROJECTED_EVENT_FIELDS if key in event }
+    detail = event.get("detail", {})
+    projected_detail = projected["detail"] = { key: detail[key] for key in PROJECTED_DETAIL_FIELDS if key in detail }
+    request_parameters = detail.get("requestParameters", {})
+    projected_detail["requestParameters"] = { key: request_parameters[key] for key in PROJECTED_REQUEST_FIELDS if key in request_parameters }
+    return projected
+
+def get_attribute(attributes, name):
+    # -*- coding: utf-8 -*-
+    """This method returns the string value of the named message attribute, or None if the
+    message doesn't have it. It accepts the attributes both as sent to SQS and as Lambda
+    hands them over in SQS records (which spells the keys in lower camel case).
+    """
+    attribute = (attributes or {}).get(name, None)
+    if not attribute:
+        return None
+    return attribute.get("StringValue", attribute.get("stringValue", None))
+
+def get_message_size(body, attributes):
+    # -*- coding: utf-8 -*-
+    """This method returns the size of a message as SQS counts it: the body plus the name,
+    data type and value of each message attribute.
+    """
+    size = len(body.encode("utf-8"))
+    for name, attribute in (attributes or {}).items():
+        size += len(name.encode("utf-8")) + len(attribute["DataType"].encode("utf-8"))
+        size += len(attribute.get("StringValue", "").encode("utf-8"))
+    return size
+
+class FileBlobStore():
+    """A blob store that keeps each blob as a file in a local directory."""
+    name = "file"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, data):
+        import uuid
+        key = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, key), "w", encoding="utf-8") as blob:
+            blob.write(data)
+        return key
+
+    def get(self, key):
+        with open(os.path.join(self.directory, os.path.basename(key)), encoding="utf-8") as blob:
+            return blob.read()
+
+class S3BlobStore():
+    """A blob store that keeps each blob as an object in an S3 bucket. Blobs are not
+    deleted once read, so the bucket should have a lifecycle rule that expires them.
+    """
+    name = "s3"
+
+    def __init__(self, bucket, prefix="claim-check/"):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3")
+
+    def put(self, data):
+        import uuid
+        key = self.prefix + uuid.uuid4().hex
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data.encode("utf-8"))
+        return key
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read().decode("utf-8")
+
+class MessageCodec():
+    """Encodes message bodies before they are queued, and decodes them after they are
+    received, as described at the top of this file.
+    """
+    def __init__(self, projection=False, compression=None, compression_min_bytes=DEFAULT_COMPRESSION_MIN_BYTES,
+                 max_bytes=DEFAULT_MESSAGE_MAX_BYTES, blob_store=None):
+        if compression and compression not in COMPRESSORS:
+            raise ValueError(f"unknown message compression '{compression}'")
+        self.projection = projection
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+        self.max_bytes = max_bytes
+        self.blob_store = blob_store
+
+    def project(self, event):
+        return project_event(event) if self.projection else event
+
+    def encode(self, body):
+        # -*- coding: utf-8 -*-
+        """This method returns a (body, attributes) tuple holding the message body to send
+        for the given JSON 'body', and the message attributes to send with it.
+        """
+        attributes = {}
+        if self.compression and len(body.encode("utf-8")) >= self.compression_min_bytes:
+            compress = COMPRESSORS[self.compression][0]
+            body = base64.b64encode(compress(body.encode("utf-8"))).decode("ascii")
+            attributes[CONTENT_ENCODING_ATTRIBUTE] = { "DataType": "String", "StringValue": self.compression }
+        if self.blob_store and get_message_size(body, attributes) > self.max_bytes:
+            body = self.blob_store.put(body)
+            attributes[CLAIM_CHECK_ATTRIBUTE] = { "DataType": "String", "StringValue": self.blob_store.name }
+        return body, attributes
+
+    def decode(self, body, attributes):
+        # -*- coding: utf-8 -*-
+        """This method returns the JSON body that was encoded as the given message 'body'
+        and 'attributes' by encode().
+        """
+        claim_check = get_attribute(attributes, CLAIM_CHECK_ATTRIBUTE)
+        if claim_check:
+            if not self.blob_store or self.blob_store.name != claim_check:
+                raise ValueError(f"message was moved to a '{claim_check}' blob store, which is not configured")
+            body = self.blob_store.get(body)
+        content_encoding = get_attribute(attributes, CONTENT_ENCODING_ATTRIBUTE)
+        if content_encoding:
+            if content_encoding not in COMPRESSORS:
+                raise ValueError(f"unknown message content encoding '{content_encoding}'")
+            decompress = COMPRESSORS[content_encoding][1]
+            body = decompress(base64.b64decode(body)).decode("utf-8")
+        return body
+
+def get_blob_store():
+    # -*- coding: utf-8 -*-
+    """This method returns the blob store configured by the "CLAIM_CHECK_BUCKET" or
+    "CLAIM_CHECK_DIR" environment variables, or None if neither is set. Blob stores are
+    cached, so that a warm Lambda container reuses the same S3 client.
+    """
+    if os.environ.get("CLAIM_CHECK_BUCKET", None):
+        config = (S3BlobStore, os.environ["CLAIM_CHECK_BUCKET"])
+    elif os.environ.get("CLAIM_CHECK_DIR", None):
+        config = (FileBlobStore, os.environ["CLAIM_CHECK_DIR"])
+    else:
+        return None
+    if config not in _blob_stores:
+        _blob_stores[config] = config[0](config[1])
+    return _blob_stores[config]
+
+def get_message_compression():
+    # -*- coding: utf-8 -*-
+    """This method returns the compression algorithm set by the "MESSAGE_COMPRESSION"
+    environment variable (one of COMPRESSORS), or None if it is unset or "none". Any
+    other value raises a ValueError.
+    """
+    compression = (os.environ.get("MESSAGE_COMPRESSION", None) or "none").strip().lower()
+    if compression == "none":
+        return None
+    if compression not in COMPRESSORS:
+        raise ValueError(f"unknown message compression '{compression}', expecting 'none' or one of {sorted(COMPRESSORS)}")
+    return compression
+
+def get_message_codec():
+    # -*- coding: utf-8 -*-
+    """This method returns the MessageCodec configured by the environment variables
+    described at the top of this file.
+    """
+    return MessageCodec(
+        projection=os.environ.get("MESSAGE_PROJECTION", "").lower() == "true",
+        compression=get_message_compression(),
+        compression_min_bytes=int(os.environ.get("MESSAGE_COMPRESSION_MIN_BYTES", None) or DEFAULT_COMPRESSION_MIN_BYTES),
+        max_bytes=int(os.environ.get("MESSAGE_MAX_BYTES", None) or DEFAULT_MESSAGE_MAX_BYTES),
+        blob_store=get_blob_store())
@@ -16,43 +16,33 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #######################################################################################
 
-import copy
-import json
 import logging
 import os
 import sys
-
-import boto3
-import botocore
+import time
 
 sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from backpressure import get_fanout_delays
+from codec import get_message_codec, get_message_size
+from jobs import get_job_tracker, record_tags_dropped
+import json_codec
+from lanes import choose_lane, get_lane_queue_name, has_lanes
+from split_policy import chunk_items, group_chunks_for_tree
+from telemetry import METRIC_ENQUEUE_BATCH_LATENCY, METRIC_FAN_OUT_SIZE, put_metric
+from transport import get_transport
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def enqueue_event(event):
-    # -*- coding: utf-8 -*-
-    """This method takes a event and enqueues it as a JSON string in an SQS Queue. The
-    name of the Queue is found in the "QUEUE_NAME" environment.
+SQS_MAX_BATCH_ENTRIES = 10         # SendMessageBatch accepts at most 10 entries
+SQS_MAX_BATCH_BYTES   = 256 * 1024 # ... and at most 256 KB summed over all entries
+SQS_MAX_SEND_ATTEMPTS = 3          # attempts made for entries failing with a non-sender fault
 
-    Parameters
-    ----------
-    event : list or dict
-        The incoming data event that should be enqueued. Typically this is a python
-        representation of JSON, in an arbitrarily nested list or dict object.
-    """
-    try:
-        sqs = boto3.resource("sqs")
-        queue_name = os.environ["QUEUE_NAME"]
-        if not queue_name or len(queue_name) == 0:
-            logger.error(f"===> FAIL: unable to find environment variable QUEUE_NAME")
-            return
-        logger.info(f"===> queueing a message to queue '{queue_name}'...")
-        queue = sqs.get_queue_by_name(QueueName=queue_name)
-        queue.send_message(MessageBody=json.dumps(event))
-    except botocore.exceptions.ClientError as ex:
-        logger.error(f"===> EXCEPTION CAUGHT: while queueing message to SQS queue named '{queue_name}'")
-        raise ex
+# stands in for the embedded list while an event is serialized (see encode_split_events())
+ITEMS_PLACEHOLDER = "__load_splitter_items__"
+
+# the top-level key of a queued event that holds what the splitter records about it
+SPLIT_METADATA_KEY = "loadSplitter"
 
 def get_reference_to_embedded_list(event):
     # -*- coding: utf-8 -*-
@@ -90,14 +80,287 @@ def get_reference_to_embedded_list(event):
         return []
     return event.get("detail",{}).get("requestParameters",{}).get("tagSet",{}).get("items",[])
 
-def queue_smaller_events(event):
+def batch_messages(messages):
+    # -*- coding: utf-8 -*-
+    """This method takes messages and groups them into batches that can each be sent with
+    a single SQS SendMessageBatch call, i.e. batches of no more than
+    SQS_MAX_BATCH_ENTRIES entries whose sizes sum to no more than SQS_MAX_BATCH_BYTES
+    bytes. A message which is too large to ever be sent is placed in a batch of its own,
+    so that SQS can report it as failed.
+
+    Parameters
+    ----------
+    messages : iterable
+        The messages to be grouped into batches, each a (body, attributes) tuple as
+        returned by codec.MessageCodec.encode(). This may be a generator, in which case
+        each batch is yielded as soon as it is complete.
+
+    Returns
+    -------
+    generator
+        Yields lists of (index, message) tuples, one list per batch, where 'index' is the
+        position of the message in 'messages'. The messages keep their original order.
+    """
+    batch = []
+    batch_bytes = 0
+    for index, message in enumerate(messages):
+        message_bytes = get_message_size(*message)
+        if batch and (len(batch) == SQS_MAX_BATCH_ENTRIES or batch_bytes + message_bytes > SQS_MAX_BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append((index, message))
+        batch_bytes += message_bytes
+    if batch:
+        yield batch
+
+def send_message_batch(transport, batch, results, delays=None):
+    # -*- coding: utf-8 -*-
+    """This method sends one batch of messages to an SQS queue with SendMessageBatch
+    and records the outcome of each entry in 'results'. Entries that SQS reports as failed
+    for a reason that is not the sender's fault (e.g. an internal error) are re-sent on
+    their own, up to SQS_MAX_SEND_ATTEMPTS attempts in total; entries that succeeded are
+    never re-sent.
+
+    Parameters
+    ----------
+    transport : transport.SqsTransport
+        The transport for the SQS queue to send the messages to.
+    batch : list
+        The (index, message) tuples which make up this batch (see batch_messages()).
+    results : list
+        A list of booleans, long enough to hold every index in the batch, which is
+        updated in place so that results[index] is True for each entry that was
+        successfully enqueued.
+    delays : list, optional
+        The "DelaySeconds" of each message, by index (see backpressure.py).
+    """
+    entries = {}
+    for index, (body, attributes) in batch:
+        entries[index] = { "Id": str(index), "MessageBody": body }
+        if attributes:
+            entries[index]["MessageAttributes"] = attributes
+        if delays and delays[index]:
+            entries[index]["DelaySeconds"] = delays[index]
+    pending = list(entries)
+    for attempt in range(1, SQS_MAX_SEND_ATTEMPTS + 1):
+        started = time.monotonic()
+        response = transport.send_message_batch([ entries[index] for index in pending ])
+        put_metric(METRIC_ENQUEUE_BATCH_LATENCY, (time.monotonic() - started) * 1000)
+        for entry in response.get("Successful", []):
+            results[int(entry["Id"])] = True
+        retry = []
+        for entry in response.get("Failed", []):
+            logger.error(f"===> FAIL: unable to queue message (attempt {attempt}): {entry.get('Code')} {entry.get('Message')}")
+            if not entry.get("SenderFault", False):
+                retry.append(int(entry["Id"]))
+        if not retry:
+            return
+        pending = retry
+
+def enqueue_message_bodies(bodies, codec=None, delays=None, queue_name=None):
+    # -*- coding: utf-8 -*-
+    """This method takes message bodies (strings) and enqueues them in an SQS Queue,
+    packing them into as few SendMessageBatch calls as possible. The name of the Queue is
+    given by 'queue_name', else found in the "QUEUE_NAME" environment.
+
+    Parameters
+    ----------
+    bodies : iterable
+        The message bodies (strings) that should be enqueued. This may be a generator,
+        in which case the bodies are sent as they are generated.
+    codec : codec.MessageCodec, optional
+        Encodes each body into the message that is sent. Defaults to the codec configured
+        by the environment (see codec.py).
+    delays : list, optional
+        The "DelaySeconds" of each message, in the same order as the bodies.
+    queue_name : str, optional
+        The name of the Queue (e.g. that of a priority lane, see lanes.py).
+
+    Returns
+    -------
+    list
+        A list of booleans, one per incoming body and in the same order, each of which is
+        True if that body was enqueued and False if it was not.
+    """
+    import botocore.exceptions # loaded here, so that events that aren't split don't load it
+    queue_name = queue_name or os.environ.get("QUEUE_NAME", None)
+    transport = get_transport(queue_name)
+    if not transport:
+        logger.error(f"===> FAIL: unable to find environment variable QUEUE_NAME")
+        return [ False for body in bodies ]
+    results = []
+    try:
+        logger.info(f"===> queueing message(s) to queue '{queue_name}'...")
+        codec = codec or get_message_codec()
+        for batch in batch_messages(codec.encode(body) for body in bodies):
+            results.extend([False] * len(batch))
+            send_message_batch(transport, batch, results, delays)
+    except botocore.exceptions.ClientError as ex:
+        logger.error(f"===> EXCEPTION CAUGHT: while queueing messages to SQS queue named '{queue_name}'")
+        raise ex
+    logger.info(f"===> queued '{sum(results)}' of '{len(results)}' message(s) to queue '{queue_name}'")
+    return results
+
+def copy_event_with_items(event, items):
+    # -*- coding: utf-8 -*-
+    """This method returns a copy of the incoming event in which the embedded list (see
+    get_reference_to_embedded_list()) is replaced by 'items'. Only the dicts on the path
+    down to the list are copied; everything else is shared with the incoming event, so
+    the copy is cheap to make but must not be modified.
+    """
+    event_copy = dict(event)
+    detail = event_copy["detail"] = dict(event_copy.get("detail",{}))
+    request_parameters = detail["requestParameters"] = dict(detail.get("requestParameters",{}))
+    tag_set = request_parameters["tagSet"] = dict(request_parameters.get("tagSet",{}))
+    tag_set["items"] = items
+    return event_copy
+
+def encode_split_events(event, chunks):
+    # -*- coding: utf-8 -*-
+    """This method generates the JSON message body of each smaller event made by replacing
+    the embedded list of the incoming event (see get_reference_to_embedded_list()) with
+    one of the chunks. Rather than copying and serializing the whole event once per
+    chunk, the event is serialized just once, with a placeholder where the list goes,
+    and each chunk's serialized JSON is then spliced into that template.
+
+    Parameters
+    ----------
+    event : dict
+        The incoming dict, with the structure documented in
+        get_reference_to_embedded_list().
+    chunks : iterable
+        The chunks, each a list of items to place in one smaller event.
+
+    Returns
+    -------
+    generator
+        Yields one JSON string per chunk, in the same order as the chunks.
+    """
+    placeholder = json_codec.dumps(ITEMS_PLACEHOLDER)
+    template = json_codec.dumps(copy_event_with_items(event, ITEMS_PLACEHOLDER))
+    if template.count(placeholder) != 1:
+        # the placeholder text also occurs elsewhere in the event, so it can't be used
+        for chunk in chunks:
+            yield json_codec.dumps(copy_event_with_items(event, chunk))
+        return
+    prefix, suffix = template.split(placeholder)
+    for chunk in chunks:
+        yield prefix + json_codec.dumps(chunk) + suffix
+
+def get_split_metadata(event):
+    # -*- coding: utf-8 -*-
+    """This method returns the dict that the splitter recorded in a queued event (under
+    the SPLIT_METADATA_KEY key), or an empty dict if there is none. For example, a range
+    message (see split_policy.py) has the metadata { "range": True, "depth": 1 }, and
+    the messages of a tracked job (see jobs.py) have its "jobId" and "jobTotal".
+    """
+    if not isinstance(event, dict):
+        return {}
+    return event.get(SPLIT_METADATA_KEY, None) or {}
+
+def with_split_metadata(event, **updates):
+    # -*- coding: utf-8 -*-
+    """This method returns a shallow copy of the event, with its split metadata (see
+    get_split_metadata()) updated from the keyword arguments. A keyword argument whose
+    value is None removes that key, and the metadata is left out entirely if it ends up
+    empty.
+    """
+    metadata = dict(get_split_metadata(event), **updates)
+    metadata = { key: value for key, value in metadata.items() if value is not None }
+    event_copy = { key: value for key, value in event.items() if key != SPLIT_METADATA_KEY }
+    if metadata:
+        event_copy[SPLIT_METADATA_KEY] = metadata
+    return event_copy
+
+def route_to_lane(event, fan_out):
+    # -*- coding: utf-8 -*-
+    """This method returns an (event, queue_name) tuple holding the event, with its
+    priority lane recorded in its split metadata, and the name of the lane's queue. The
+    lane already recorded in the event is kept; otherwise the lane is chosen by the lane
+    rules, given the event's 'fan_out' (see lanes.py). Without lanes, the event is
+    returned as it is, with the queue named in the "QUEUE_NAME" environment.
+    """
+    if not has_lanes():
+        return event, os.environ.get("QUEUE_NAME", None)
+    lane = get_split_metadata(event).get("lane", None) or choose_lane(event, fan_out)
+    return with_split_metadata(event, lane=lane), get_lane_queue_name(lane)
+
+def queue_chunks(event, chunks):
+    # -*- coding: utf-8 -*-
+    """This method enqueues to SQS one copy of the incoming event per chunk, each copy
+    having its embedded list (see get_reference_to_embedded_list()) replaced with a list
+    containing just the items of that chunk. The copies are encoded by
+    encode_split_events(), after being projected by the message codec (see codec.py),
+    and streamed into batches as they are encoded (see enqueue_message_bodies()).
+
+    If the tree fan-out is enabled and there are too many chunks (see
+    split_policy.group_chunks_for_tree()), then the chunks are grouped into ranges and
+    one range message is queued per range instead, to be split again by the invocation
+    that receives it. Otherwise, the messages may be delayed to spread them over time
+    (see backpressure.py), and those that can't be paced are held back: they are
+    returned as not queued, without being sent. When job tracking is enabled and the event isn't part of a job
+    yet, a job is started for the items, and the items of the messages that can't be
+    queued are then dropped from it (see jobs.py). The messages are queued in
+    the event's priority lane (see route_to_lane()).
+
+    Parameters
+    ----------
+    event : dict
+        The incoming dict, with the structure documented in
+        get_reference_to_embedded_list().
+    chunks : list
+        A list of chunks, each a list of items to place in one copy of the event.
+
+    Returns
+    -------
+    list
+        A list of (items, queued) tuples, one per queued message, where 'items' is the
+        list of items held by that message and 'queued' is True if it was enqueued.
+    """
+    event, queue_name = route_to_lane(event, sum(len(chunk) for chunk in chunks))
+    metadata = get_split_metadata(event)
+    depth = metadata.get("depth", 0)
+    tracker = get_job_tracker()
+    started_job_id = None
+    if tracker and not metadata.get("jobId", None):
+        total = sum(len(chunk) for chunk in chunks)
+        started_job_id = tracker.start_job(total)
+        event = with_split_metadata(event, jobId=started_job_id, jobTotal=total)
+    ranges = group_chunks_for_tree(chunks, depth)
+    if ranges:
+        logger.info(f"===> queueing '{len(chunks)}' chunk(s) as '{len(ranges)}' range message(s) at depth '{depth + 1}'")
+        chunks = ranges
+        event = with_split_metadata(event, range=True, depth=depth + 1)
+    else:
+        event = with_split_metadata(event, range=None, depth=None)
+    put_metric(METRIC_FAN_OUT_SIZE, len(chunks))
+    codec = get_message_codec()
+    delays = None if ranges else get_fanout_delays(len(chunks))
+    held_back = chunks[len(delays):] if delays is not None else []
+    chunks = chunks[:len(chunks) - len(held_back)]
+    bodies = encode_split_events(codec.project(event), chunks)
+    try:
+        outcomes = list(zip(chunks, enqueue_message_bodies(bodies, codec, delays, queue_name)))
+        outcomes += [ (chunk, False) for chunk in held_back ]
+    except Exception as ex:
+        if started_job_id:
+            record_tags_dropped(started_job_id, [ item for chunk in chunks + held_back for item in chunk ])
+        raise ex
+    if started_job_id:
+        # the job is only for the items that were queued, so that it can complete
+        record_tags_dropped(started_job_id, [ item for chunk, queued in outcomes if not queued for item in chunk ])
+    return outcomes
+
+def queue_smaller_events(event, chunk_size=None, max_cost=None):
     # -*- coding: utf-8 -*-
     """This method takes an event parameter and finds an embedded list of interest inside
-    it. If there is more than 1 item in the list, then this method iteratively enqueues to
-    SQS the same original incoming event, but each time replacing the embedded list with
-    an updated list, containing just one of the items from the original list. Thus this
-    method has the effect of breaking down large events into multiple smaller events and
-    enqueing them.
+    it. The list is broken into chunks by the split policy (see split_policy.py) and, if
+    there is more than 1 chunk, then this method enqueues to SQS one copy of the original
+    incoming event per chunk, each copy having the embedded list replaced with a list
+    containing just the items of that chunk (see queue_chunks()). Thus this method has
+    the effect of breaking down large events into multiple smaller events and enqueing
+    them, in the priority lane of the event (see route_to_lane()).
 
     Parameters
     ----------
@@ -106,16 +369,61 @@ def queue_smaller_events(event):
         get_reference_to_embedded_list() method above. When it has that structure, the
         list found in the "items" key is used as described earlier. If the incoming dict
         does not have the expected structure, this method does nothing.
+    chunk_size : int, optional
+        The maximum number of items per smaller event (see split_policy.chunk_items()).
+    max_cost : float, optional
+        The maximum estimated cost per smaller event (see split_policy.chunk_items()).
+
+    Returns
+    -------
+    list
+        A list of (items, queued) tuples, one per smaller event, where 'items' is the
+        chunk of items held by that event and 'queued' is True if it was enqueued. The
+        list is empty if nothing needed to be enqueued.
     """
-    event_copy = copy.deepcopy(event) # work with a copy, so caller sees no changes
-    list_reference = get_reference_to_embedded_list(event_copy)
-    list_items = list_reference.copy() # iterate through copy of list, as list will be changing
-    if len(list_items) == 1:
-        return
-    for item in list_items:
-        list_reference.clear()
-        list_reference.append(item)
-        enqueue_event(event_copy)
+    chunks = chunk_items(get_reference_to_embedded_list(event), chunk_size, max_cost)
+    if len(chunks) <= 1:
+        return []
+    return queue_chunks(event, chunks)
+
+def get_queue_records(queued_event_message):
+    # -*- coding: utf-8 -*-
+    """This method takes a 'queued_event_message', and if it is an SQS structure (i.e. if
+    it has "Records" whose 'eventSource' is 'aws:sqs'), then it returns the list of those
+    records. Lambda may deliver a batch of several SQS messages in one event, one record
+    per message.
+
+    Parameters
+    ----------
+    queued_event_message : dict
+        This parameter holds the event as read from an SQS Queue.
+
+    Returns
+    -------
+    list
+        The SQS records found in the input parameter, or an empty list if the input
+        parameter is not recognized as an SQS event structure.
+    """
+    if not isinstance(queued_event_message, dict):
+        return []
+    records = queued_event_message.get('Records', None)
+    if not isinstance(records, list) or not records:
+        return []
+    if not all(isinstance(record, dict) and record.get("eventSource",None) == 'aws:sqs' for record in records):
+        return []
+    return records
+
+def decode_queue_record(record):
+    # -*- coding: utf-8 -*-
+    """This method takes one SQS 'record' and returns the JSON encoded in its "body" key,
+    after decoding the body with the message codec (see codec.py), or None if the record
+    has no "body". If the "body" value can't be parsed as JSON, then an exception will
+    be raised (json.JSONDecodeError).
+    """
+    if 'body' not in record:
+        return None
+    body = get_message_codec().decode(record["body"], record.get("messageAttributes", None))
+    return json_codec.loads(body)
 
 def extract_event_from_queue_message(queued_event_message):
     # -*- coding: utf-8 -*-
@@ -145,6 +453,6 @@ def extract_event_from_queue_message(queued_event_message):
         return None
     for record in queued_event_message['Records']:
         if (record.get("eventSource",None) == 'aws:sqs') and 'body' in record:
-            return(json.loads(record["body"].replace("'", '"')))
+            return decode_queue_record(record)
         else:
             return None
@@ -0,0 +1,289 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# SQS delivers each message at least once, and a message is received again whenever an
+# invocation fails, so the same tag may be handed to the Lambda more than once. The
+# idempotency guard makes sure that a tag is processed by just one of its deliveries: a
+# delivery first claims the tag, and skips it if the claim fails, because the tag has
+# already been processed or is being processed by another delivery right now. Once the
+# tag is processed, the claim is marked done; if processing fails, the claim is released,
+# so that the redelivery of the message can claim the tag again. A tag is identified by a
+# hash of the CloudTrail event ID, the resource IDs and the tag's key and value; tags of
+# events without an event ID are never skipped.
+#
+# Claims are kept in an in-memory LRU cache (done) and set (in progress), which last as
+# long as the warm Lambda container, and optionally in a persistent store that is shared
+# by all containers: a DynamoDB table ("IDEMPOTENCY_TABLE") or, for local use, an SQLite
+# file ("IDEMPOTENCY_SQLITE_PATH"). The store claims a tag with a conditional write, so
+# only one of several concurrent deliveries of a tag gets to process it. A claim that is
+# in progress expires after "IDEMPOTENCY_CLAIM_SECONDS" (so that the tag of an invocation
+# that timed out or crashed can be claimed again), and a done one after
+# "IDEMPOTENCY_TTL_SECONDS".
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+DEFAULT_IDEMPOTENCY_TTL_SECONDS   = 3600
+DEFAULT_IDEMPOTENCY_CLAIM_SECONDS = 900 # the longest a Lambda invocation can run
+DEFAULT_IDEMPOTENCY_CACHE_SIZE    = 10000
+
+STATUS_IN_PROGRESS = "IN_PROGRESS"
+STATUS_DONE        = "DONE"
+
+_guard = None
+
+def get_idempotency_key(event, tag):
+    # -*- coding: utf-8 -*-
+    """This method returns a stable key for processing the given tag of the given event,
+    or None if the event has no ID (in which case repeat deliveries can't be detected).
+    """
+    detail = event.get("detail", {})
+    event_id = detail.get("eventID", None) or event.get("id", None)
+    if not event_id:
+        return None
+    resources = detail.get("requestParameters", {}).get("resourcesSet", {}).get("items", [])
+    resource_ids = sorted(resource.get("resourceId", "") for resource in resources if isinstance(resource, dict))
+    identity = json.dumps([ event_id, resource_ids, tag.get("key", None), tag.get("value", None) ])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+class LruCache():
+    """A set of keys, of bounded size, from which the least recently used keys are evicted
+    first, and in which each key expires 'ttl_seconds' after it was added.
+    """
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._expiry_by_key = OrderedDict()
+
+    def __contains__(self, key):
+        expires_at = self._expiry_by_key.get(key, None)
+        if expires_at is None:
+            return False
+        if expires_at < time.time():
+            del self._expiry_by_key[key]
+            return False
+        self._expiry_by_key.move_to_end(key)
+        return True
+
+    def add(self, key):
+        self._expiry_by_key[key] = time.time() + self.ttl_seconds
+        self._expiry_by_key.move_to_end(key)
+        while len(self._expiry_by_key) > self.max_size:
+            self._expiry_by_key.popitem(last=False)
+
+class DictIdempotencyStore():
+    """A persistent store stand-in that keeps its entries in a dict (e.g. for tests)."""
+    def __init__(self):
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, expires_at):
+        with self._lock:
+            entry = self.entries.get(key, None)
+            if entry and entry[1] >= time.time():
+                return False
+            self.entries[key] = (STATUS_IN_PROGRESS, expires_at)
+            return True
+
+    def mark_done(self, key, expires_at):
+        with self._lock:
+            self.entries[key] = (STATUS_DONE, expires_at)
+
+    def release(self, key):
+        with self._lock:
+            if self.entries.get(key, (None,))[0] == STATUS_IN_PROGRESS:
+                del self.entries[key]
+
+class SqliteIdempotencyStore():
+    """A persistent store that keeps its entries in an SQLite database file."""
+    def __init__(self, path):
+        import sqlite3
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS idempotency_claims (key TEXT PRIMARY KEY, status TEXT, expires_at REAL)")
+
+    def claim(self, key, expires_at):
+        with self._lock:
+            self._connection.execute("DELETE FROM idempotency_claims WHERE key = ? AND expires_at < ?", (key, time.time()))
+            cursor = self._connection.execute("INSERT OR IGNORE INTO idempotency_claims VALUES (?, ?, ?)",
+                                              (key, STATUS_IN_PROGRESS, expires_at))
+        return cursor.rowcount == 1
+
+    def mark_done(self, key, expires_at):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO idempotency_claims VALUES (?, ?, ?)", (key, STATUS_DONE, expires_at))
+
+    def release(self, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM idempotency_claims WHERE key = ? AND status = ?", (key, STATUS_IN_PROGRESS))
+
+class DynamoDbIdempotencyStore():
+    """A persistent store that keeps its entries in a DynamoDB table, with a string hash
+    key named "idempotencyKey" and DynamoDB TTL enabled on the "expiresAt" attribute.
+    Tags are claimed with a conditional put, which succeeds for just one of several
+    concurrent deliveries of a tag, so just that one processes it.
+    """
+    def __init__(self, table_name):
+        import boto3
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb")
+
+    def claim(self, key, expires_at):
+        import botocore.exceptions
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={ "idempotencyKey": { "S": key }, "status": { "S": STATUS_IN_PROGRESS }, "expiresAt": { "N": str(int(expires_at)) } },
+                ConditionExpression="attribute_not_exists(idempotencyKey) OR expiresAt < :now",
+                ExpressionAttributeValues={ ":now": { "N": str(int(time.time())) } })
+            return True
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise ex
+
+    def mark_done(self, key, expires_at):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={ "idempotencyKey": { "S": key }, "status": { "S": STATUS_DONE }, "expiresAt": { "N": str(int(expires_at)) } })
+
+    def release(self, key):
+        import botocore.exceptions
+        try:
+            self.client.delete_item(
+                TableName=self.table_name, Key={ "idempotencyKey": { "S": key } },
+                ConditionExpression="#status = :inProgress",
+                ExpressionAttributeNames={ "#status": "status" },
+                ExpressionAttributeValues={ ":inProgress": { "S": STATUS_IN_PROGRESS } })
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise ex
+
+class IdempotencyGuard():
+    """Claims tags before they are processed, in an LRU cache and optionally in a
+    persistent 'store', and counts how many tags were found to be repeats ('hits') or
+    were claimed ('misses').
+    """
+    def __init__(self, store=None, ttl_seconds=DEFAULT_IDEMPOTENCY_TTL_SECONDS, cache_size=DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+                 claim_seconds=DEFAULT_IDEMPOTENCY_CLAIM_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.claim_seconds = claim_seconds
+        self.cache = LruCache(cache_size, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+        self._in_progress = set()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        # -*- coding: utf-8 -*-
+        """This method claims the tag with the given key (see get_idempotency_key()), and
+        returns True if the caller should process it, or False if the tag has already been
+        processed, or is being processed by another delivery.
+        """
+        if key is None:
+            return True
+        with self._lock:
+            if key in self.cache or key in self._in_progress:
+                self.hits += 1
+                return False
+            self._in_progress.add(key)
+        try:
+            claimed = not self.store or self.store.claim(key, time.time() + self.claim_seconds)
+        except Exception:
+            with self._lock:
+                self._in_progress.discard(key)
+            raise
+        with self._lock:
+            if claimed:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._in_progress.discard(key)
+        return claimed
+
+    def mark_done(self, key):
+        # -*- coding: utf-8 -*-
+        """This method records that the claimed tag with the given key has been processed.
+        A failure to record it in the store is logged rather than raised, as the tag was
+        processed: its claim then expires, after which a repeat delivery would process it
+        again.
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._in_progress.discard(key)
+            self.cache.add(key)
+        if self.store:
+            try:
+                self.store.mark_done(key, time.time() + self.ttl_seconds)
+            except Exception:
+                logger.exception(f"===> EXCEPTION CAUGHT: while marking tag with idempotency key '{key}' as done")
+
+    def release(self, key):
+        # -*- coding: utf-8 -*-
+        """This method gives up the claim on the tag with the given key (because processing
+        it failed), so that a redelivery can claim it again. A failure to release it in the
+        store is logged rather than raised: the claim then expires instead.
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._in_progress.discard(key)
+        if self.store:
+            try:
+                self.store.release(key)
+            except Exception:
+                logger.exception(f"===> EXCEPTION CAUGHT: while releasing the claim on tag with idempotency key '{key}'")
+
+    def stats(self):
+        return { "hits": self.hits, "misses": self.misses }
+
+def get_idempotency_guard():
+    # -*- coding: utf-8 -*-
+    """This method returns the IdempotencyGuard configured by the environment variables
+    described at the top of this file, creating it the first time it is needed, so that
+    its cache lasts as long as the warm Lambda container.
+    """
+    global _guard
+    if _guard is None:
+        store = None
+        if os.environ.get("IDEMPOTENCY_TABLE", None):
+            store = DynamoDbIdempotencyStore(os.environ["IDEMPOTENCY_TABLE"])
+        elif os.environ.get("IDEMPOTENCY_SQLITE_PATH", None):
+            store = SqliteIdempotencyStore(os.environ["IDEMPOTENCY_SQLITE_PATH"])
+        _guard = IdempotencyGuard(store,
+            ttl_seconds=int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", None) or DEFAULT_IDEMPOTENCY_TTL_SECONDS),
+            cache_size=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", None) or DEFAULT_IDEMPOTENCY_CACHE_SIZE),
+            claim_seconds=int(os.environ.get("IDEMPOTENCY_CLAIM_SECONDS", None) or DEFAULT_IDEMPOTENCY_CLAIM_SECONDS))
+    return _guard
+
+def reset_idempotency_guard():
+    # -*- coding: utf-8 -*-
+    """This method discards the IdempotencyGuard, and everything it remembers (e.g.
+    between tests).
+    """
+    global _guard
+    _guard = None
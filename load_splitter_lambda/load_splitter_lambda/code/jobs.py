@@ -0,0 +1,359 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+
+# Job tracking records when all the tags of a split event have been processed. When an
+# event is first split, the splitter starts a job, and records its "jobId" and "jobTotal"
+# (the number of tags queued) in the split metadata of every message it queues, which is
+# passed on when those messages are split again (by a tree fan-out or at a deadline).
+# Each tag processed from such a message decrements the job's counter of remaining tags,
+# atomically, in a job store shared by all containers. The invocation that brings the
+# counter to 0 emits the completion event, which holds the job's makespan (from the split
+# to the last tag done) and its slowest sub-task (the slowest tag or coalesced unit).
+#
+# Tags are counted rather than messages, as the number of messages of a job isn't known
+# when it starts. Each tag is counted at most once, however often it is delivered: the
+# job store marks the tags it has counted, with a conditional write per tag, and only
+# decrements the counter for those it marks first. A tag whose repeat delivery is
+# skipped (see idempotency.py) is not counted either.
+#
+# The job is started before its messages are queued, as they carry its ID. The tags of
+# the messages that can't be queued are then dropped from the job, which takes them off
+# its total as well as its counter, so that the job still completes once the tags that
+# were queued are done.
+#
+# Jobs are tracked when a job store is configured: a DynamoDB table ("JOB_TABLE") or, for
+# local use, an SQLite file ("JOB_SQLITE_PATH", which may be ":memory:"). Jobs expire after
+# "JOB_TTL_SECONDS". The completion event is always logged and published as the
+# JobMakespan metric, and is also sent to the EventBridge bus named by "JOB_EVENT_BUS" (if
+# set), to trigger follow-up work.
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from telemetry import METRIC_JOB_MAKESPAN, StructuredMessage, put_metric
+
+logger = logging.getLogger()
+
+DEFAULT_JOB_TTL_SECONDS = 24 * 3600
+
+JOB_COMPLETED_SOURCE      = "load-splitter"
+JOB_COMPLETED_DETAIL_TYPE = "Load Splitter Job Completed"
+
+_tracker = None
+_events_client = None
+
+class DictJobStore():
+    """A job store stand-in that keeps its jobs in a dict (e.g. for tests)."""
+    def __init__(self):
+        self.jobs = {}
+        self.tag_ids = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, total, created_at, expires_at):
+        with self._lock:
+            self.jobs[job_id] = { "jobId": job_id, "total": total, "remaining": total, "createdAt": created_at,
+                                  "expiresAt": expires_at, "slowestSeconds": 0.0, "slowestSubTask": None }
+            self.tag_ids[job_id] = set()
+
+    def decrement(self, job_id, tag_ids, seconds, sub_task, dropped=False):
+        with self._lock:
+            job = self.jobs.get(job_id, None)
+            if not job or job["expiresAt"] < time.time():
+                return None, 0
+            counted = set(tag_ids) - self.tag_ids[job_id]
+            self.tag_ids[job_id] |= counted
+            job["remaining"] -= len(counted)
+            if dropped:
+                job["total"] -= len(counted)
+            if seconds > job["slowestSeconds"]:
+                job["slowestSeconds"], job["slowestSubTask"] = seconds, sub_task
+            return dict(job), len(counted)
+
+class SqliteJobStore():
+    """A job store that keeps its jobs in an SQLite database file, which may be shared by
+    several processes (e.g. the workers of local_runner.py).
+    """
+    COLUMNS = ("jobId", "total", "remaining", "createdAt", "expiresAt", "slowestSeconds", "slowestSubTask")
+
+    def __init__(self, path):
+        import sqlite3
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, total INTEGER, remaining INTEGER, "
+                                 "created_at REAL, expires_at REAL, slowest_seconds REAL, slowest_sub_task TEXT)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS job_tags (job_id TEXT, tag_id TEXT, PRIMARY KEY (job_id, tag_id))")
+
+    def create(self, job_id, total, created_at, expires_at):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, 0.0, NULL)",
+                                     (job_id, total, total, created_at, expires_at))
+
+    def decrement(self, job_id, tag_ids, seconds, sub_task, dropped=False):
+        sub_task = json.dumps(sub_task)
+        with self._lock:
+            # the transaction makes the update and the read atomic, across processes too
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT 1 FROM jobs WHERE job_id = ? AND expires_at >= ?", (job_id, time.time())).fetchone()
+                if not row:
+                    return None, 0
+                count = 0
+                for tag_id in set(tag_ids):
+                    count += self._connection.execute("INSERT OR IGNORE INTO job_tags VALUES (?, ?)", (job_id, tag_id)).rowcount
+                self._connection.execute(
+                    "UPDATE jobs SET remaining = remaining - ?, total = total - ?, "
+                    "slowest_sub_task = CASE WHEN ? > slowest_seconds THEN ? ELSE slowest_sub_task END, "
+                    "slowest_seconds = MAX(slowest_seconds, ?) WHERE job_id = ? AND expires_at >= ?",
+                    (count, count if dropped else 0, seconds, sub_task, seconds, job_id, time.time()))
+                row = self._connection.execute("SELECT * FROM jobs WHERE job_id = ? AND expires_at >= ?", (job_id, time.time())).fetchone()
+            finally:
+                self._connection.execute("COMMIT")
+        if not row:
+            return None, 0
+        job = dict(zip(self.COLUMNS, row))
+        job["slowestSubTask"] = json.loads(job["slowestSubTask"]) if job["slowestSubTask"] else None
+        return job, count
+
+class DynamoDbJobStore():
+    """A job store that keeps its jobs in a DynamoDB table, with a string hash key named
+    "jobId" and DynamoDB TTL enabled on the "expiresAt" attribute. Each tag counted is
+    marked by an item of its own ("<jobId>#<tagId>"), put on condition that it doesn't
+    exist yet. The counter is then decremented by the number of tags marked, with an
+    atomic update which returns the job as updated, so exactly one invocation sees the
+    counter reach 0.
+    """
+    def __init__(self, table_name):
+        import boto3
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb")
+
+    def create(self, job_id, total, created_at, expires_at):
+        self.client.put_item(TableName=self.table_name, Item={
+            "jobId": { "S": job_id }, "total": { "N": str(total) }, "remaining": { "N": str(total) },
+            "createdAt": { "N": repr(created_at) }, "expiresAt": { "N": str(int(expires_at)) },
+            "slowestSeconds": { "N": "0" } })
+
+    def decrement(self, job_id, tag_ids, seconds, sub_task, dropped=False):
+        import botocore.exceptions
+        key = { "jobId": { "S": job_id } }
+        item = self.client.get_item(TableName=self.table_name, Key=key, ProjectionExpression="expiresAt").get("Item", None)
+        if not item:
+            return None, 0 # the job is unknown, or has expired
+        count = 0
+        for tag_id in set(tag_ids):
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={ "jobId": { "S": f"{job_id}#{tag_id}" }, "expiresAt": item["expiresAt"] },
+                    ConditionExpression="attribute_not_exists(jobId)")
+                count += 1
+            except botocore.exceptions.ClientError as ex:
+                if ex.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise ex
+        try:
+            # record the sub-task first, so that the decrement that completes the job reads it
+            self.client.update_item(
+                TableName=self.table_name, Key=key,
+                UpdateExpression="SET slowestSeconds = :seconds, slowestSubTask = :subTask",
+                ConditionExpression="attribute_exists(jobId) AND slowestSeconds < :seconds",
+                ExpressionAttributeValues={ ":seconds": { "N": repr(seconds) }, ":subTask": { "S": json.dumps(sub_task) } })
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise ex
+        try:
+            item = self.client.update_item(
+                TableName=self.table_name, Key=key,
+                UpdateExpression="ADD remaining :minus, total :dropped",
+                ConditionExpression="attribute_exists(jobId)",
+                ExpressionAttributeValues={ ":minus": { "N": str(-count) }, ":dropped": { "N": str(-count if dropped else 0) } },
+                ReturnValues="ALL_NEW")["Attributes"]
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return None, 0 # the job has expired
+            raise ex
+        return {
+            "jobId":          job_id,
+            "total":          int(item["total"]["N"]),
+            "remaining":      int(item["remaining"]["N"]),
+            "createdAt":      float(item["createdAt"]["N"]),
+            "expiresAt":      int(item["expiresAt"]["N"]),
+            "slowestSeconds": float(item["slowestSeconds"]["N"]),
+            "slowestSubTask": json.loads(item["slowestSubTask"]["S"]) if "slowestSubTask" in item else None,
+        }, count
+
+class JobTracker():
+    """Starts jobs, and counts down their remaining tags, in a job 'store'."""
+    def __init__(self, store, ttl_seconds=DEFAULT_JOB_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def start_job(self, total):
+        # -*- coding: utf-8 -*-
+        """This method starts a job of 'total' tags, and returns its ID."""
+        import uuid
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.store.create(job_id, total, now, now + self.ttl_seconds)
+        logger.info(StructuredMessage("===> started job", jobId=job_id, total=total))
+        return job_id
+
+    def record_done(self, job_id, tag_ids, seconds, sub_task):
+        # -*- coding: utf-8 -*-
+        """This method records that the tags of the job with the given IDs (see
+        get_tag_id()) are done, by a sub-task (e.g. the list of the tags' keys) that took
+        'seconds', and returns the completion event if this completed the job, or None
+        otherwise. Tags that were already recorded as done are not counted again.
+        """
+        job, count = self.store.decrement(job_id, tag_ids, seconds, sub_task)
+        return self.get_completion(job, count)
+
+    def drop_tags(self, job_id, tag_ids):
+        # -*- coding: utf-8 -*-
+        """This method takes the tags of the job with the given IDs off the job's total,
+        as they won't be processed as part of it (e.g. they couldn't be queued), and
+        returns the completion event if the job's other tags were all done already, or
+        None otherwise.
+        """
+        job, count = self.store.decrement(job_id, tag_ids, 0.0, None, dropped=True)
+        logger.info(StructuredMessage("===> dropped tags from job", jobId=job_id, tags=count))
+        return self.get_completion(job, count)
+
+    def get_completion(self, job, count):
+        # -*- coding: utf-8 -*-
+        """This method returns the completion event of the 'job' as returned by the store,
+        if counting 'count' more of its tags completed it, or None otherwise.
+        """
+        if not job or count <= 0 or job["remaining"] > 0 or job["remaining"] + count <= 0 or job["total"] <= 0:
+            return None # still running, expired, repeated, already completed, or empty
+        job_id = job["jobId"]
+        completed_at = time.time()
+        return {
+            "jobId":           job_id,
+            "total":           job["total"],
+            "startedAt":       format_timestamp(job["createdAt"]),
+            "completedAt":     format_timestamp(completed_at),
+            "makespanSeconds": round(completed_at - job["createdAt"], 3),
+            "slowestSubTask":  { "tags": job["slowestSubTask"], "seconds": round(job["slowestSeconds"], 3) },
+        }
+
+def get_tag_id(tag):
+    # -*- coding: utf-8 -*-
+    """This method returns the ID of a tag within its job. As all the tags of a job come
+    from one event, and apply to the same resources, the tag's key and value identify it.
+    """
+    identity = json.dumps([ tag.get("key", None), tag.get("value", None) ])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+def format_timestamp(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat()
+
+def get_job_tracker():
+    # -*- coding: utf-8 -*-
+    """This method returns the JobTracker configured by the environment variables
+    described at the top of this file, or None if no job store is configured.
+    """
+    global _tracker
+    if _tracker is None:
+        if os.environ.get("JOB_TABLE", None):
+            store = DynamoDbJobStore(os.environ["JOB_TABLE"])
+        elif os.environ.get("JOB_SQLITE_PATH", None):
+            store = SqliteJobStore(os.environ["JOB_SQLITE_PATH"])
+        else:
+            return None
+        _tracker = JobTracker(store, ttl_seconds=int(os.environ.get("JOB_TTL_SECONDS", None) or DEFAULT_JOB_TTL_SECONDS))
+    return _tracker
+
+def reset_job_tracker():
+    # -*- coding: utf-8 -*-
+    """This method discards the JobTracker and the EventBridge client (e.g. between tests)."""
+    global _tracker, _events_client
+    _tracker = None
+    _events_client = None
+
+def record_tags_done(job_id, tags, seconds):
+    # -*- coding: utf-8 -*-
+    """This method records that the given tags of a job were processed, as one sub-task
+    that took 'seconds', and emits the completion event if that completed the job. It
+    does nothing for tags that are not part of a job ('job_id' of None), or when no job
+    store is configured. Errors are logged rather than raised, as the tags were processed.
+
+    Returns
+    -------
+    dict
+        The completion event, or None if the job didn't complete.
+    """
+    tracker = get_job_tracker() if job_id else None
+    if not tracker:
+        return None
+    try:
+        completion = tracker.record_done(job_id, [ get_tag_id(tag) for tag in tags ], seconds, [ tag.get("key", None) for tag in tags ])
+        if completion:
+            emit_job_completed(completion)
+        return completion
+    except Exception:
+        logger.exception(StructuredMessage("===> EXCEPTION CAUGHT: while recording the progress of a job", jobId=job_id))
+        return None
+
+def record_tags_dropped(job_id, tags):
+    # -*- coding: utf-8 -*-
+    """This method drops the given tags from a job (see JobTracker.drop_tags()), and emits
+    the completion event if that completed the job. Like record_tags_done(), it does
+    nothing without a job or a job store, and logs errors rather than raising them.
+
+    Returns
+    -------
+    dict
+        The completion event, or None if the job didn't complete.
+    """
+    tracker = get_job_tracker() if job_id else None
+    if not tracker or not tags:
+        return None
+    try:
+        completion = tracker.drop_tags(job_id, [ get_tag_id(tag) for tag in tags ])
+        if completion:
+            emit_job_completed(completion)
+        return completion
+    except Exception:
+        logger.exception(StructuredMessage("===> EXCEPTION CAUGHT: while dropping tags from a job", jobId=job_id))
+        return None
+
+def emit_job_completed(completion):
+    # -*- coding: utf-8 -*-
+    """This method logs the completion event, publishes the job's makespan as a metric,
+    and sends the event to the EventBridge bus named by "JOB_EVENT_BUS", if set.
+    """
+    global _events_client
+    logger.info(StructuredMessage("===> JOB COMPLETED", **completion))
+    put_metric(METRIC_JOB_MAKESPAN, completion["makespanSeconds"] * 1000)
+    event_bus = os.environ.get("JOB_EVENT_BUS", None)
+    if not event_bus:
+        return
+    if _events_client is None:
+        import boto3
+        _events_client = boto3.client("events")
+    response = _events_client.put_events(Entries=[ {
+        "Source": JOB_COMPLETED_SOURCE, "DetailType": JOB_COMPLETED_DETAIL_TYPE,
+        "Detail": json.dumps(completion), "EventBusName": event_bus } ])
+    if response.get("FailedEntryCount", 0):
+        logger.error(StructuredMessage("===> FAIL: unable to send the job completion event", jobId=completion["jobId"], entries=response.get("Entries")))
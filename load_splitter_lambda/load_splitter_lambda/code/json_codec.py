@@ -0,0 +1,99 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The JSON codec serializes the events that are queued and parses the messages that are
+# received. It uses orjson (https://github.com/ijl/orjson) when that library is
+# installed, which is several times faster than the standard library on CloudTrail
+# events, and falls back to the standard "json" module otherwise. The "JSON_CODEC"
+# environment variable ("orjson" or "json") overrides the choice.
+#
+# Both implementations produce the same compact JSON (no whitespace, non-ASCII characters
+# left as they are), so that the message sizes don't depend on which one is used, and
+# both raise json.JSONDecodeError (or a subclass of it) for invalid JSON.
+
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger()
+
+class StdlibJsonCodec():
+    """Serializes and parses JSON with the standard "json" module."""
+    name = "json"
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+    def loads(self, text):
+        return json.loads(text)
+
+class OrjsonCodec():
+    """Serializes and parses JSON with orjson."""
+    name = "orjson"
+
+    def dumps(self, value):
+        return orjson.dumps(value).decode("utf-8")
+
+    def loads(self, text):
+        return orjson.loads(text)
+
+_codecs = {}
+
+def get_json_codec(name=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the JSON codec to use.
+
+    Parameters
+    ----------
+    name : str, optional
+        "orjson" or "json". Defaults to the value of the "JSON_CODEC" environment
+        variable, else to "orjson" if orjson is installed and "json" if it isn't.
+
+    Returns
+    -------
+    StdlibJsonCodec or OrjsonCodec
+        The codec, which is created once and then reused.
+    """
+    name = (name or os.environ.get("JSON_CODEC", None) or ("orjson" if orjson else "json")).lower()
+    if name not in _codecs:
+        if name == "orjson":
+            if orjson is None:
+                raise ValueError("JSON codec 'orjson' was requested, but orjson is not installed")
+            _codecs[name] = OrjsonCodec()
+        elif name == "json":
+            _codecs[name] = StdlibJsonCodec()
+        else:
+            raise ValueError(f"unknown JSON codec '{name}'")
+    return _codecs[name]
+
+def dumps(value):
+    # -*- coding: utf-8 -*-
+    """This method returns 'value' serialized as a JSON string, by the configured codec."""
+    return get_json_codec().dumps(value)
+
+def loads(text):
+    # -*- coding: utf-8 -*-
+    """This method returns the value parsed from the JSON string 'text', by the configured
+    codec. The text is parsed as it is, so it must be valid JSON.
+    """
+    return get_json_codec().loads(text)
@@ -0,0 +1,118 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+
+# Priority lanes keep small, interactive events from waiting behind the messages of a very
+# large one. Each lane has a queue of its own, polled by its own event source mapping, so
+# a bulk split only ever delays the other messages of its lane. The queue named by
+# "QUEUE_NAME" is the "default" lane, and the other lanes' queues are named by the
+# "LANE_QUEUES" environment variable, which holds a JSON object such as
+# '{"bulk": "my_bulk_queue"}'.
+#
+# An event is assigned to a lane by the rules in the "LANE_RULES" environment variable, a
+# JSON list such as '[{"lane": "bulk", "minFanOut": 100}]'. The first rule whose
+# conditions all hold wins, and events matching no rule go to the default lane. A rule
+# may have these conditions:
+#
+#   - "minFanOut" / "maxFanOut": bounds on the number of tags of the event being split
+#   - "eventSource" / "eventName": shell-style patterns (e.g. "ec2.*") matched against the
+#     CloudTrail event's source and name
+#   - "tagKeyPattern": a shell-style pattern matched against the key of any of its tags
+#
+# A lane is chosen once, when an event is first queued, and recorded in the split
+# metadata of its messages, so that range messages and the tags spilled at a deadline stay
+# in the lane of the event they came from.
+
+import fnmatch
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+DEFAULT_LANE = "default"
+
+RULE_CONDITIONS = ("minFanOut", "maxFanOut", "eventSource", "eventName", "tagKeyPattern")
+
+def get_lane_queues():
+    # -*- coding: utf-8 -*-
+    """This method returns a dict of the queue name of each lane, from the "QUEUE_NAME"
+    and "LANE_QUEUES" environment variables (see the top of this file).
+    """
+    lane_queues = { DEFAULT_LANE: os.environ.get("QUEUE_NAME", None) }
+    lane_queues.update(json.loads(os.environ.get("LANE_QUEUES", None) or "{}"))
+    return lane_queues
+
+def get_lane_rules():
+    # -*- coding: utf-8 -*-
+    """This method returns the list of rules in the "LANE_RULES" environment variable,
+    having checked that each names a lane and has only known conditions.
+    """
+    rules = json.loads(os.environ.get("LANE_RULES", None) or "[]")
+    for rule in rules:
+        unknown = set(rule) - set(RULE_CONDITIONS) - { "lane" }
+        if not rule.get("lane", None) or unknown:
+            raise ValueError(f"invalid lane rule '{rule}' (unknown conditions: {sorted(unknown)})")
+    return rules
+
+def rule_matches(rule, event, fan_out):
+    # -*- coding: utf-8 -*-
+    """This method returns True if all the conditions of the 'rule' hold for the 'event',
+    which has 'fan_out' tags to split.
+    """
+    detail = event.get("detail", {}) if isinstance(event, dict) else {}
+    if "minFanOut" in rule and fan_out < rule["minFanOut"]:
+        return False
+    if "maxFanOut" in rule and fan_out > rule["maxFanOut"]:
+        return False
+    for condition, field in (("eventSource", "eventSource"), ("eventName", "eventName")):
+        if condition in rule and not fnmatch.fnmatchcase(str(detail.get(field, "")), rule[condition]):
+            return False
+    if "tagKeyPattern" in rule:
+        tags = detail.get("requestParameters", {}).get("tagSet", {}).get("items", [])
+        if not any(isinstance(tag, dict) and fnmatch.fnmatchcase(str(tag.get("key", "")), rule["tagKeyPattern"]) for tag in tags):
+            return False
+    return True
+
+def choose_lane(event, fan_out):
+    # -*- coding: utf-8 -*-
+    """This method returns the lane of the event, which has 'fan_out' tags to split, by
+    the rules described at the top of this file. A rule naming a lane that has no queue is
+    logged and skipped.
+    """
+    lane_queues = get_lane_queues()
+    for rule in get_lane_rules():
+        if not rule_matches(rule, event, fan_out):
+            continue
+        if rule["lane"] in lane_queues:
+            return rule["lane"]
+        logger.error(f"===> FAIL: lane rule names lane '{rule['lane']}', which has no queue in LANE_QUEUES")
+    return DEFAULT_LANE
+
+def get_lane_queue_name(lane):
+    # -*- coding: utf-8 -*-
+    """This method returns the name of the queue of the lane, falling back to the default
+    lane's queue for an unknown lane.
+    """
+    lane_queues = get_lane_queues()
+    return lane_queues.get(lane, None) or lane_queues[DEFAULT_LANE]
+
+def has_lanes():
+    # -*- coding: utf-8 -*-
+    """This method returns True if there are lanes other than the default one."""
+    return len(get_lane_queues()) > 1
@@ -0,0 +1,103 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The local executor lets one Lambda invocation process several tags at the same time,
+# using a bounded pool of threads. This suits tag processing that mostly waits on other
+# AWS APIs. It is enabled by setting "LOCAL_MAX_WORKERS" to the size of the pool.
+
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger()
+
+DEFAULT_LOCAL_MAX_WORKERS    = 0    # 0 disables the local executor
+DEFAULT_LOCAL_BUDGET_SECONDS = 20.0
+
+# the outcome of processing one tag: either 'result' holds the value returned by the
+# processing function, or 'exception' holds the exception that it raised
+TagResult = namedtuple("TagResult", ["tag", "result", "exception"])
+
+def get_local_max_workers(max_workers=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the number of threads in the local pool: the 'max_workers'
+    argument if given, else the "LOCAL_MAX_WORKERS" environment variable, else
+    DEFAULT_LOCAL_MAX_WORKERS. A value of 0 means that the local executor is disabled.
+    """
+    if max_workers is None:
+        max_workers = os.environ.get("LOCAL_MAX_WORKERS", None) or DEFAULT_LOCAL_MAX_WORKERS
+    return max(0, int(max_workers))
+
+def get_local_budget_seconds(budget_seconds=None):
+    # -*- coding: utf-8 -*-
+    """This method returns how long the local pool may keep starting new tags: the
+    'budget_seconds' argument if given, else the "LOCAL_BUDGET_SECONDS" environment
+    variable, else DEFAULT_LOCAL_BUDGET_SECONDS.
+    """
+    if budget_seconds is None:
+        budget_seconds = os.environ.get("LOCAL_BUDGET_SECONDS", None) or DEFAULT_LOCAL_BUDGET_SECONDS
+    return max(0.0, float(budget_seconds))
+
+def process_tags_locally(tags, process_tag, max_workers=None, budget_seconds=None):
+    # -*- coding: utf-8 -*-
+    """This method runs 'process_tag' on each of the 'tags' using a bounded thread pool.
+    Tags that have not been started when the budget runs out are not processed, and are
+    returned so that the caller can hand them to SQS instead. Tags that were already
+    started when the budget runs out are allowed to finish.
+
+    Parameters
+    ----------
+    tags : list
+        The tags to be processed.
+    process_tag : function
+        Called with one tag at a time, from one of the pool's threads.
+    max_workers : int, optional
+        The number of threads in the pool (see get_local_max_workers()). At least 1
+        thread is always used.
+    budget_seconds : float, optional
+        How long to wait for the tags to be processed (see get_local_budget_seconds()).
+
+    Returns
+    -------
+    tuple
+        A (results, spilled) tuple, where 'results' is a list of TagResult, one per tag
+        that was processed, and 'spilled' is the list of tags that were not processed.
+        Both lists keep the original order of the tags.
+    """
+    max_workers = max(1, get_local_max_workers(max_workers))
+    budget_seconds = get_local_budget_seconds(budget_seconds)
+    results = []
+    spilled = []
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [ (tag, executor.submit(process_tag, tag)) for tag in tags ]
+        wait([ future for tag, future in futures ], timeout=budget_seconds)
+        for tag, future in futures:
+            if future.cancel(): # only succeeds for tags that have not been started
+                spilled.append(tag)
+    finally:
+        executor.shutdown(wait=True)
+    for tag, future in futures:
+        if future.cancelled():
+            continue
+        exception = future.exception()
+        results.append(TagResult(tag, None if exception else future.result(), exception))
+    if spilled:
+        logger.info(f"===> local pool ran out of budget with '{len(spilled)}' of '{len(tags)}' tag(s) not started")
+    return results, spilled
@@ -0,0 +1,237 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The local runner runs the load splitter outside of AWS, e.g. in batch jobs on
+# multi-core hosts, or offline. Each event is handed to the Lambda handler, and the
+# messages it queues are handed back to the handler, in batches of SQS records, until no
+# message is left, just as Lambda does with the SQS queue. The messages are either kept
+# in memory and handled in this process ('processes' of 0), or put on a multiprocessing
+# queue and handled by a pool of worker processes, one per core by default (see the
+# local backends in transport.py). Priority lanes (see lanes.py) each get a queue of their
+# own in memory, the default lane's being drained first, while the worker processes share
+# one queue for all the lanes.
+#
+# To run it, execute it from the parent directory where your lambda code resides, with a
+# file holding one event (or a list of events) as JSON:
+#   python load_splitter_lambda/code/local_runner.py events.json --processes 4
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from lanes import get_lane_queues
+from transport import (InProcessTransport, MultiprocessingTransport, handle_records, install_transport,
+                       receive_again, reset_transports)
+
+logger = logging.getLogger()
+
+DEFAULT_LOCAL_QUEUE_NAME = "local"
+WORKER_POLL_SECONDS      = 0.1
+
+def get_handler():
+    # -*- coding: utf-8 -*-
+    """This method returns the Lambda handler (imported here, so that worker processes
+    import it themselves).
+    """
+    from main import lambda_handler
+    return lambda_handler
+
+def get_local_queue_names():
+    # -*- coding: utf-8 -*-
+    """This method returns the names of the queues of every priority lane, the default
+    lane's first, without repeats.
+    """
+    return list(dict.fromkeys(queue_name for queue_name in get_lane_queues().values() if queue_name))
+
+def run_worker(queue_names, tasks, dead_letters, batch_size, max_receives):
+    # -*- coding: utf-8 -*-
+    """This method is the loop of one worker process: it takes batches of records from the
+    'tasks' queue, and hands them to the handler, until it takes None from the queue.
+    Failed records are put back on the queue, or on the 'dead_letters' queue once they
+    have been received 'max_receives' times. Each record is marked done only after the
+    messages that handling it queued have been put on the queue, so that the queue is
+    only ever joined once all the work is done.
+    """
+    reset_transports()
+    for queue_name in queue_names:
+        install_transport(MultiprocessingTransport(queue_name, tasks))
+    handler = get_handler()
+    stopping = False
+    while not stopping:
+        record = tasks.get()
+        if record is None:
+            tasks.task_done()
+            return
+        batch = [ record ]
+        while len(batch) < batch_size:
+            try:
+                record = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if record is None:
+                tasks.task_done()
+                stopping = True
+                break
+            batch.append(record)
+        for record in handle_records(handler, batch):
+            if int(record["attributes"]["ApproximateReceiveCount"]) >= max_receives:
+                dead_letters.put(record)
+            else:
+                tasks.put(receive_again(record))
+        for record in batch:
+            tasks.task_done()
+
+def wait_for_workers(tasks, workers):
+    # -*- coding: utf-8 -*-
+    """This method waits until every task has been done, checking that the worker
+    processes are still running meanwhile, as the tasks would never be done otherwise.
+
+    Raises
+    ------
+    RuntimeError
+        If a worker process exits before every task has been done.
+    """
+    waiter = threading.Thread(target=tasks.join, daemon=True)
+    waiter.start()
+    while waiter.is_alive():
+        waiter.join(WORKER_POLL_SECONDS)
+        exited = [ worker for worker in workers if not worker.is_alive() ]
+        if exited and waiter.is_alive():
+            exit_codes = [ worker.exitcode for worker in exited ]
+            logger.error(f"===> FAIL: '{len(exited)}' worker process(es) exited early, with exit code(s) {exit_codes}")
+            raise RuntimeError(f"'{len(exited)}' worker process(es) exited before all the messages were handled, with exit code(s) {exit_codes}")
+
+def run_locally(events, processes=None, batch_size=10, max_receives=3, queue_name=None, start_method=None):
+    # -*- coding: utf-8 -*-
+    """This method runs the load splitter on the given events, as described at the top of
+    this file, and returns when every message they gave rise to has been handled.
+
+    Parameters
+    ----------
+    events : list
+        The events to hand to the handler (e.g. CloudTrail CreateTags events).
+    processes : int, optional
+        The number of worker processes, or 0 to handle the messages in this process.
+        Defaults to the number of CPUs.
+    batch_size : int, optional
+        The maximum number of records handed to the handler at once.
+    max_receives : int, optional
+        The number of times a failed message is handled before it is given up on.
+    queue_name : str, optional
+        The name of the queue. Defaults to "QUEUE_NAME", else DEFAULT_LOCAL_QUEUE_NAME.
+    start_method : str, optional
+        The multiprocessing start method ("fork", "spawn" or "forkserver").
+
+    Returns
+    -------
+    dict
+        "events" and "seconds": the number of events and the time taken to run them, and
+        "deadLetters": the records of the messages that were given up on.
+
+    Raises
+    ------
+    RuntimeError
+        If a worker process exits before all the messages have been handled.
+    """
+    # the handler (and the worker processes) read the queue name from the environment,
+    # which is restored afterwards, along with the transports
+    previous_queue_name = os.environ.get("QUEUE_NAME", None)
+    os.environ["QUEUE_NAME"] = queue_name or previous_queue_name or DEFAULT_LOCAL_QUEUE_NAME
+    try:
+        return run_events(events, processes, batch_size, max_receives, start_method)
+    finally:
+        reset_transports()
+        if previous_queue_name is None:
+            os.environ.pop("QUEUE_NAME", None)
+        else:
+            os.environ["QUEUE_NAME"] = previous_queue_name
+
+def run_events(events, processes, batch_size, max_receives, start_method):
+    # -*- coding: utf-8 -*-
+    """This method runs the events for run_locally(), once "QUEUE_NAME" is set. The
+    transports it installs are left for run_locally() to reset.
+    """
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    handler = get_handler()
+    started = time.perf_counter()
+    queue_names = get_local_queue_names()
+    if processes <= 0:
+        transports = [ install_transport(InProcessTransport(name)) for name in queue_names ]
+        for event in events:
+            handler(event, None)
+            while any(transport.records for transport in transports):
+                for transport in transports:
+                    transport.drain(handler, batch_size, max_receives)
+        dead_letters = [ record for transport in transports for record in transport.dead_letters ]
+    else:
+        context = multiprocessing.get_context(start_method)
+        tasks = context.JoinableQueue()
+        dead_letter_queue = context.Queue()
+        workers = [ context.Process(target=run_worker, args=(queue_names, tasks, dead_letter_queue, batch_size, max_receives), daemon=True)
+                    for i in range(processes) ]
+        for worker in workers:
+            worker.start()
+        try:
+            for name in queue_names:
+                install_transport(MultiprocessingTransport(name, tasks))
+            for event in events:
+                handler(event, None)
+            wait_for_workers(tasks, workers)
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    tasks.put(None)
+            for worker in workers:
+                worker.join()
+        dead_letters = []
+        while True:
+            try:
+                dead_letters.append(dead_letter_queue.get(timeout=0.1))
+            except queue.Empty:
+                break
+    seconds = time.perf_counter() - started
+    logger.info(f"===> ran '{len(events)}' event(s) locally in '{seconds:.2f}' seconds, giving up on '{len(dead_letters)}' message(s)")
+    return { "events": len(events), "seconds": seconds, "deadLetters": dead_letters }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the load splitter locally on events read from a JSON file")
+    parser.add_argument("events_file",                         help="file holding one event, or a list of events, as JSON")
+    parser.add_argument("--processes",    type=int, default=None, help="number of worker processes (0 to run in this process)")
+    parser.add_argument("--batch-size",   type=int, default=10,   help="maximum number of records per handler call")
+    parser.add_argument("--max-receives", type=int, default=3,    help="number of times a failing message is handled")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with open(args.events_file, encoding="utf-8") as events_file:
+        events = json.load(events_file)
+    out = run_locally(events if isinstance(events, list) else [ events ], args.processes, args.batch_size, args.max_receives)
+    print(json.dumps({ "events": out["events"], "seconds": out["seconds"], "deadLetters": len(out["deadLetters"]) }))
+    return 1 if out["deadLetters"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,24 +16,89 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #######################################################################################
 
-import json
+import functools
 import logging
 import sys
 import time
 
-import boto3
-import botocore
-
 sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
-from event_queue import extract_event_from_queue_message, queue_smaller_events
+from backpressure import is_throttling_error, record_success, record_throttle
+from coalescer import coalesce_tag_work, get_coalesce_max_tags, is_coalescible
+from event_queue import (decode_queue_record, get_queue_records, get_reference_to_embedded_list,
+                         get_split_metadata, queue_chunks)
+from idempotency import get_idempotency_guard, get_idempotency_key
+from jobs import record_tags_done
+from local_executor import get_local_max_workers, process_tags_locally
+from scheduler import (get_remaining_time_ms, get_tag_seconds_estimate, get_time_budget_seconds,
+                       record_tag_duration, tags_that_fit)
+from split_policy import chunk_items, fits_in_one_chunk
+from telemetry import (METRIC_COALESCED_UNIT_SIZE, METRIC_PROCESS_TAG_DURATION, METRIC_QUEUE_DWELL_TIME,
+                       StructuredMessage, flush_metrics, get_log_level, log_event_sample, put_metric)
+from transport import prewarm_transport
 
 logger = logging.getLogger()
 
+# when enabled, create the SQS client during the init phase rather than when first needed
+prewarm_transport()
+
 def process_one_tag(tag):
-    logger.info(f"===> START processing tag '{tag['key']}'")
-    # simulate some time-consuming work
+    logger.info(StructuredMessage("===> START processing tag", tag=tag['key']))
+    # simulate some time-consuming work (real work should let throttling errors raised by
+    # the AWS APIs it calls propagate, so that later splits slow down, see backpressure.py)
+    time.sleep(5)
+    logger.info(StructuredMessage("===> DONE processing tag", tag=tag['key']))
+
+def process_tags_of_resources(tags):
+    """The batch-aware variant of process_one_tag(), which processes several tags that
+    apply to the same resources as one unit of work (see coalescer.py).
+    """
+    logger.info(StructuredMessage("===> START processing tags", tags=[ tag['key'] for tag in tags ]))
+    # simulate some time-consuming work, done once for all the tags (e.g. one API call)
     time.sleep(5)
-    logger.info(f"===> DONE processing tag '{tag['key']}'")
+    logger.info(StructuredMessage("===> DONE processing tags", tags=[ tag['key'] for tag in tags ]))
+
+def process_and_time(process, work, tag_count):
+    """Calls process(work), which processes 'tag_count' tags, and records how long each
+    tag took (see scheduler.py and telemetry.py) and whether it was throttled (see
+    backpressure.py).
+    """
+    started = time.monotonic()
+    try:
+        result = process(work)
+        record_success()
+        return result
+    except Exception as ex:
+        if is_throttling_error(ex):
+            record_throttle()
+        raise ex
+    finally:
+        seconds = (time.monotonic() - started) / tag_count
+        record_tag_duration(seconds)
+        put_metric(METRIC_PROCESS_TAG_DURATION, seconds * 1000)
+
+def process_and_time_one_tag(tag):
+    """Processes one tag, and records how long it took (see process_and_time())."""
+    return process_and_time(process_one_tag, tag, 1)
+
+def process_tag_of_event_once(event, tag):
+    """Processes one tag of the given event, unless another delivery of it has already
+    claimed it (e.g. because SQS delivered the same message more than once, see
+    idempotency.py), and counts it as done for the event's job, if any (see jobs.py).
+    """
+    guard = get_idempotency_guard()
+    key = get_idempotency_key(event, tag)
+    if not guard.claim(key):
+        logger.info(StructuredMessage("===> SKIP: tag has already been processed, or is being processed", tag=tag.get('key')))
+        return None
+    started = time.monotonic()
+    try:
+        result = process_and_time_one_tag(tag)
+    except Exception as ex:
+        guard.release(key)
+        raise ex
+    guard.mark_done(key)
+    record_tags_done(get_split_metadata(event).get("jobId", None), [ tag ], time.monotonic() - started)
+    return result
 
 def lambda_handler(event, context):
     """AWS Lambda Function entrypoint to Load Splitter Example
@@ -42,7 +107,7 @@ def lambda_handler(event, context):
     ----------
     event: dict, required
         - CloudTrail event
-        - or SQS event
+        - or SQS event, holding a batch of one or more queued messages
     context: object, required
         Lambda Context runtime methods and attributes
         Context doc: https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
@@ -51,58 +116,252 @@ def lambda_handler(event, context):
     -------
     dict
         statusCode: an integer success or failure status code
-        count:      an integer count of the number of Tag Creation events processed
+        count:      an integer count of the number of Tag Creation events processed (or,
+                    when the event was split, the number of tags actually queued)
         body:       a string describing the processing that was performed
+        batchItemFailures: (SQS events only) a list of {"itemIdentifier": messageId} for
+                    each queued message that failed, so that only those are redriven
+    """
+    logger.setLevel(get_log_level())
+    log_event_sample(event)
+
+    try:
+        # check if the event came from our queue, in which case it holds a batch of messages
+        records = get_queue_records(event)
+        if records:
+            return handle_queue_records(records, context)
+        return handle_event(event, context, min_local_tags=1)
+    finally:
+        function_name = getattr(context, "function_name", None)
+        flush_metrics({ "FunctionName": function_name } if isinstance(function_name, str) else None)
+
+def handle_queue_records(records, context):
+    """Processes each record of a batch of SQS messages independently, as an event of its
+    own (see handle_event()). A record fails if its body can't be decoded, if processing
+    it raises an exception, or if it results in an error status code. The failed records
+    are listed in "batchItemFailures" so that Lambda deletes the others from the queue.
+    When coalescing is enabled, the small events are processed together instead (see
+    handle_coalesced_events()).
+    """
+    ret_val_ok_batch = { 'statusCode': 200, 'count': 0, 'body': '', 'batchItemFailures': [] }
+
+    coalesce = get_coalesce_max_tags() > 1
+    coalesced = []
+    handled_any = False
+    now_ms = time.time() * 1000
+    for index, record in enumerate(records):
+        message_id = record.get("messageId", None)
+        sent_timestamp = record.get("attributes", {}).get("SentTimestamp", None)
+        if sent_timestamp:
+            put_metric(METRIC_QUEUE_DWELL_TIME, max(0, now_ms - int(sent_timestamp)))
+        try:
+            event = decode_queue_record(record)
+            if coalesce and is_coalescible(event):
+                # this small event is processed along with the others, see below
+                coalesced.append((message_id, event))
+                continue
+            # make sure the first message always makes progress, even if short of time
+            ret_val = handle_event(event, context, min_local_tags=0 if handled_any else 1)
+            handled_any = True
+        except Exception:
+            logger.exception(StructuredMessage("===> EXCEPTION CAUGHT: while processing queued message", messageId=message_id))
+            ret_val = None
+        if not ret_val or ret_val['statusCode'] >= 400:
+            logger.error(StructuredMessage("===> FAIL: unable to process queued message", messageId=message_id))
+            ret_val_ok_batch['batchItemFailures'].append({ 'itemIdentifier': message_id })
+            continue
+        ret_val_ok_batch['count'] += ret_val['count']
+    if coalesced:
+        failed_message_ids, count = handle_coalesced_events(coalesced, context, min_local_tags=0 if handled_any else 1)
+        ret_val_ok_batch['batchItemFailures'].extend({ 'itemIdentifier': message_id } for message_id in failed_message_ids)
+        ret_val_ok_batch['count'] += count
+
+    failures = len(ret_val_ok_batch['batchItemFailures'])
+    ret_val_ok_batch['body'] = f"handled '{len(records) - failures}' of '{len(records)}' queued messages"
+    logger.info(StructuredMessage("===> DONE", repeatTags=get_idempotency_guard().stats(), **ret_val_ok_batch))
+    return ret_val_ok_batch
+
+def handle_coalesced_events(messages, context=None, min_local_tags=0):
+    """Processes the tags of small events from a batch of SQS messages, grouped into units
+    of work by the resources they apply to (see coalescer.py). Tags that another
+    delivery has already claimed are skipped (see idempotency.py), and the others are
+    counted as done for their jobs, if any (see jobs.py). If processing a unit raises an
+    exception, every message with a tag in that unit fails, and its claims are released.
+    When the 'context' tells how much time is left, a unit that doesn't fit before the
+    deadline isn't started, and its messages fail so that they are redelivered (see
+    scheduler.py).
 
-    Raises
-    ------
-    json.JSONDecodeError
-        May be raised if an input SQS message does not contain JSON parsable information.
+    Parameters
+    ----------
+    messages : list
+        The (message_id, event) tuples of the coalescible events.
+    context : object, optional
+        The Lambda context, which tells how much time is left.
+    min_local_tags : int, optional
+        How many tags to process even if short of time, so that the batch makes progress.
+
+    Returns
+    -------
+    tuple
+        The list of the ids of the messages that failed, and the number of tags of the
+        other messages.
     """
-    logger.setLevel(logging.INFO)
-    logger.info(event)
+    guard = get_idempotency_guard()
+    failed_message_ids = []
+    started_tags = 0
+    for unit in coalesce_tag_work(messages):
+        remaining_ms = get_remaining_time_ms(context)
+        if remaining_ms is not None and started_tags >= min_local_tags and tags_that_fit(remaining_ms) < len(unit):
+            # this unit won't finish before the deadline, so its messages are redelivered
+            logger.info(StructuredMessage("===> deferring coalesced tags until after the deadline", remainingMs=remaining_ms, tags=len(unit)))
+            failed_message_ids.extend(message_id for message_id, event, tag in unit if message_id not in failed_message_ids)
+            continue
+        started_tags += len(unit)
+        keys = [ get_idempotency_key(event, tag) for message_id, event, tag in unit ]
+        todo = [ (item, key) for item, key in zip(unit, keys) if guard.claim(key) ]
+        if not todo:
+            continue
+        tags = [ item[2] for item, key in todo ]
+        put_metric(METRIC_COALESCED_UNIT_SIZE, len(tags))
+        started = time.monotonic()
+        try:
+            process_and_time(process_tags_of_resources, tags, len(tags))
+        except Exception:
+            logger.exception(StructuredMessage("===> EXCEPTION CAUGHT: while processing coalesced tags", tags=[ tag.get('key') for tag in tags ]))
+            failed_message_ids.extend(message_id for message_id, event, tag in unit if message_id not in failed_message_ids)
+            for item, key in todo:
+                guard.release(key)
+            continue
+        seconds = time.monotonic() - started
+        tags_by_job_id = {}
+        for (message_id, event, tag), key in todo:
+            guard.mark_done(key)
+            tags_by_job_id.setdefault(get_split_metadata(event).get("jobId", None), []).append(tag)
+        for job_id, job_tags in tags_by_job_id.items():
+            record_tags_done(job_id, job_tags, seconds)
+    count = sum(len(get_reference_to_embedded_list(event)) for message_id, event in messages if message_id not in failed_message_ids)
+    logger.info(StructuredMessage("===> processed coalesced events", messages=len(messages), count=count, failedMessages=failed_message_ids))
+    return failed_message_ids, count
 
+def handle_event(event, context, min_local_tags=0):
+    """Processes one CloudTrail event, which either came directly to the Lambda or was
+    taken from a queued message. When the 'context' tells how much time is left, as many
+    tags as fit before the deadline (but at least 'min_local_tags') are processed here
+    and the rest are queued (see scheduler.py). See lambda_handler() for the returned
+    dict.
+    """
     ret_val_ok         = { 'statusCode': 200, 'count': 0, 'body': '' }
-    ret_val_ok_split   = { 'statusCode': 202, 'count': 0, 'body': 'event was accepted' }
     ret_val_ok_ignored = { 'statusCode': 202, 'count': 0, 'body': 'event was ignored, not a type of interest' }
     ret_val_err        = { 'statusCode': 400, 'count': 0, 'body': 'invalid event argument' }
 
-    # try to parse event as an SQS message, in case the event came from our queue
-    event_from_sqs = extract_event_from_queue_message(event)
-    if event_from_sqs:
-        # yes, the event is from our queue, so now we will just work with it
-        event = event_from_sqs
-
     # try to confirm this is a CreateTags event, which is what we are interested in
-    if not event or not event.get("detail",{}).get("eventName",None):
-        logger.error(f"===> FAIL: unable to parse event (cannot find the 'eventName')\n{event}\n{ret_val_err}")
+    if not isinstance(event, dict) or not event.get("detail",{}).get("eventName",None):
+        logger.error(StructuredMessage("===> FAIL: unable to parse event (cannot find the 'eventName')", event=event, **ret_val_err))
         return ret_val_err
     event_name = event.get("detail",{}).get("eventName",None)
     if not event_name == "CreateTags":
-        logger.info(f"===> ignoring event of '{event_name}', since it is not of interest\n{ret_val_ok_ignored}")
+        logger.info(StructuredMessage("===> ignoring event, since it is not of interest", eventName=event_name, **ret_val_ok_ignored))
         return ret_val_ok_ignored
 
     # try to find the list of tags that have been newly created
     if not event or not event.get("detail",{}).get("requestParameters",{}).get("tagSet",{}).get("items",None):
-        logger.error(f"===> FAIL: unable to parse event (cannot find the 'tagSet')\n{event}\n{ret_val_err}")
+        logger.error(StructuredMessage("===> FAIL: unable to parse event (cannot find the 'tagSet')", event=event, **ret_val_err))
         return ret_val_err
     tags = event.get("detail").get("requestParameters").get("tagSet").get("items")
     if not isinstance(tags, list):
-        logger.error(f"===> FAIL: unable to parse event (cannot find the 'tagSet' as a list)\n{event}\n{ret_val_err}")
+        logger.error(StructuredMessage("===> FAIL: unable to parse event (cannot find the 'tagSet' as a list)", event=event, **ret_val_err))
         return ret_val_err
 
     # process the the list of tags found
-    logger.info(f"===> found '{len(tags)}' tag(s) to process")
-    if len(tags) == 1:
-        # just one tag, so we work on the tag here
-        process_one_tag(tags[0])
-        ret_val_ok['count'] = 1
-        ret_val_ok['body'] = "handled 1 tag"
-        logger.info(f"===> SUCCESS: processed 1 tag ({tags[0]['key']})\n{ret_val_ok}")
+    logger.info(StructuredMessage("===> found tag(s) to process", tags=len(tags)))
+    if get_split_metadata(event).get("range", False):
+        # this is a range of the tags of a very large event, which we split further
+        return split_event(event, tags)
+    max_workers = get_local_max_workers()
+    remaining_ms = get_remaining_time_ms(context)
+    if remaining_ms is not None:
+        # work on as many tags here as fit before the deadline, and queue the rest
+        workers = max(1, max_workers)
+        fit = tags_that_fit(remaining_ms, workers)
+        count = min(len(tags), max(fit, min_local_tags))
+        budget_seconds = get_time_budget_seconds(remaining_ms)
+        if count > fit:
+            budget_seconds = max(budget_seconds, get_tag_seconds_estimate())
+        logger.info(StructuredMessage("===> processing tag(s) here before the deadline", remainingMs=remaining_ms, localTags=count, tags=len(tags)))
+        return handle_tags_locally(event, tags[:count], workers, budget_seconds, tags_to_queue=tags[count:])
+    if max_workers > 0:
+        # work on the tags here in parallel, and queue only those we don't get to
+        return handle_tags_locally(event, tags, max_workers)
+    if fits_in_one_chunk(tags):
+        # the tags fit in one chunk, so we work on them here
+        for tag in tags:
+            process_tag_of_event_once(event, tag)
+        ret_val_ok['count'] = len(tags)
+        ret_val_ok['body'] = "handled 1 tag" if len(tags) == 1 else f"handled {len(tags)} tags"
+        logger.info(StructuredMessage("===> SUCCESS", **ret_val_ok))
         return ret_val_ok
-    # there was more than one tag, so we will queue 1 message per tag found
-    queue_smaller_events(event)
-    ret_val_ok_split['count'] = len(tags)
-    ret_val_ok_split['body'] = f"split '{len(tags)}' tags into '{len(tags)}' queued messages"
-    logger.info(f"===> SUCCESS: split '{len(tags)}' tags into '{len(tags)}' queued messages\n{ret_val_ok_split}")
+    # there were more tags than fit in one chunk, so we will queue 1 message per chunk
+    return split_event(event, tags)
+
+def split_event(event, tags):
+    """Queues the tags of one event in chunks (see split_policy.py), to be processed by
+    other invocations. See lambda_handler() for the returned dict.
+    """
+    ret_val_ok_split   = { 'statusCode': 202, 'count': 0, 'body': 'event was accepted' }
+    ret_val_err_split  = { 'statusCode': 500, 'count': 0, 'body': 'event was only partly queued' }
+
+    outcomes = queue_chunks(event, chunk_items(tags))
+    messages = sum(1 for chunk, queued in outcomes if queued)
+    queued_tags = sum(len(chunk) for chunk, queued in outcomes if queued)
+    if messages < len(outcomes):
+        ret_val_err_split['count'] = queued_tags
+        ret_val_err_split['body'] = f"split '{len(tags)}' tags but only queued '{messages}' of '{len(outcomes)}' messages"
+        logger.error(StructuredMessage("===> FAIL", **ret_val_err_split))
+        return ret_val_err_split
+    ret_val_ok_split['count'] = queued_tags
+    ret_val_ok_split['body'] = f"split '{len(tags)}' tags into '{messages}' queued messages"
+    logger.info(StructuredMessage("===> SUCCESS", **ret_val_ok_split))
     return ret_val_ok_split
+
+def handle_tags_locally(event, tags, max_workers, budget_seconds=None, tags_to_queue=()):
+    """Processes the tags of one event in a local pool of 'max_workers' threads (see
+    local_executor.py). The 'tags_to_queue' are queued in chunks (see split_policy.py),
+    to be processed by other invocations, before the pool starts, so that they are
+    queued even if the invocation times out; tags that the pool doesn't start within its
+    budget are queued after it. Tags whose processing raised an exception make the event
+    fail. See lambda_handler() for the returned dict.
+    """
+    ret_val_ok       = { 'statusCode': 200, 'count': 0, 'body': '' }
+    ret_val_ok_split = { 'statusCode': 202, 'count': 0, 'body': 'event was accepted' }
+    ret_val_err      = { 'statusCode': 500, 'count': 0, 'body': 'event was only partly handled' }
+
+    started = time.monotonic()
+    outcomes = queue_chunks(event, chunk_items(tags_to_queue)) if tags_to_queue else []
+    if budget_seconds is not None:
+        budget_seconds = max(0, budget_seconds - (time.monotonic() - started))
+    process_tag = functools.partial(process_tag_of_event_once, event)
+    results, spilled = process_tags_locally(tags, process_tag, max_workers, budget_seconds)
+    failed = [ result for result in results if result.exception ]
+    for result in failed:
+        logger.error(StructuredMessage("===> FAIL: unable to process tag", tag=result.tag.get('key')), exc_info=result.exception)
+    processed = len(results) - len(failed)
+    if spilled:
+        outcomes += queue_chunks(event, chunk_items(spilled))
+    spilled += list(tags_to_queue)
+    messages = sum(1 for chunk, queued in outcomes if queued)
+    queued_tags = sum(len(chunk) for chunk, queued in outcomes if queued)
+
+    if failed or messages < len(outcomes):
+        ret_val_err['count'] = processed + queued_tags
+        ret_val_err['body'] = f"handled '{processed}' tags and queued '{queued_tags}' tags, but failed on '{len(results) + len(spilled) - processed - queued_tags}' tags"
+        logger.error(StructuredMessage("===> FAIL", **ret_val_err))
+        return ret_val_err
+    if outcomes:
+        ret_val_ok_split['count'] = processed + queued_tags
+        ret_val_ok_split['body'] = f"handled '{processed}' tags and split '{len(spilled)}' tags into '{messages}' queued messages"
+        logger.info(StructuredMessage("===> SUCCESS", **ret_val_ok_split))
+        return ret_val_ok_split
+    ret_val_ok['count'] = processed
+    ret_val_ok['body'] = "handled 1 tag" if processed == 1 else f"handled {processed} tags"
+    logger.info(StructuredMessage("===> SUCCESS", workers=max_workers, **ret_val_ok))
+    return ret_val_ok
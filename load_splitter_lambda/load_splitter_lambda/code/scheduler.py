@@ -0,0 +1,107 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The scheduler decides how many of an event's tags one invocation can process before
+# its deadline. It keeps an exponentially weighted moving average (EWMA) of how long one
+# tag takes to process, in module state, so that the estimate carries over between the
+# invocations of a warm Lambda container. Until the first tag has been timed, the
+# estimate is taken from the "TAG_SECONDS_ESTIMATE" environment variable.
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger()
+
+DEFAULT_TAG_SECONDS_ESTIMATE = 5.0
+DEFAULT_EWMA_ALPHA           = 0.3    # weight given to each new duration measured
+DEFAULT_SAFETY_MARGIN_MS     = 3000   # time kept back for queueing the remainder, etc.
+
+_lock = threading.Lock()
+_tag_seconds_ewma = None
+
+def record_tag_duration(seconds, alpha=DEFAULT_EWMA_ALPHA):
+    # -*- coding: utf-8 -*-
+    """This method folds the measured duration of processing one tag into the moving
+    average. It may be called from several threads at once.
+    """
+    global _tag_seconds_ewma
+    with _lock:
+        if _tag_seconds_ewma is None:
+            _tag_seconds_ewma = seconds
+        else:
+            _tag_seconds_ewma = alpha * seconds + (1 - alpha) * _tag_seconds_ewma
+
+def get_tag_seconds_estimate():
+    # -*- coding: utf-8 -*-
+    """This method returns the estimated number of seconds it takes to process one tag."""
+    if _tag_seconds_ewma is not None:
+        return _tag_seconds_ewma
+    return float(os.environ.get("TAG_SECONDS_ESTIMATE", None) or DEFAULT_TAG_SECONDS_ESTIMATE)
+
+def reset_tag_duration_estimate():
+    # -*- coding: utf-8 -*-
+    """This method forgets every duration recorded so far (e.g. between tests)."""
+    global _tag_seconds_ewma
+    with _lock:
+        _tag_seconds_ewma = None
+
+def get_safety_margin_ms():
+    # -*- coding: utf-8 -*-
+    """This method returns the time to keep back from the deadline, in milliseconds, from
+    the "SAFETY_MARGIN_MS" environment variable, else DEFAULT_SAFETY_MARGIN_MS.
+    """
+    return max(0, int(os.environ.get("SAFETY_MARGIN_MS", None) or DEFAULT_SAFETY_MARGIN_MS))
+
+def get_remaining_time_ms(context):
+    # -*- coding: utf-8 -*-
+    """This method returns the milliseconds left before the invocation times out, or None
+    if the 'context' doesn't provide get_remaining_time_in_millis() (e.g. in tests).
+    """
+    get_remaining_time_in_millis = getattr(context, "get_remaining_time_in_millis", None)
+    if not callable(get_remaining_time_in_millis):
+        return None
+    return get_remaining_time_in_millis()
+
+def get_time_budget_seconds(remaining_ms):
+    # -*- coding: utf-8 -*-
+    """This method returns the seconds available for processing tags, which is the time
+    remaining less the safety margin (and never less than 0).
+    """
+    return max(0, remaining_ms - get_safety_margin_ms()) / 1000.0
+
+def tags_that_fit(remaining_ms, workers=1):
+    # -*- coding: utf-8 -*-
+    """This method returns how many tags can be processed before the deadline.
+
+    Parameters
+    ----------
+    remaining_ms : int
+        The milliseconds left before the invocation times out.
+    workers : int, optional
+        How many tags are processed at the same time.
+
+    Returns
+    -------
+    int
+        The number of tags that, going by the estimated time per tag, can be processed
+        in the time remaining less the safety margin.
+    """
+    estimate = max(get_tag_seconds_estimate(), 0.001)
+    rounds = int(get_time_budget_seconds(remaining_ms) // estimate)
+    return rounds * max(1, workers)
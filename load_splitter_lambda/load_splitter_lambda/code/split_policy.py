@@ -0,0 +1,186 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The split policy decides how the list of items (tags) found in a large event is broken
+# down into the chunks that are each queued as one smaller event. There are two modes:
+#
+#   - by count: each chunk holds up to CHUNK_SIZE items (the default, 1 item per chunk)
+#   - by cost:  when CHUNK_MAX_COST is set, each chunk holds as many items as fit within
+#               that estimated cost, using the per-tag-key estimates in TAG_COST_ESTIMATES
+#
+# Both settings come from the Lambda environment, and can be overridden by arguments.
+#
+# For very large events, the chunks can also be queued as a tree rather than all at
+# once: when "TREE_BRANCHING_FACTOR" (K) is at least 2 and there are more than K chunks,
+# K "range" messages are queued instead, each holding a slice of the items, and the
+# invocation that receives a range message splits it again in the same way. The fan-out
+# work is thus spread over about log_K(N) levels of invocations, of which there are at
+# most "TREE_MAX_DEPTH" levels of range messages.
+
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+DEFAULT_CHUNK_SIZE            = 1
+DEFAULT_ITEM_COST             = 1.0
+DEFAULT_TREE_BRANCHING_FACTOR = 0 # 0 (or 1) disables the tree fan-out
+DEFAULT_TREE_MAX_DEPTH        = 3
+
+def get_chunk_size(chunk_size=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the maximum number of items per chunk: the 'chunk_size'
+    argument if given, else the "CHUNK_SIZE" environment variable, else
+    DEFAULT_CHUNK_SIZE. The returned value is never less than 1.
+    """
+    if chunk_size is None:
+        chunk_size = os.environ.get("CHUNK_SIZE", None) or DEFAULT_CHUNK_SIZE
+    return max(1, int(chunk_size))
+
+def get_max_chunk_cost(max_cost=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the maximum estimated cost per chunk: the 'max_cost' argument
+    if given, else the "CHUNK_MAX_COST" environment variable. None is returned when
+    neither is set, meaning that chunks are made by count rather than by cost.
+    """
+    if max_cost is None:
+        max_cost = os.environ.get("CHUNK_MAX_COST", None) or None
+    return None if max_cost is None else float(max_cost)
+
+def get_tag_cost_estimates():
+    # -*- coding: utf-8 -*-
+    """This method returns the per-tag-key cost estimates held by the "TAG_COST_ESTIMATES"
+    environment variable, a JSON object such as '{"Owner": 0.2, "BackupPolicy": 4}'.
+    """
+    return json.loads(os.environ.get("TAG_COST_ESTIMATES", None) or "{}")
+
+def estimate_item_cost(item, estimates=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the estimated cost of processing one item (tag). The estimate is
+    looked up by the tag's key in 'estimates', which defaults to get_tag_cost_estimates()
+    (pass them in when estimating many items, so that they are parsed just once). Tags
+    whose key is not listed cost DEFAULT_ITEM_COST.
+    """
+    if estimates is None:
+        estimates = get_tag_cost_estimates()
+    key = item.get("key", None) if isinstance(item, dict) else None
+    return float(estimates.get(key, DEFAULT_ITEM_COST))
+
+def chunk_items(items, chunk_size=None, max_cost=None, cost_of=None):
+    # -*- coding: utf-8 -*-
+    """This method breaks a list of items into consecutive chunks, according to the split
+    policy described at the top of this file.
+
+    Parameters
+    ----------
+    items : list
+        The items to be broken into chunks.
+    chunk_size : int, optional
+        The maximum number of items per chunk (see get_chunk_size()).
+    max_cost : float, optional
+        The maximum estimated cost per chunk (see get_max_chunk_cost()). When there is a
+        maximum cost, chunks are made by cost, and an item that costs more than the
+        maximum on its own is placed in a chunk of its own.
+    cost_of : function, optional
+        Returns the estimated cost of one item. Defaults to estimate_item_cost(), with
+        the estimates parsed once for all the items.
+
+    Returns
+    -------
+    list
+        A list of chunks, each a non-empty list of items, in their original order.
+    """
+    max_cost = get_max_chunk_cost(max_cost)
+    if max_cost is None:
+        chunk_size = get_chunk_size(chunk_size)
+        return [ items[i:i + chunk_size] for i in range(0, len(items), chunk_size) ]
+    if cost_of is None:
+        estimates = get_tag_cost_estimates()
+        cost_of = lambda item: estimate_item_cost(item, estimates)
+    chunks = []
+    chunk = []
+    chunk_cost = 0.0
+    for item in items:
+        item_cost = cost_of(item)
+        if chunk and chunk_cost + item_cost > max_cost:
+            chunks.append(chunk)
+            chunk = []
+            chunk_cost = 0.0
+        chunk.append(item)
+        chunk_cost += item_cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def fits_in_one_chunk(items, chunk_size=None, max_cost=None, cost_of=None):
+    # -*- coding: utf-8 -*-
+    """This method returns True if the split policy would not break the list of items into
+    more than one chunk, i.e. if the items are small enough to be processed inline.
+    """
+    return len(chunk_items(items, chunk_size, max_cost, cost_of)) <= 1
+
+def get_tree_branching_factor(branching_factor=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the number of range messages that a range of chunks is split
+    into: the 'branching_factor' argument if given, else the "TREE_BRANCHING_FACTOR"
+    environment variable, else DEFAULT_TREE_BRANCHING_FACTOR.
+    """
+    if branching_factor is None:
+        branching_factor = os.environ.get("TREE_BRANCHING_FACTOR", None) or DEFAULT_TREE_BRANCHING_FACTOR
+    return max(0, int(branching_factor))
+
+def get_tree_max_depth(max_depth=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the maximum depth of range messages: the 'max_depth' argument if
+    given, else the "TREE_MAX_DEPTH" environment variable, else DEFAULT_TREE_MAX_DEPTH.
+    """
+    if max_depth is None:
+        max_depth = os.environ.get("TREE_MAX_DEPTH", None) or DEFAULT_TREE_MAX_DEPTH
+    return max(0, int(max_depth))
+
+def group_chunks_for_tree(chunks, depth, branching_factor=None, max_depth=None):
+    # -*- coding: utf-8 -*-
+    """This method decides whether chunks being queued from the given tree 'depth' should
+    be queued as range messages rather than as they are.
+
+    Parameters
+    ----------
+    chunks : list
+        The chunks to be queued (see chunk_items()).
+    depth : int
+        The depth of the event the chunks come from: 0 for an event that was not itself
+        a range message.
+    branching_factor : int, optional
+        See get_tree_branching_factor().
+    max_depth : int, optional
+        See get_tree_max_depth().
+
+    Returns
+    -------
+    list
+        None if the chunks should be queued as they are. Otherwise, a list of at most
+        'branching_factor' ranges, each a list of the items of consecutive chunks, to be
+        queued as range messages at depth + 1.
+    """
+    branching_factor = get_tree_branching_factor(branching_factor)
+    if branching_factor < 2 or len(chunks) <= branching_factor or depth >= get_tree_max_depth(max_depth):
+        return None
+    chunks_per_range = -(-len(chunks) // branching_factor) # i.e. rounded up
+    return [ [ item for chunk in chunks[i:i + chunks_per_range] for item in chunk ]
+             for i in range(0, len(chunks), chunks_per_range) ]
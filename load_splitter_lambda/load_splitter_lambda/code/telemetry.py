@@ -0,0 +1,180 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# Telemetry for the handler's hot path, in two parts:
+#
+#   - structured logging: log messages are StructuredMessage objects, which are only
+#     formatted (as one line of JSON) if the logger actually emits them, so that log
+#     calls below the log level ("LOG_LEVEL", default INFO) cost next to nothing. Full
+#     event dumps are only logged for a sample of invocations, at the rate given by
+#     "LOG_EVENT_SAMPLE_RATE" (between 0 and 1, default 0.01).
+#   - metrics: values put with put_metric() are buffered and written once per invocation
+#     by flush_metrics(), as one log line in CloudWatch Embedded Metric Format (EMF)
+#     (https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html),
+#     from which CloudWatch extracts the metrics asynchronously, without any API calls.
+#     Metrics are published to the "METRICS_NAMESPACE" namespace (default
+#     "LoadSplitter"), and setting it to "none" turns them off.
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger()
+
+DEFAULT_LOG_LEVEL             = "INFO"
+DEFAULT_LOG_EVENT_SAMPLE_RATE = 0.01
+DEFAULT_METRICS_NAMESPACE     = "LoadSplitter"
+EMF_MAX_VALUES_PER_METRIC     = 100 # EMF accepts at most 100 values per metric per line
+
+# the metrics put by the Lambda, with their units
+METRIC_FAN_OUT_SIZE          = ("FanOutSize", "Count")               # messages queued per split event
+METRIC_ENQUEUE_BATCH_LATENCY = ("EnqueueBatchLatency", "Milliseconds") # per SendMessageBatch call
+METRIC_PROCESS_TAG_DURATION  = ("ProcessTagDuration", "Milliseconds")  # per tag processed
+METRIC_QUEUE_DWELL_TIME      = ("QueueDwellTime", "Milliseconds")      # from enqueue (SentTimestamp) to dequeue
+METRIC_COALESCED_UNIT_SIZE   = ("CoalescedUnitSize", "Count")         # tags per coalesced unit of work
+METRIC_JOB_MAKESPAN          = ("JobMakespan", "Milliseconds")         # from split to the last tag of the job done
+
+_lock = threading.Lock()
+_metrics = {}
+
+class StructuredMessage():
+    """A log message with structured fields, which is formatted as one line of JSON only
+    when (and if) the logging framework turns it into a string.
+    """
+    __slots__ = ("message", "fields")
+
+    def __init__(self, message, **fields):
+        self.message = message
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(dict(message=self.message, **self.fields), default=str)
+
+def get_log_level():
+    # -*- coding: utf-8 -*-
+    """This method returns the log level set by the "LOG_LEVEL" environment variable."""
+    return (os.environ.get("LOG_LEVEL", None) or DEFAULT_LOG_LEVEL).upper()
+
+def get_log_event_sample_rate():
+    # -*- coding: utf-8 -*-
+    """This method returns the fraction of invocations whose event is logged in full, from
+    the "LOG_EVENT_SAMPLE_RATE" environment variable, else DEFAULT_LOG_EVENT_SAMPLE_RATE.
+    """
+    rate = os.environ.get("LOG_EVENT_SAMPLE_RATE", None)
+    return min(1.0, max(0.0, float(DEFAULT_LOG_EVENT_SAMPLE_RATE if rate in (None, "") else rate)))
+
+def log_event_sample(event):
+    # -*- coding: utf-8 -*-
+    """This method logs the whole 'event' for a sample of the calls made to it (see
+    get_log_event_sample_rate()), and returns True if it was logged.
+    """
+    if not logger.isEnabledFor(logging.INFO) or random.random() >= get_log_event_sample_rate():
+        return False
+    logger.info(StructuredMessage("===> sampled event", event=event))
+    return True
+
+def get_metrics_namespace():
+    # -*- coding: utf-8 -*-
+    """This method returns the namespace to publish metrics to, or None if metrics are
+    turned off.
+    """
+    namespace = os.environ.get("METRICS_NAMESPACE", None) or DEFAULT_METRICS_NAMESPACE
+    return None if namespace.lower() == "none" else namespace
+
+def put_metric(metric, value):
+    # -*- coding: utf-8 -*-
+    """This method buffers one value of a metric, to be written by flush_metrics(). It
+    may be called from several threads at once.
+
+    Parameters
+    ----------
+    metric : tuple
+        The (name, unit) of the metric, e.g. METRIC_FAN_OUT_SIZE.
+    value : float
+        The value to record.
+    """
+    with _lock:
+        _metrics.setdefault(metric, []).append(value)
+
+def build_metrics_documents(namespace, metrics, dimensions=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the EMF documents (dicts) that hold the given buffered
+    'metrics', a dict of lists of values by (name, unit). Each document holds at most
+    EMF_MAX_VALUES_PER_METRIC values per metric, so more documents are returned when
+    there are more values than that.
+    """
+    dimensions = dimensions or {}
+    documents = []
+    offset = 0
+    while True:
+        values_by_metric = { metric: values[offset:offset + EMF_MAX_VALUES_PER_METRIC]
+                             for metric, values in metrics.items() if values[offset:offset + EMF_MAX_VALUES_PER_METRIC] }
+        if not values_by_metric:
+            return documents
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [ {
+                    "Namespace": namespace,
+                    "Dimensions": [ sorted(dimensions) ],
+                    "Metrics": [ { "Name": name, "Unit": unit } for name, unit in values_by_metric ]
+                } ]
+            }
+        }
+        document.update(dimensions)
+        for (name, unit), values in values_by_metric.items():
+            document[name] = values if len(values) > 1 else values[0]
+        documents.append(document)
+        offset += EMF_MAX_VALUES_PER_METRIC
+
+def flush_metrics(dimensions=None, stream=None):
+    # -*- coding: utf-8 -*-
+    """This method writes the buffered metrics as EMF documents, one per line, to 'stream'
+    (default: standard output, which Lambda sends to CloudWatch Logs), and empties the
+    buffer. It returns the documents written.
+
+    Parameters
+    ----------
+    dimensions : dict, optional
+        The dimensions of every metric, e.g. { "FunctionName": "my_lambda" }.
+    stream : file, optional
+        Where to write the documents.
+    """
+    global _metrics
+    with _lock:
+        metrics, _metrics = _metrics, {}
+    namespace = get_metrics_namespace()
+    if not namespace or not metrics:
+        return []
+    documents = build_metrics_documents(namespace, metrics, dimensions)
+    stream = stream or sys.stdout
+    for document in documents:
+        stream.write(json.dumps(document) + "\n")
+    stream.flush()
+    return documents
+
+def reset_metrics():
+    # -*- coding: utf-8 -*-
+    """This method discards the buffered metrics (e.g. between tests)."""
+    global _metrics
+    with _lock:
+        _metrics = {}
@@ -0,0 +1,310 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# The SQS client and the resolved queue URLs are kept in module state, so that they are
+# created on first use and then reused by every later invocation of a warm Lambda
+# container (along with the HTTP connection pool that the client holds).
+#
+# boto3 and botocore are only imported when the client is first needed, as importing
+# them takes longer than handling an event that isn't split. When "PREWARM_SQS_CLIENT" is
+# "true", prewarm_transport() imports them and creates the client during the Lambda init
+# phase instead, which runs before the first invocation (with a full CPU, whatever the
+# memory size of the Lambda), so that the first split doesn't pay for them. That makes
+# every cold start slower, though, including those of containers that never split an
+# event, so it is off by default.
+#
+# A transport is anything with the send_message() and send_message_batch() methods of
+# QueueTransport, which take and return what the SQS API does. The "QUEUE_TRANSPORT"
+# environment variable chooses the backend used by get_transport():
+#
+#   - "sqs" (the default): SqsTransport, which sends the messages to SQS
+#   - "memory": InProcessTransport, which keeps the messages in a list in memory, from
+#     which drain() hands them to the handler, as Lambda would
+#   - "multiprocessing": the messages are put on a multiprocessing queue, from which a
+#     pool of worker processes hands them to the handler (see local_runner.py, which
+#     installs this backend with install_transport())
+#
+# The local backends turn each message into the record that Lambda would pass to the
+# handler for it, so that the handler runs the same code as it does in AWS. They don't
+# delay messages (DelaySeconds is ignored).
+
+import logging
+import os
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger()
+
+# error codes returned by SQS when a queue URL no longer refers to an existing queue
+NON_EXISTENT_QUEUE_ERROR_CODES = ("AWS.SimpleQueueService.NonExistentQueue", "QueueDoesNotExist")
+
+_sqs_client = None
+_transports = {}
+
+def get_sqs_client():
+    # -*- coding: utf-8 -*-
+    """This method returns the SQS client shared by all transports, creating it the first
+    time it is needed.
+    """
+    global _sqs_client
+    if _sqs_client is None:
+        import boto3
+        _sqs_client = boto3.client("sqs")
+    return _sqs_client
+
+class QueueTransport():
+    """The interface of a transport, which sends messages to one queue."""
+    def send_message(self, body, attributes=None):
+        # -*- coding: utf-8 -*-
+        """This method sends one message, with the given message attributes (in the
+        format of the SQS SendMessage API), and returns a dict holding its "MessageId".
+        """
+        raise NotImplementedError()
+
+    def send_message_batch(self, entries):
+        # -*- coding: utf-8 -*-
+        """This method sends the given entries (in the format of the SQS SendMessageBatch
+        API), and returns a dict listing the "Successful" and "Failed" entries by "Id".
+        """
+        raise NotImplementedError()
+
+class SqsTransport(QueueTransport):
+    """Sends messages to one SQS queue, identified by its name. The queue URL is resolved
+    with GetQueueUrl the first time it is needed (unless it is given up front) and then
+    cached. If SQS later reports that the cached URL refers to a queue that does not
+    exist, the URL is resolved again and the request is retried once.
+    """
+    def __init__(self, queue_name, queue_url=None):
+        self.queue_name = queue_name
+        self._queue_url = queue_url
+
+    @property
+    def queue_url(self):
+        if self._queue_url is None:
+            response = get_sqs_client().get_queue_url(QueueName=self.queue_name)
+            self._queue_url = response["QueueUrl"]
+            logger.info(f"===> resolved queue '{self.queue_name}' to '{self._queue_url}'")
+        return self._queue_url
+
+    def _call(self, operation, **kwargs):
+        import botocore.exceptions
+        try:
+            return operation(QueueUrl=self.queue_url, **kwargs)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") not in NON_EXISTENT_QUEUE_ERROR_CODES:
+                raise ex
+            logger.info(f"===> cached URL for queue '{self.queue_name}' is no longer valid, resolving it again")
+            self._queue_url = None
+            return operation(QueueUrl=self.queue_url, **kwargs)
+
+    def send_message(self, body, attributes=None):
+        if attributes:
+            return self._call(get_sqs_client().send_message, MessageBody=body, MessageAttributes=attributes)
+        return self._call(get_sqs_client().send_message, MessageBody=body)
+
+    def send_message_batch(self, entries):
+        return self._call(get_sqs_client().send_message_batch, Entries=entries)
+
+class LocalTransport(QueueTransport):
+    """The base of the local backends, which turns each message into the SQS record that
+    Lambda would hand to the handler, and passes it to put().
+    """
+    def __init__(self, queue_name):
+        self.queue_name = queue_name
+        self.event_source_arn = f"arn:aws:sqs:local:000000000000:{queue_name}"
+
+    def put(self, record):
+        raise NotImplementedError()
+
+    def make_record(self, body, attributes=None):
+        # -*- coding: utf-8 -*-
+        """This method returns the SQS record for a message (see the top of this file)."""
+        message_id = str(uuid.uuid4())
+        return {
+            "messageId": message_id,
+            "receiptHandle": message_id,
+            "body": body,
+            "attributes": { "ApproximateReceiveCount": "1", "SentTimestamp": str(int(time.time() * 1000)) },
+            "messageAttributes": { name: { "stringValue": attribute.get("StringValue", None), "dataType": attribute["DataType"] }
+                                   for name, attribute in (attributes or {}).items() },
+            "eventSource": "aws:sqs",
+            "eventSourceARN": self.event_source_arn,
+            "awsRegion": "local",
+        }
+
+    def send_message(self, body, attributes=None):
+        record = self.make_record(body, attributes)
+        self.put(record)
+        return { "MessageId": record["messageId"] }
+
+    def send_message_batch(self, entries):
+        successful = []
+        for entry in entries:
+            record = self.make_record(entry["MessageBody"], entry.get("MessageAttributes", None))
+            self.put(record)
+            successful.append({ "Id": entry["Id"], "MessageId": record["messageId"] })
+        return { "Successful": successful, "Failed": [] }
+
+def handle_records(handler, records, context=None):
+    # -*- coding: utf-8 -*-
+    """This method hands a batch of SQS 'records' to the 'handler', as Lambda would, and
+    returns the records that failed (as listed in "batchItemFailures"), or all of them if
+    the handler raised an exception.
+    """
+    try:
+        out = handler({ "Records": records }, context)
+    except Exception:
+        logger.exception("===> EXCEPTION CAUGHT: while handling a batch of local messages")
+        return records
+    failed_ids = { failure.get("itemIdentifier", None) for failure in (out or {}).get("batchItemFailures", []) }
+    return [ record for record in records if record["messageId"] in failed_ids ]
+
+def receive_again(record):
+    # -*- coding: utf-8 -*-
+    """This method returns a copy of the record, as it would be received again after its
+    handling failed.
+    """
+    record = dict(record, attributes=dict(record["attributes"]))
+    record["attributes"]["ApproximateReceiveCount"] = str(int(record["attributes"]["ApproximateReceiveCount"]) + 1)
+    return record
+
+class InProcessTransport(LocalTransport):
+    """Keeps the messages in memory, for drain() to hand them to the handler."""
+    def __init__(self, queue_name):
+        super().__init__(queue_name)
+        self.records = deque()
+        self.dead_letters = []
+
+    def put(self, record):
+        self.records.append(record)
+
+    def drain(self, handler, batch_size=10, max_receives=3):
+        # -*- coding: utf-8 -*-
+        """This method hands the queued messages to the 'handler' in batches of up to
+        'batch_size', until the queue is empty (including the messages queued by the
+        handler itself). A message whose handling fails is queued again, until it has
+        been received 'max_receives' times, after which it is moved to 'dead_letters'.
+        It returns the number of batches handled.
+        """
+        batches = 0
+        while self.records:
+            batch = [ self.records.popleft() for i in range(min(batch_size, len(self.records))) ]
+            batches += 1
+            for record in handle_records(handler, batch):
+                if int(record["attributes"]["ApproximateReceiveCount"]) >= max_receives:
+                    self.dead_letters.append(record)
+                else:
+                    self.records.append(receive_again(record))
+        return batches
+
+class MultiprocessingTransport(LocalTransport):
+    """Puts the messages on a multiprocessing (joinable) queue, from which the worker
+    processes of local_runner.py take them.
+    """
+    def __init__(self, queue_name, queue):
+        super().__init__(queue_name)
+        self.queue = queue
+
+    def put(self, record):
+        self.queue.put(record)
+
+# the backends that get_transport() creates by name (see the top of this file)
+TRANSPORT_BACKENDS = {
+    "sqs":    lambda queue_name, queue_url: SqsTransport(queue_name, queue_url),
+    "memory": lambda queue_name, queue_url: InProcessTransport(queue_name),
+}
+
+def get_transport_backend():
+    # -*- coding: utf-8 -*-
+    """This method returns the name of the backend set by "QUEUE_TRANSPORT"."""
+    return (os.environ.get("QUEUE_TRANSPORT", None) or "sqs").lower()
+
+def get_transport(queue_name=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the cached transport for a queue, creating it with the backend
+    set by "QUEUE_TRANSPORT" the first time the queue is used.
+
+    Parameters
+    ----------
+    queue_name : str, optional
+        The name of the queue. Defaults to the value of the "QUEUE_NAME" environment
+        variable. When the queue named by "QUEUE_NAME" is used and the "QUEUE_URL"
+        environment variable is also set, that URL is used without calling GetQueueUrl.
+
+    Returns
+    -------
+    QueueTransport
+        The transport for the queue, or None if no queue name could be found.
+    """
+    default_queue_name = os.environ.get("QUEUE_NAME", None)
+    queue_name = queue_name or default_queue_name
+    if not queue_name:
+        return None
+    if queue_name not in _transports:
+        backend = get_transport_backend()
+        if backend not in TRANSPORT_BACKENDS:
+            raise ValueError(f"unknown queue transport '{backend}', installed transports must be used for it")
+        queue_url = os.environ.get("QUEUE_URL", None) if queue_name == default_queue_name else None
+        _transports[queue_name] = TRANSPORT_BACKENDS[backend](queue_name, queue_url or None)
+    return _transports[queue_name]
+
+def install_transport(transport):
+    # -*- coding: utf-8 -*-
+    """This method makes get_transport() return the given 'transport' for its queue."""
+    _transports[transport.queue_name] = transport
+    return transport
+
+def prewarm_transport(force=False):
+    # -*- coding: utf-8 -*-
+    """This method creates the SQS client and the transport for the default queue ahead
+    of their first use, and resolves the queue URL if it isn't given by "QUEUE_URL". It
+    is meant to be called during the Lambda init phase, and does nothing unless the
+    "PREWARM_SQS_CLIENT" environment variable is "true" and it runs in Lambda (or 'force'
+    is True). Errors are logged rather than raised, as the client will be
+    created again when it is needed.
+
+    Returns
+    -------
+    bool
+        True if the client was created.
+    """
+    if os.environ.get("PREWARM_SQS_CLIENT", "false").lower() != "true":
+        return False
+    if not force and not os.environ.get("AWS_LAMBDA_FUNCTION_NAME", None):
+        return False
+    if get_transport_backend() != "sqs":
+        return False
+    try:
+        get_sqs_client()
+        transport = get_transport()
+        if transport:
+            transport.queue_url
+        return True
+    except Exception:
+        logger.exception("===> EXCEPTION CAUGHT: while prewarming the SQS client")
+        return False
+
+def reset_transports():
+    # -*- coding: utf-8 -*-
+    """This method discards the cached SQS client and transports (e.g. between tests that
+    each mock a fresh SQS environment).
+    """
+    global _sqs_client
+    _sqs_client = None
+    _transports.clear()
@@ -0,0 +1,104 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the rate limiting and staggering in "backpressure.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+
+import botocore
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from backpressure import (SQS_MAX_DELAY_SECONDS, TokenBucket, get_fanout_delays, get_rate_factor,
+                          is_throttling_error, record_success, record_throttle, reset_backpressure)
+
+
+@pytest.fixture(autouse=True)
+def clean_backpressure():
+    reset_backpressure()
+    yield
+    reset_backpressure()
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def throttling_error(code="RequestLimitExceeded"):
+    return botocore.exceptions.ClientError({ "Error": { "Code": code, "Message": "slow down" } }, "CreateTags")
+
+class TestTokenBucket():
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(burst=2, clock=FakeClock())
+        assert(bucket.reserve(5, rate=2) == [ 0.0, 0.0, 0.5, 1.0, 1.5 ])
+    def test_bucket_refills_over_time(self):
+        clock = FakeClock()
+        bucket = TokenBucket(burst=2, clock=clock)
+        bucket.reserve(4, rate=2) # 2 tokens in debt
+        clock.now = 2.0           # 4 tokens refilled, but the bucket holds at most 2
+        assert(bucket.reserve(3, rate=2) == [ 0.0, 0.0, 0.5 ])
+    def test_debt_is_capped(self):
+        clock = FakeClock()
+        bucket = TokenBucket(burst=1, clock=clock, max_delay=2)
+        assert(bucket.reserve(5, rate=1) == [ 0.0, 1.0, 2.0 ])
+        assert(bucket.reserve(1, rate=1) == [])
+        clock.now = 1.0
+        assert(bucket.reserve(2, rate=1) == [ 2.0 ])
+
+class TestFanoutDelays():
+    def test_no_delays_by_default(self):
+        assert(get_fanout_delays(25) is None)
+    def test_stagger_window(self, monkeypatch):
+        monkeypatch.setenv("STAGGER_WINDOW_SECONDS", "10")
+        assert(get_fanout_delays(5) == [ 0, 2, 4, 6, 8 ])
+    def test_rate_limit(self, monkeypatch):
+        monkeypatch.setenv("FANOUT_RATE_PER_SECOND", "1")
+        monkeypatch.setenv("FANOUT_BURST", "2")
+        delays = get_fanout_delays(5)
+        assert(delays[:2] == [ 0, 0 ] and delays[2:] >= [ 1, 2, 3 ])
+    def test_stagger_window_is_capped(self, monkeypatch):
+        monkeypatch.setenv("STAGGER_WINDOW_SECONDS", "5000")
+        assert(get_fanout_delays(10) == [ 90 * i for i in range(10) ])
+    def test_messages_that_cannot_be_paced_are_held_back(self, monkeypatch):
+        monkeypatch.setenv("FANOUT_RATE_PER_SECOND", "1")
+        monkeypatch.setenv("FANOUT_BURST", "1")
+        delays = get_fanout_delays(1000)
+        assert(len(delays) == SQS_MAX_DELAY_SECONDS + 1 and max(delays) == SQS_MAX_DELAY_SECONDS)
+        assert(len(get_fanout_delays(10)) <= 1), "Expecting the bucket's debt not to grow past the maximum delay"
+    def test_throttling_slows_later_splits(self, monkeypatch):
+        monkeypatch.setenv("STAGGER_WINDOW_SECONDS", "10")
+        record_throttle()
+        assert(get_rate_factor() == 0.5)
+        assert(get_fanout_delays(5) == [ 0, 4, 8, 12, 16 ])
+        for i in range(100):
+            record_success()
+        assert(get_rate_factor() == 1.0)
+
+class TestThrottlingErrors():
+    def test_throttling_error_codes(self):
+        assert(is_throttling_error(throttling_error("RequestLimitExceeded")))
+        assert(is_throttling_error(throttling_error("Throttling")))
+        assert(not is_throttling_error(throttling_error("InvalidInstanceID.NotFound")))
+        assert(not is_throttling_error(ValueError("Throttling")))
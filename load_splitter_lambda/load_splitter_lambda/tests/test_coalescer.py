@@ -0,0 +1,76 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the coalescing of small events in "coalescer.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from coalescer import coalesce_tag_work, is_coalescible
+
+
+def generate_event(resource_ids, *tags):
+    return {
+        "detail": {
+            "eventName": "CreateTags",
+            "awsRegion": "us-west-2",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": resource_id } for resource_id in resource_ids ] },
+                "tagSet": { "items": [ { "key": key, "value": value } for key, value in tags ] }
+            }
+        }
+    }
+
+def unit_keys(units):
+    return [ [ (message_id, tag["key"]) for message_id, event, tag in unit ] for unit in units ]
+
+class TestCoalescer():
+    def test_tags_are_grouped_by_resources(self):
+        messages = [
+            ("m1", generate_event(["i-1"], ("a", "1"))),
+            ("m2", generate_event(["i-2"], ("a", "1"))),
+            ("m3", generate_event(["i-1"], ("b", "2"))),
+        ]
+        assert(unit_keys(coalesce_tag_work(messages, 10)) == [ [ ("m1", "a"), ("m3", "b") ], [ ("m2", "a") ] ])
+    def test_units_hold_at_most_max_tags(self):
+        messages = [ (f"m{i}", generate_event(["i-1"], (f"key-{i}", "v"))) for i in range(5) ]
+        assert([ len(unit) for unit in coalesce_tag_work(messages, 2) ] == [ 2, 2, 1 ])
+    def test_repeated_tag_key_starts_a_new_unit(self):
+        messages = [
+            ("m1", generate_event(["i-1"], ("a", "old"))),
+            ("m2", generate_event(["i-1"], ("a", "new"))),
+        ]
+        units = coalesce_tag_work(messages, 10)
+        assert([ [ tag["value"] for message_id, event, tag in unit ] for unit in units ] == [ [ "old" ], [ "new" ] ])
+    def test_events_without_resources_are_not_merged(self):
+        messages = [ ("m1", generate_event([], ("a", "1"))), ("m2", generate_event([], ("b", "2"))) ]
+        assert(len(coalesce_tag_work(messages, 10)) == 2)
+    def test_only_small_leaf_events_are_coalescible(self, monkeypatch):
+        assert(is_coalescible(generate_event(["i-1"], ("a", "1"))))
+        assert(not is_coalescible(generate_event(["i-1"], ("a", "1"), ("b", "2")))) # two chunks by default
+        monkeypatch.setenv("CHUNK_SIZE", "5")
+        assert(is_coalescible(generate_event(["i-1"], ("a", "1"), ("b", "2"))))
+        range_event = dict(generate_event(["i-1"], ("a", "1")), loadSplitter={ "range": True, "depth": 1 })
+        assert(not is_coalescible(range_event))
+        assert(not is_coalescible({ "detail": { "eventName": "RunInstances" } }))
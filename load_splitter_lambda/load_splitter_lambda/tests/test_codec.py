@@ -0,0 +1,117 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the message codec in "codec.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from codec import (CLAIM_CHECK_ATTRIBUTE, CONTENT_ENCODING_ATTRIBUTE, FileBlobStore,
+                   MessageCodec, get_message_compression, get_message_size, project_event)
+
+
+def generate_cloudtrail_event():
+    return {
+        "version": "0",
+        "id": "6a7e8feb-b491-4cf7-a9f1-bf3703467718",
+        "source": "aws.ec2",
+        "resources": [],
+        "detail": {
+            "eventID": "1a2b3c4d",
+            "eventSource": "ec2.amazonaws.com",
+            "eventName": "CreateTags",
+            "userIdentity": { "type": "IAMUser", "arn": "arn:aws:iam::123456789012:user/someone" },
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": "tag-key-1", "value": "tag-value-1" } ] },
+                "dryRun": False
+            },
+            "responseElements": { "requestId": "e1a9b3a5", "_return": True }
+        }
+    }
+
+def to_lambda_attributes(attributes):
+    # Lambda hands message attributes over with keys in lower camel case
+    return { name: { "stringValue": attribute["StringValue"], "dataType": attribute["DataType"] }
+             for name, attribute in attributes.items() }
+
+class TestMessageCodec():
+    def test_projection_keeps_only_needed_fields(self):
+        projected = project_event(generate_cloudtrail_event())
+        assert(projected == {
+            "version": "0",
+            "id": "6a7e8feb-b491-4cf7-a9f1-bf3703467718",
+            "source": "aws.ec2",
+            "detail": {
+                "eventID": "1a2b3c4d",
+                "eventSource": "ec2.amazonaws.com",
+                "eventName": "CreateTags",
+                "requestParameters": {
+                    "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                    "tagSet": { "items": [ { "key": "tag-key-1", "value": "tag-value-1" } ] }
+                }
+            }
+        })
+    def test_plain_codec_changes_nothing(self):
+        body = json.dumps(generate_cloudtrail_event())
+        assert(MessageCodec().encode(body) == (body, {}))
+    @pytest.mark.parametrize("compression", ["zlib", "gzip"])
+    def test_compression_round_trip(self, compression):
+        codec = MessageCodec(compression=compression, compression_min_bytes=10)
+        body = json.dumps([generate_cloudtrail_event()] * 20)
+        encoded, attributes = codec.encode(body)
+        assert(attributes[CONTENT_ENCODING_ATTRIBUTE]["StringValue"] == compression)
+        assert(len(encoded) < len(body))
+        assert(codec.decode(encoded, to_lambda_attributes(attributes)) == body)
+    def test_small_bodies_are_not_compressed(self):
+        codec = MessageCodec(compression="zlib", compression_min_bytes=1000)
+        assert(codec.encode("{}") == ("{}", {}))
+    def test_compression_threshold_counts_bytes(self):
+        codec = MessageCodec(compression="zlib", compression_min_bytes=100)
+        body = json.dumps("\u00e9" * 60, ensure_ascii=False) # 62 characters, but 122 bytes
+        assert(CONTENT_ENCODING_ATTRIBUTE in codec.encode(body)[1])
+    def test_compression_setting_is_parsed(self, monkeypatch):
+        monkeypatch.delenv("MESSAGE_COMPRESSION", raising=False)
+        assert(get_message_compression() is None)
+        monkeypatch.setenv("MESSAGE_COMPRESSION", "None")
+        assert(get_message_compression() is None)
+        monkeypatch.setenv("MESSAGE_COMPRESSION", "GZIP")
+        assert(get_message_compression() == "gzip")
+        for value in ("nonezlib", "brotli"):
+            monkeypatch.setenv("MESSAGE_COMPRESSION", value)
+            with pytest.raises(ValueError):
+                get_message_compression()
+    def test_oversized_bodies_go_to_blob_store(self, tmp_path):
+        codec = MessageCodec(max_bytes=100, blob_store=FileBlobStore(str(tmp_path)))
+        body = json.dumps(generate_cloudtrail_event())
+        encoded, attributes = codec.encode(body)
+        assert(attributes[CLAIM_CHECK_ATTRIBUTE]["StringValue"] == "file")
+        assert(get_message_size(encoded, attributes) <= 100)
+        assert(codec.decode(encoded, to_lambda_attributes(attributes)) == body)
+    def test_claim_check_without_blob_store_fails(self):
+        with pytest.raises(ValueError):
+            MessageCodec().decode("some-key", { CLAIM_CHECK_ATTRIBUTE: { "stringValue": "file" } })
@@ -26,13 +26,16 @@
 # References:
 #   https://docs.pytest.org/en/stable/index.html
 
+import copy
 import json
 import sys
 
 import pytest
 
 sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
-from event_queue import extract_event_from_queue_message
+from event_queue import (ITEMS_PLACEHOLDER, SQS_MAX_BATCH_BYTES, batch_messages,
+                         encode_split_events, extract_event_from_queue_message,
+                         get_queue_records, send_message_batch)
 
 
 def generate_sqs_event():
@@ -47,7 +50,7 @@ def generate_sqs_event():
             "Records": [
                 {
                     "body":
-                        "{'detail': {'eventSource': 'ec2.amazonaws.com', 'eventName': 'CreateTags', 'awsRegion': 'us-west-2', 'requestParameters': {'resourcesSet': {'items': [{'resourceId': 'i-00000000000000000'}]}, 'tagSet': {'items': [{'key': 'tag-key-1', 'value': 'tag-value-1'}]}}}}",
+                        '{"detail": {"eventSource": "ec2.amazonaws.com", "eventName": "CreateTags", "awsRegion": "us-west-2", "requestParameters": {"resourcesSet": {"items": [{"resourceId": "i-00000000000000000"}]}, "tagSet": {"items": [{"key": "tag-key-1", "value": "tag-value-1"}]}}}}',
                     "eventSource": "aws:sqs"
                 }
             ]
@@ -119,7 +122,87 @@ class TestEventQueue():
         input = generate_sqs_event_with_bad_body_json()
         with pytest.raises(json.JSONDecodeError):
             res = extract_event_from_queue_message(input)
+    def test_sqs_body_with_apostrophe(self):
+        input = generate_sqs_event()
+        input["Records"][0]["body"] = input["Records"][0]["body"].replace("tag-value-1", "it's a tag")
+        expected_output = generate_create_tags_event()
+        expected_output["detail"]["requestParameters"]["tagSet"]["items"][0]["value"] = "it's a tag"
+        res = extract_event_from_queue_message(input)
+        assert(res == expected_output)
     def test_bad_sqs_no_body(self):
         input = generate_sqs_event_without_body()
         res = extract_event_from_queue_message(input)
         assert(res == None)
+    def test_sqs_batch_records(self):
+        input = generate_sqs_event()
+        input["Records"].append(generate_sqs_event()["Records"][0])
+        assert(len(get_queue_records(input)) == 2)
+    def test_ec2_event_has_no_queue_records(self):
+        assert(get_queue_records(generate_ec2_event()) == [])
+        assert(get_queue_records(generate_create_tags_event()) == [])
+
+class FakeTransport():
+    """A stand-in for an SqsTransport which fails each entry id listed in 'failures'
+    once, with the given 'sender_fault', and records every batch that it is sent."""
+    def __init__(self, failures, sender_fault=False):
+        self.failures = set(failures)
+        self.sender_fault = sender_fault
+        self.batches = []
+    def send_message_batch(self, Entries):
+        self.batches.append([entry["Id"] for entry in Entries])
+        self.entries = Entries
+        failed = [ entry for entry in Entries if entry["Id"] in self.failures ]
+        self.failures -= { entry["Id"] for entry in failed }
+        return {
+            "Successful": [ { "Id": entry["Id"] } for entry in Entries if entry not in failed ],
+            "Failed":     [ { "Id": entry["Id"], "SenderFault": self.sender_fault, "Code": "InternalError" } for entry in failed ]
+        }
+
+class TestMessageBatching():
+    def test_batches_hold_at_most_10_entries(self):
+        batches = list(batch_messages([("{}", {})] * 25))
+        assert([len(batch) for batch in batches] == [10, 10, 5])
+        assert([index for batch in batches for index, body in batch] == list(range(25)))
+    def test_batches_respect_byte_limit(self):
+        body = "x" * (SQS_MAX_BATCH_BYTES // 3)
+        batches = list(batch_messages([(body, {})] * 7))
+        assert([len(batch) for batch in batches] == [3, 3, 1])
+    def test_partial_failure_resends_only_failed_entries(self):
+        transport = FakeTransport(failures=["1", "3"])
+        results = [False] * 5
+        send_message_batch(transport, list(enumerate([("{}", {})] * 5)), results)
+        assert(transport.batches == [["0", "1", "2", "3", "4"], ["1", "3"]])
+        assert(results == [True] * 5)
+    def test_sender_fault_is_not_resent(self):
+        transport = FakeTransport(failures=["2"], sender_fault=True)
+        results = [False] * 3
+        send_message_batch(transport, list(enumerate([("{}", {})] * 3)), results)
+        assert(transport.batches == [["0", "1", "2"]])
+        assert(results == [True, True, False])
+
+    def test_delays_are_sent(self):
+        transport = FakeTransport(failures=[])
+        results = [False] * 3
+        send_message_batch(transport, list(enumerate([("{}", {})] * 3)), results, delays=[0, 5, 10])
+        assert([entry.get("DelaySeconds", 0) for entry in transport.entries] == [0, 5, 10])
+        assert("DelaySeconds" not in transport.entries[0])
+
+class TestSplitEncoder():
+    def test_encoded_events_match_copies_of_event(self):
+        event = generate_create_tags_event()
+        event["detail"]["responseElements"] = { "requestId": "abc", "_return": True }
+        chunks = [ [ { "key": f"key-{i}", "value": "it's \"quoted\"" } ] for i in range(3) ]
+        original = copy.deepcopy(event)
+        bodies = list(encode_split_events(event, chunks))
+        assert(event == original)
+        for body, chunk in zip(bodies, chunks):
+            expected = generate_create_tags_event()
+            expected["detail"]["responseElements"] = event["detail"]["responseElements"]
+            expected["detail"]["requestParameters"]["tagSet"]["items"] = chunk
+            assert(json.loads(body) == expected)
+    def test_placeholder_text_inside_event_is_left_alone(self):
+        event = generate_create_tags_event()
+        event["detail"]["userAgent"] = ITEMS_PLACEHOLDER
+        bodies = list(encode_split_events(event, [[1], [2]]))
+        assert([json.loads(body)["detail"]["requestParameters"]["tagSet"]["items"] for body in bodies] == [[1], [2]])
+        assert(json.loads(bodies[0])["detail"]["userAgent"] == ITEMS_PLACEHOLDER)
@@ -0,0 +1,118 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the idempotency guard in "idempotency.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+import time
+
+import pytest
+from mock import patch
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from idempotency import (DictIdempotencyStore, IdempotencyGuard, LruCache,
+                         SqliteIdempotencyStore, get_idempotency_key)
+
+
+def generate_event(event_id="1a2b3c4d"):
+    return {
+        "detail": {
+            "eventID": event_id,
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-1" }, { "resourceId": "i-0" } ] }
+            }
+        }
+    }
+
+TAG = { "key": "tag-key-1", "value": "tag-value-1" }
+
+class TestIdempotencyKey():
+    def test_key_is_stable(self):
+        assert(get_idempotency_key(generate_event(), TAG) == get_idempotency_key(generate_event(), dict(TAG)))
+    def test_key_depends_on_event_and_tag(self):
+        key = get_idempotency_key(generate_event(), TAG)
+        assert(key != get_idempotency_key(generate_event("5e6f7a8b"), TAG))
+        assert(key != get_idempotency_key(generate_event(), dict(TAG, value="other")))
+    def test_no_key_without_event_id(self):
+        assert(get_idempotency_key({ "detail": {} }, TAG) is None)
+
+class TestLruCache():
+    def test_least_recently_used_key_is_evicted(self):
+        cache = LruCache(max_size=2, ttl_seconds=60)
+        cache.add("a")
+        cache.add("b")
+        assert("a" in cache) # "a" is now the most recently used
+        cache.add("c")
+        assert("a" in cache and "c" in cache and "b" not in cache)
+    def test_keys_expire(self):
+        cache = LruCache(max_size=2, ttl_seconds=-1)
+        cache.add("a")
+        assert("a" not in cache)
+
+@pytest.fixture(params=["dict", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "dict":
+        return DictIdempotencyStore()
+    return SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+
+class TestIdempotencyStores():
+    def test_conditional_claim(self, store):
+        assert(store.claim("a", time.time() + 60))
+        assert(not store.claim("a", time.time() + 60)), "Expecting a claim in progress to block other claims"
+        store.mark_done("a", time.time() + 60)
+        assert(not store.claim("a", time.time() + 60))
+    def test_expired_claims_can_be_made_again(self, store):
+        assert(store.claim("a", time.time() - 1))
+        assert(store.claim("a", time.time() + 60))
+    def test_released_claims_can_be_made_again(self, store):
+        assert(store.claim("a", time.time() + 60))
+        store.release("a")
+        assert(store.claim("a", time.time() + 60))
+        store.mark_done("a", time.time() + 60)
+        store.release("a")
+        assert(not store.claim("a", time.time() + 60)), "Expecting a done claim not to be released"
+    def test_guards_share_the_store(self, store):
+        # two guards stand for two Lambda containers, each with its own cache
+        first, second = IdempotencyGuard(store), IdempotencyGuard(store)
+        assert(first.claim("a"))
+        assert(not second.claim("a")), "Expecting a concurrent delivery to be skipped while the tag is processed"
+        first.mark_done("a")
+        assert(not second.claim("a"))
+        assert(not first.claim("a"))
+        assert(first.stats() == { "hits": 1, "misses": 1 })
+        assert(second.stats() == { "hits": 2, "misses": 0 })
+    def test_failed_tag_can_be_claimed_again(self, store):
+        first, second = IdempotencyGuard(store), IdempotencyGuard(store)
+        assert(first.claim("a"))
+        first.release("a")
+        assert(second.claim("a"))
+
+class TestIdempotencyGuard():
+    def test_failure_to_mark_done_is_not_raised(self):
+        store = DictIdempotencyStore()
+        guard = IdempotencyGuard(store)
+        assert(guard.claim("a"))
+        with patch.object(store, "mark_done", side_effect=RuntimeError("store unavailable")):
+            guard.mark_done("a")
+        assert(not guard.claim("a")), "Expecting the tag to be remembered by the guard's cache"
@@ -0,0 +1,203 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the job tracking in "jobs.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+import event_queue
+import jobs
+import main
+from backpressure import reset_backpressure
+from event_queue import SPLIT_METADATA_KEY, get_split_metadata
+from idempotency import reset_idempotency_guard
+from jobs import DictJobStore, JobTracker, SqliteJobStore, get_job_tracker, record_tags_done, reset_job_tracker
+from local_runner import run_locally
+from scheduler import reset_tag_duration_estimate
+from telemetry import reset_metrics
+from transport import reset_transports
+
+
+@pytest.fixture(params=["dict", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "dict":
+        return DictJobStore()
+    return SqliteJobStore(str(tmp_path / "jobs.db"))
+
+@pytest.fixture(scope="function")
+def job_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("QUEUE_NAME", "local")
+    monkeypatch.setenv("METRICS_NAMESPACE", "none")
+    monkeypatch.setenv("JOB_SQLITE_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.delenv("JOB_TABLE", raising=False)
+    monkeypatch.delenv("JOB_EVENT_BUS", raising=False)
+    for reset in (reset_transports, reset_tag_duration_estimate, reset_idempotency_guard, reset_metrics,
+                  reset_backpressure, reset_job_tracker):
+        reset()
+    yield
+    reset_job_tracker()
+    reset_transports()
+
+class TestJobTracker():
+    def test_completes_once_when_last_tags_are_done(self, store):
+        tracker = JobTracker(store)
+        job_id = tracker.start_job(5)
+        assert tracker.record_done(job_id, [ "a", "b" ], 0.5, [ "a", "b" ]) is None
+        assert tracker.record_done(job_id, [ "c", "d" ], 1.5, [ "c", "d" ]) is None
+        completion = tracker.record_done(job_id, [ "e" ], 0.1, [ "e" ])
+        assert completion["jobId"] == job_id
+        assert completion["total"] == 5
+        assert completion["makespanSeconds"] >= 0
+        assert completion["slowestSubTask"] == { "tags": [ "c", "d" ], "seconds": 1.5 }
+        assert tracker.record_done(job_id, [ "e" ], 0.1, [ "e" ]) is None, "Expecting a job to complete just once"
+
+    def test_repeated_tags_are_counted_once(self, store):
+        tracker = JobTracker(store)
+        job_id = tracker.start_job(2)
+        assert tracker.record_done(job_id, [ "a" ], 0.1, [ "a" ]) is None
+        assert tracker.record_done(job_id, [ "a" ], 0.1, [ "a" ]) is None, "Expecting a repeated tag not to complete the job"
+        assert tracker.record_done(job_id, [ "b" ], 0.1, [ "b" ])["total"] == 2
+
+    def test_dropped_tags_are_taken_off_the_total(self, store):
+        tracker = JobTracker(store)
+        job_id = tracker.start_job(3)
+        assert tracker.drop_tags(job_id, [ "c" ]) is None
+        assert tracker.record_done(job_id, [ "a" ], 0.1, [ "a" ]) is None
+        assert tracker.drop_tags(job_id, [ "c" ]) is None, "Expecting a tag to be dropped once"
+        assert tracker.record_done(job_id, [ "b" ], 0.1, [ "b" ])["total"] == 2
+
+    def test_job_completes_when_its_last_tags_are_dropped(self, store):
+        tracker = JobTracker(store)
+        job_id = tracker.start_job(2)
+        assert tracker.record_done(job_id, [ "a" ], 0.1, [ "a" ]) is None
+        assert tracker.drop_tags(job_id, [ "b" ])["total"] == 1
+        assert tracker.drop_tags(tracker.start_job(1), [ "a" ]) is None, "Expecting a job without tags not to complete"
+
+    def test_unknown_and_expired_jobs_never_complete(self, store):
+        tracker = JobTracker(store, ttl_seconds=-1)
+        job_id = tracker.start_job(1)
+        assert tracker.record_done(job_id, [ "a" ], 0.1, [ "a" ]) is None
+        assert tracker.record_done("no-such-job", [ "a" ], 0.1, [ "a" ]) is None
+
+    def test_tracking_is_off_without_a_store(self, monkeypatch):
+        monkeypatch.delenv("JOB_TABLE", raising=False)
+        monkeypatch.delenv("JOB_SQLITE_PATH", raising=False)
+        reset_job_tracker()
+        assert get_job_tracker() is None
+        assert record_tags_done("some-job", [ { "key": "a" } ], 0.1) is None
+
+def test_completion_is_sent_to_event_bus(job_environment, monkeypatch):
+    class FakeEventsClient():
+        def __init__(self):
+            self.entries = []
+        def put_events(self, Entries):
+            self.entries.extend(Entries)
+            return { "FailedEntryCount": 0 }
+    client = FakeEventsClient()
+    monkeypatch.setattr(jobs, "_events_client", client)
+    monkeypatch.setenv("JOB_EVENT_BUS", "default")
+    job_id = get_job_tracker().start_job(1)
+    completion = record_tags_done(job_id, [ { "key": "a" } ], 0.1)
+    assert len(client.entries) == 1
+    assert client.entries[0]["DetailType"] == jobs.JOB_COMPLETED_DETAIL_TYPE
+    assert json.loads(client.entries[0]["Detail"]) == completion
+
+def test_split_event_completes_its_job(job_environment, monkeypatch):
+    monkeypatch.setenv("TREE_BRANCHING_FACTOR", "3") # so that the job spans two levels of messages
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: None)
+    job_ids = set()
+    handle_event = main.handle_event
+    def record_job_id(event, *args, **kwargs):
+        job_ids.add(get_split_metadata(event).get("jobId", None))
+        return handle_event(event, *args, **kwargs)
+    monkeypatch.setattr(main, "handle_event", record_job_id)
+    completions = []
+    emit_job_completed = jobs.emit_job_completed
+    monkeypatch.setattr(jobs, "emit_job_completed", lambda completion: completions.append(completion) or emit_job_completed(completion))
+    event = {
+        "detail": {
+            "eventName": "CreateTags",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(25) ] }
+            },
+        }
+    }
+    run_locally([ event ], processes=0)
+    assert len(completions) == 1, "Expecting the job to complete once all its tags are done"
+    assert completions[0]["total"] == 25
+    assert job_ids == { None, completions[0]["jobId"] }, "Expecting every queued message to carry the job ID"
+
+def test_redelivered_tag_does_not_complete_its_job(job_environment, monkeypatch):
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: None)
+    completions = []
+    monkeypatch.setattr(jobs, "emit_job_completed", completions.append)
+    job_id = get_job_tracker().start_job(2)
+    event = {
+        "id": "event-1",
+        "detail": {
+            "eventName": "CreateTags",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": "a", "value": "1" }, { "key": "b", "value": "2" } ] }
+            },
+        },
+        SPLIT_METADATA_KEY: { "jobId": job_id, "jobTotal": 2 },
+    }
+    tag_a, tag_b = event["detail"]["requestParameters"]["tagSet"]["items"]
+    for delivery in range(2):
+        reset_idempotency_guard() # as if delivered to another container
+        main.process_tag_of_event_once(event, tag_a)
+    assert completions == [], "Expecting a redelivered tag to be counted once"
+    main.process_tag_of_event_once(event, tag_b)
+    assert len(completions) == 1
+
+def test_split_with_failed_sends_still_completes_its_job(job_environment, monkeypatch):
+    queued = []
+    def enqueue_message_bodies(bodies, *args, **kwargs):
+        queued.extend(bodies)
+        return [ index == 0 for index in range(len(queued)) ] # only the first message is queued
+    monkeypatch.setattr(event_queue, "enqueue_message_bodies", enqueue_message_bodies)
+    completions = []
+    monkeypatch.setattr(jobs, "emit_job_completed", completions.append)
+    event = {
+        "detail": {
+            "eventName": "CreateTags",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(4) ] }
+            },
+        }
+    }
+    outcomes = event_queue.queue_chunks(event, [ event_queue.get_reference_to_embedded_list(event)[:2],
+                                                  event_queue.get_reference_to_embedded_list(event)[2:] ])
+    assert [ queued for chunk, queued in outcomes ] == [ True, False ]
+    job_id = get_split_metadata(json.loads(queued[0]))["jobId"]
+    assert record_tags_done(job_id, outcomes[0][0], 0.1)["total"] == 2, \
+        "Expecting the job to complete once the tags that were queued are done"
+    assert len(completions) == 1
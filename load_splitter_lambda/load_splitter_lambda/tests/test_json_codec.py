@@ -0,0 +1,66 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the JSON codecs in "json_codec.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+import json_codec
+from json_codec import get_json_codec
+
+EVENT = {
+    "detail": {
+        "eventName": "CreateTags",
+        "requestParameters": {
+            "tagSet": { "items": [ { "key": "Owner", "value": "it's \"ours\" é中" } ] }
+        }
+    },
+    "_return": True,
+    "count": 3
+}
+
+AVAILABLE_CODECS = [ "json" ] + ([ "orjson" ] if json_codec.orjson else [])
+
+@pytest.fixture(params=AVAILABLE_CODECS)
+def codec(request):
+    return get_json_codec(request.param)
+
+class TestJsonCodec():
+    def test_round_trip(self, codec):
+        assert(codec.loads(codec.dumps(EVENT)) == EVENT)
+    def test_output_is_compact_and_the_same_for_every_codec(self, codec):
+        assert(codec.dumps(EVENT) == json.dumps(EVENT, separators=(",", ":"), ensure_ascii=False))
+    def test_bad_json_raises(self, codec):
+        with pytest.raises(json.JSONDecodeError):
+            codec.loads("{'detail': {}}")
+    def test_codec_from_environment(self, monkeypatch):
+        monkeypatch.setenv("JSON_CODEC", "json")
+        assert(get_json_codec().name == "json")
+        monkeypatch.setenv("JSON_CODEC", "yaml")
+        with pytest.raises(ValueError):
+            get_json_codec()
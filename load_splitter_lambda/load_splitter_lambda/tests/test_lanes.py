@@ -0,0 +1,111 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the priority lanes in "lanes.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+import boto3
+import pytest
+from moto import mock_sqs
+
+REGION_NAME = "us-west-1"
+PREFIX      = "MY_PREFIX"
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from event_queue import get_split_metadata, queue_smaller_events
+from lanes import DEFAULT_LANE, choose_lane, get_lane_queue_name, get_lane_rules
+from transport import reset_transports
+
+
+def generate_event(count, event_source="ec2.amazonaws.com", key_prefix="tag-key"):
+    return {
+        "detail": {
+            "eventSource": event_source,
+            "eventName": "CreateTags",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": f"{key_prefix}-{i}", "value": f"tag-value-{i}" } for i in range(count) ] }
+            },
+        }
+    }
+
+@pytest.fixture(scope="function")
+def lanes(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", REGION_NAME)
+    monkeypatch.setenv("QUEUE_NAME", PREFIX)
+    monkeypatch.setenv("LANE_QUEUES", json.dumps({ "bulk": f"{PREFIX}_bulk", "audit": f"{PREFIX}_audit" }))
+    monkeypatch.setenv("LANE_RULES", json.dumps([
+        { "lane": "audit", "tagKeyPattern": "Audit*" },
+        { "lane": "bulk", "minFanOut": 10 },
+        { "lane": "bulk", "eventSource": "rds.*", "maxFanOut": 5 },
+    ]))
+    reset_transports()
+
+class TestChooseLane():
+    def test_rules_are_matched_in_order(self, lanes):
+        assert choose_lane(generate_event(3), 3) == DEFAULT_LANE
+        assert choose_lane(generate_event(25), 25) == "bulk"
+        assert choose_lane(generate_event(25, key_prefix="AuditTrail"), 25) == "audit", "Expecting the first matching rule to win"
+        assert choose_lane(generate_event(3, event_source="rds.amazonaws.com"), 3) == "bulk"
+        assert choose_lane(generate_event(7, event_source="rds.amazonaws.com"), 7) == DEFAULT_LANE
+
+    def test_lane_without_queue_is_skipped(self, lanes, monkeypatch):
+        monkeypatch.setenv("LANE_RULES", json.dumps([ { "lane": "missing" }, { "lane": "bulk" } ]))
+        assert choose_lane(generate_event(1), 1) == "bulk"
+        assert get_lane_queue_name("missing") == PREFIX
+
+    def test_invalid_rules_are_rejected(self, lanes, monkeypatch):
+        monkeypatch.setenv("LANE_RULES", json.dumps([ { "lane": "bulk", "minFanOUT": 10 } ]))
+        with pytest.raises(ValueError):
+            get_lane_rules()
+
+def receive_all(queue):
+    bodies = []
+    while True:
+        messages = queue.receive_messages(MaxNumberOfMessages=10)
+        if not messages:
+            return bodies
+        for message in messages:
+            bodies.append(json.loads(message.body))
+            message.delete()
+
+@mock_sqs
+def test_split_events_are_queued_in_their_lane(lanes, monkeypatch):
+    sqs = boto3.resource("sqs")
+    default_queue = sqs.create_queue(QueueName=PREFIX)
+    bulk_queue = sqs.create_queue(QueueName=f"{PREFIX}_bulk")
+    sqs.create_queue(QueueName=f"{PREFIX}_audit")
+    queue_smaller_events(generate_event(3))
+    assert len(receive_all(default_queue)) == 3
+    monkeypatch.setenv("TREE_BRANCHING_FACTOR", "5")
+    queue_smaller_events(generate_event(25))
+    ranges = receive_all(bulk_queue)
+    assert len(ranges) == 5
+    assert all(get_split_metadata(event) == { "range": True, "depth": 1, "lane": "bulk" } for event in ranges)
+    # a range holds fewer tags than the "bulk" rule's minimum, but stays in its lane
+    queue_smaller_events(ranges[0])
+    assert len(receive_all(bulk_queue)) == 5
+    assert not receive_all(default_queue)
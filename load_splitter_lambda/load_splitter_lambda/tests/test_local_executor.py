@@ -0,0 +1,63 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the thread pool in "local_executor.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+import threading
+import time
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from local_executor import process_tags_locally
+
+
+class TestLocalExecutor():
+    def test_tags_are_processed_in_parallel(self):
+        lock = threading.Lock()
+        running = [0, 0] # currently running, most ever running
+        def process_tag(tag):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return tag * 10
+        results, spilled = process_tags_locally(list(range(8)), process_tag, max_workers=4, budget_seconds=10)
+        assert(spilled == [])
+        assert([result.result for result in results] == [tag * 10 for tag in range(8)])
+        assert(running[1] == 4)
+    def test_exceptions_are_collected_per_tag(self):
+        def process_tag(tag):
+            if tag == 2:
+                raise ValueError("bad tag")
+            return tag
+        results, spilled = process_tags_locally([1, 2, 3], process_tag, max_workers=2, budget_seconds=10)
+        assert([result.tag for result in results] == [1, 2, 3])
+        assert(isinstance(results[1].exception, ValueError))
+        assert(results[0].exception is None and results[2].exception is None)
+    def test_tags_not_started_within_budget_are_spilled(self):
+        results, spilled = process_tags_locally([1, 2, 3, 4], lambda tag: time.sleep(0.2), max_workers=1, budget_seconds=0.05)
+        assert([result.tag for result in results] == [1])
+        assert(spilled == [2, 3, 4])
@@ -0,0 +1,111 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for running the load splitter locally with "local_runner.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+import main
+import transport
+from backpressure import reset_backpressure
+from idempotency import reset_idempotency_guard
+from local_runner import run_locally
+from scheduler import reset_tag_duration_estimate
+from telemetry import reset_metrics
+from transport import reset_transports
+
+
+@pytest.fixture(scope="function")
+def local_environment(monkeypatch):
+    monkeypatch.setenv("QUEUE_NAME", "local")
+    monkeypatch.setenv("METRICS_NAMESPACE", "none")
+    reset_transports()
+    reset_tag_duration_estimate()
+    reset_idempotency_guard()
+    reset_metrics()
+    reset_backpressure()
+    yield
+    reset_transports()
+
+def create_tags_event(count):
+    return {
+        "detail": {
+            "eventSource": "ec2.amazonaws.com",
+            "eventName": "CreateTags",
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(count) ] }
+            },
+        }
+    }
+
+def test_run_in_process(local_environment, monkeypatch):
+    processed = []
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: processed.append(tag["key"]))
+    out = run_locally([ create_tags_event(25), create_tags_event(3) ], processes=0)
+    assert out["events"] == 2
+    assert out["deadLetters"] == []
+    assert sorted(processed) == sorted([ f"tag-key-{i}" for i in range(25) ] + [ f"tag-key-{i}" for i in range(3) ]), \
+        "Expecting every tag to be processed once"
+
+def test_run_in_process_gives_up_on_failing_messages(local_environment, monkeypatch):
+    def process_one_tag(tag):
+        if tag["key"] == "tag-key-1":
+            raise RuntimeError("failed to process tag")
+    monkeypatch.setattr(main, "process_one_tag", process_one_tag)
+    out = run_locally([ create_tags_event(3) ], processes=0, max_receives=2)
+    assert len(out["deadLetters"]) == 1, "Expecting the failing message to be given up on"
+    dead_letter = out["deadLetters"][0]
+    assert dead_letter["attributes"]["ApproximateReceiveCount"] == "2"
+    assert "tag-key-1" in dead_letter["body"]
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs the fork start method")
+def test_run_in_worker_processes(local_environment, monkeypatch):
+    context = multiprocessing.get_context("fork")
+    processed = context.Value("i", 0)
+    def process_one_tag(tag):
+        with processed.get_lock():
+            processed.value += 1
+    monkeypatch.setattr(main, "process_one_tag", process_one_tag) # inherited by the forked workers
+    out = run_locally([ create_tags_event(25) ], processes=2, start_method="fork")
+    assert out["deadLetters"] == []
+    assert processed.value == 25, "Expecting every tag to be processed by the worker processes"
+
+def test_run_restores_the_queue_name(local_environment, monkeypatch):
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: None)
+    out = run_locally([ create_tags_event(25) ], processes=0, queue_name="other")
+    assert out["deadLetters"] == []
+    assert os.environ["QUEUE_NAME"] == "local", "Expecting the queue name of the environment to be left as it was"
+    assert transport._transports == {}, "Expecting the in-process transports to be uninstalled"
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs the fork start method")
+def test_run_fails_when_a_worker_exits_early(local_environment, monkeypatch):
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: os._exit(1)) # inherited by the forked workers
+    with pytest.raises(RuntimeError):
+        run_locally([ create_tags_event(25) ], processes=2, start_method="fork")
@@ -29,6 +29,7 @@ import os
 import sys
 
 import boto3
+import botocore
 import pytest
 from mock import patch
 from moto import mock_sqs
@@ -37,13 +38,23 @@ REGION_NAME = "us-west-1"
 PREFIX      = "MY_PREFIX"
 
 sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from backpressure import get_rate_factor, reset_backpressure
+from idempotency import get_idempotency_guard, reset_idempotency_guard
 from main import lambda_handler
+from scheduler import reset_tag_duration_estimate
+from telemetry import reset_metrics
+from transport import reset_transports
 
 
 @pytest.fixture(scope="function")
 def aws_credentials():
     os.environ["AWS_DEFAULT_REGION"] = REGION_NAME
     os.environ["QUEUE_NAME"]         = PREFIX
+    reset_transports() # don't reuse an SQS client created under a previous mock
+    reset_tag_duration_estimate()
+    reset_idempotency_guard()
+    reset_metrics()
+    reset_backpressure()
 
 class TestData:
     def create_3_tags_event():
@@ -131,3 +142,357 @@ def test_lambda_handler_with_3_tags(aws_credentials):
     output_message = json.loads(sqs_messages[0].body)
     tag_count_after = len(output_message["detail"]["requestParameters"]["tagSet"]["items"])
     assert tag_count_after == 1, "Expecting just one tag in the output"
+
+@mock_sqs
+def test_lambda_handler_with_25_tags(aws_credentials):
+    # TEST SETUP ---------------------------------------------------------------------------
+    COUNT = 25 # more than fits in one SendMessageBatch call
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    event["detail"]["requestParameters"]["tagSet"]["items"] = [
+        { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(COUNT) ]
+    # RUN TEST -----------------------------------------------------------------------------
+    from main import lambda_handler
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 202,
+        "count":      COUNT,
+        "body":       f"split '{COUNT}' tags into '{COUNT}' queued messages"
+    }, f"Expecting lambda to return saying it split '{COUNT}' tags into '{COUNT}' queued messages"
+    keys = set()
+    while True:
+        sqs_messages = queue.receive_messages(MaxNumberOfMessages=10)
+        if not sqs_messages:
+            break
+        for sqs_message in sqs_messages:
+            items = json.loads(sqs_message.body)["detail"]["requestParameters"]["tagSet"]["items"]
+            assert len(items) == 1, "Expecting just one tag in each output message"
+            keys.add(items[0]["key"])
+            sqs_message.delete()
+    assert len(keys) == COUNT, f"Expecting one message per tag, '{COUNT}' in total"
+
+@mock_sqs
+def test_lambda_handler_with_3_tags_in_chunks_of_2(aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("CHUNK_SIZE", "2")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 202,
+        "count":      3,
+        "body":       "split '3' tags into '2' queued messages"
+    }, "Expecting lambda to return saying it split '3' tags into '2' queued messages"
+    sqs_messages = queue.receive_messages(MaxNumberOfMessages=10)
+    tag_counts = sorted(len(json.loads(m.body)["detail"]["requestParameters"]["tagSet"]["items"]) for m in sqs_messages)
+    assert tag_counts == [1, 2], "Expecting one message with 2 tags and one with 1 tag"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_with_3_tags_fitting_one_chunk(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("CHUNK_SIZE", "5")
+    event = TestData.create_3_tags_event()
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 200,
+        "count":      3,
+        "body":       "handled 3 tags"
+    }, "Expecting lambda to process all 3 tags inline"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_with_sqs_batch_and_one_bad_message(sleep, aws_credentials):
+    # TEST SETUP ---------------------------------------------------------------------------
+    good_body = json.dumps(TestData.create_1_tag_event())
+    event = { "Records": [
+        { "messageId": "message-1", "eventSource": "aws:sqs", "body": good_body },
+        { "messageId": "message-2", "eventSource": "aws:sqs", "body": "some non-json parsable garbage" },
+        { "messageId": "message-3", "eventSource": "aws:sqs", "body": good_body },
+    ] }
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode":        200,
+        "count":             2,
+        "body":              "handled '2' of '3' queued messages",
+        "batchItemFailures": [ { "itemIdentifier": "message-2" } ]
+    }, "Expecting lambda to process 2 messages and report the bad one as a batch item failure"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_with_3_tags_in_local_pool(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("LOCAL_MAX_WORKERS", "3")
+    event = TestData.create_3_tags_event()
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 200,
+        "count":      3,
+        "body":       "handled 3 tags"
+    }, "Expecting lambda to process all 3 tags in the local pool"
+
+@mock_sqs
+def test_lambda_handler_spills_tags_from_local_pool(aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    import main
+    monkeypatch.setenv("LOCAL_MAX_WORKERS", "1")
+    monkeypatch.setenv("LOCAL_BUDGET_SECONDS", "0.05")
+    monkeypatch.setattr(main, "process_one_tag", lambda tag: main.time.sleep(0.2))
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 202,
+        "count":      3,
+        "body":       "handled '1' tags and split '2' tags into '2' queued messages"
+    }, "Expecting lambda to process 1 tag and queue the 2 tags it didn't get to"
+    assert len(queue.receive_messages(MaxNumberOfMessages=10)) == 2
+
+class FakeContext():
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_queues_tags_that_miss_the_deadline(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("TAG_SECONDS_ESTIMATE", "2")
+    monkeypatch.setenv("SAFETY_MARGIN_MS", "3000")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, FakeContext(7000)) # time for (7000 - 3000) / 2000 = 2 tags
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 202,
+        "count":      3,
+        "body":       "handled '2' tags and split '1' tags into '1' queued messages"
+    }, "Expecting lambda to process the 2 tags that fit before the deadline, and queue 1"
+    sqs_messages = queue.receive_messages(MaxNumberOfMessages=10)
+    assert len(sqs_messages) == 1
+    assert json.loads(sqs_messages[0].body)["detail"]["requestParameters"]["tagSet"]["items"][0]["key"] == "tag-key-3"
+
+@mock_sqs
+@patch('main.process_one_tag')
+def test_lambda_handler_queues_tags_that_miss_the_deadline_first(process_one_tag, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("TAG_SECONDS_ESTIMATE", "2")
+    monkeypatch.setenv("SAFETY_MARGIN_MS", "3000")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    queued_before_processing = []
+    def count_queued_messages(tag):
+        queue.reload()
+        queued_before_processing.append(int(queue.attributes["ApproximateNumberOfMessages"]))
+    process_one_tag.side_effect = count_queued_messages
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(TestData.create_3_tags_event(), FakeContext(7000)) # time for 2 tags
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["statusCode"] == 202
+    assert queued_before_processing == [ 1, 1 ], "Expecting the tag that misses the deadline to be queued before the others are processed"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_round_trips_compressed_projected_messages(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("MESSAGE_PROJECTION", "true")
+    monkeypatch.setenv("MESSAGE_COMPRESSION", "zlib")
+    monkeypatch.setenv("MESSAGE_COMPRESSION_MIN_BYTES", "1")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    event["detail"]["responseElements"] = { "requestId": "e1a9b3a5", "_return": True }
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    sqs_messages = queue.receive_messages(MaxNumberOfMessages=10, MessageAttributeNames=["All"])
+    records = [ {
+        "messageId": m.message_id, "eventSource": "aws:sqs", "body": m.body,
+        "messageAttributes": { name: { "stringValue": a["StringValue"], "dataType": a["DataType"] }
+                               for name, a in (m.message_attributes or {}).items() }
+    } for m in sqs_messages ]
+    out_from_queue = lambda_handler({ "Records": records }, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["count"] == 3 and len(records) == 3
+    assert all(record["messageAttributes"]["ContentEncoding"]["stringValue"] == "zlib" for record in records)
+    from codec import get_message_codec
+    queued_event = json.loads(get_message_codec().decode(records[0]["body"], records[0]["messageAttributes"]))
+    assert "responseElements" not in queued_event["detail"], "Expecting the projection to drop 'responseElements'"
+    assert out_from_queue == {
+        "statusCode":        200,
+        "count":             3,
+        "body":              "handled '3' of '3' queued messages",
+        "batchItemFailures": []
+    }, "Expecting lambda to decode and process each of the 3 queued messages"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_fans_out_as_a_tree(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    COUNT = 25
+    monkeypatch.setenv("TREE_BRANCHING_FACTOR", "3")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    event = TestData.create_3_tags_event()
+    event["detail"]["requestParameters"]["tagSet"]["items"] = [
+        { "key": f"tag-key-{i}", "value": f"tag-value-{i}" } for i in range(COUNT) ]
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(event, {})
+    # keep feeding the queued messages back to the lambda, as SQS would, until none are left
+    depths = []
+    processed_keys = []
+    while True:
+        sqs_messages = queue.receive_messages(MaxNumberOfMessages=10)
+        if not sqs_messages:
+            break
+        for sqs_message in sqs_messages:
+            queued_event = json.loads(sqs_message.body)
+            metadata = queued_event.get("loadSplitter", {})
+            if metadata.get("range"):
+                depths.append(metadata["depth"])
+            else:
+                processed_keys += [ tag["key"] for tag in queued_event["detail"]["requestParameters"]["tagSet"]["items"] ]
+            record = { "messageId": sqs_message.message_id, "eventSource": "aws:sqs", "body": sqs_message.body }
+            assert lambda_handler({ "Records": [ record ] }, {})["batchItemFailures"] == []
+            sqs_message.delete()
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out == {
+        "statusCode": 202,
+        "count":      COUNT,
+        "body":       f"split '{COUNT}' tags into '3' queued messages"
+    }, "Expecting lambda to queue just 3 range messages"
+    assert sorted(depths) == [1] * 3 + [2] * 9, "Expecting 3 range messages at depth 1, each split into 3 at depth 2"
+    assert sorted(processed_keys) == sorted(f"tag-key-{i}" for i in range(COUNT)), "Expecting every tag to reach a leaf message"
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_skips_repeat_deliveries(sleep, aws_credentials):
+    # TEST SETUP ---------------------------------------------------------------------------
+    event = TestData.create_1_tag_event()
+    event["detail"]["eventID"] = "1a2b3c4d-0000-0000-0000-000000000000"
+    record = { "messageId": "message-1", "eventSource": "aws:sqs", "body": json.dumps(event) }
+    # RUN TEST -----------------------------------------------------------------------------
+    outs = [ lambda_handler({ "Records": [ record ] }, {}) for delivery in range(3) ]
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert all(out["batchItemFailures"] == [] for out in outs)
+    assert sleep.call_count == 1, "Expecting the tag to be processed just once"
+    assert get_idempotency_guard().stats() == { "hits": 2, "misses": 1 }
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_emits_metrics(sleep, aws_credentials, capsys):
+    # TEST SETUP ---------------------------------------------------------------------------
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    lambda_handler(TestData.create_3_tags_event(), {})
+    capsys.readouterr()
+    messages = queue.receive_messages(MaxNumberOfMessages=10, AttributeNames=["SentTimestamp"])
+    records = [ { "messageId": message.message_id, "eventSource": "aws:sqs", "body": message.body,
+                  "attributes": message.attributes } for message in messages ]
+    # RUN TEST -----------------------------------------------------------------------------
+    lambda_handler({ "Records": records }, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    documents = [ json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line ]
+    assert len(documents) == 1, "Expecting one EMF document per invocation"
+    names = { metric["Name"] for metric in documents[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"] }
+    assert names == { "ProcessTagDuration", "QueueDwellTime" }
+    assert len(documents[0]["QueueDwellTime"]) == 3, "Expecting the dwell time of each queued message"
+
+@mock_sqs
+def test_lambda_handler_staggers_split_messages(aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("STAGGER_WINDOW_SECONDS", "30")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(TestData.create_3_tags_event(), {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["statusCode"] == 202
+    messages = queue.receive_messages(MaxNumberOfMessages=10)
+    assert len(messages) == 1, "Expecting only the first message to be visible straight away"
+
+@mock_sqs
+def test_lambda_handler_holds_back_messages_that_cannot_be_paced(aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("FANOUT_RATE_PER_SECOND", "0.001") # a message every 1000 seconds
+    monkeypatch.setenv("FANOUT_BURST", "1")
+    queue = boto3.resource("sqs").create_queue(QueueName=os.environ["QUEUE_NAME"])
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler(TestData.create_3_tags_event(), {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["statusCode"] == 500, "Expecting the split to fail, so that it is retried later"
+    queue.reload()
+    assert queue.attributes["ApproximateNumberOfMessages"] == "1"
+    assert queue.attributes["ApproximateNumberOfMessagesDelayed"] == "0", "Expecting no message to be delayed past the maximum"
+
+@mock_sqs
+@patch('main.process_one_tag')
+def test_lambda_handler_reports_throttling(process_one_tag, aws_credentials):
+    # TEST SETUP ---------------------------------------------------------------------------
+    process_one_tag.side_effect = botocore.exceptions.ClientError(
+        { "Error": { "Code": "RequestLimitExceeded", "Message": "Request limit exceeded." } }, "CreateTags")
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler({ "Records": [ { "messageId": "message-1", "eventSource": "aws:sqs",
+                                          "body": json.dumps(TestData.create_1_tag_event()) } ] }, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["batchItemFailures"] == [ { "itemIdentifier": "message-1" } ]
+    assert get_rate_factor() < 1.0, "Expecting the throttle to slow down later splits"
+
+def create_queued_1_tag_records(resource_ids):
+    records = []
+    for i, resource_id in enumerate(resource_ids):
+        event = TestData.create_1_tag_event()
+        event["detail"]["requestParameters"]["resourcesSet"]["items"] = [ { "resourceId": resource_id } ]
+        event["detail"]["requestParameters"]["tagSet"]["items"] = [ { "key": f"tag-key-{i}", "value": "tag-value" } ]
+        records.append({ "messageId": f"message-{i}", "eventSource": "aws:sqs", "body": json.dumps(event) })
+    return records
+
+@mock_sqs
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_coalesces_small_events(sleep, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("COALESCE_MAX_TAGS", "10")
+    records = create_queued_1_tag_records([ "i-1", "i-2", "i-1", "i-1" ])
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler({ "Records": records }, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["batchItemFailures"] == []
+    assert out["count"] == 4
+    assert sleep.call_count == 2, "Expecting one unit of work per instance"
+
+@mock_sqs
+@patch('main.process_tags_of_resources')
+def test_lambda_handler_fails_messages_of_failed_unit(process_tags_of_resources, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("COALESCE_MAX_TAGS", "10")
+    process_tags_of_resources.side_effect = lambda tags: 1 / 0 if len(tags) > 1 else None
+    records = create_queued_1_tag_records([ "i-1", "i-2", "i-1" ])
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler({ "Records": records }, {})
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["batchItemFailures"] == [ { "itemIdentifier": "message-0" }, { "itemIdentifier": "message-2" } ]
+    assert out["count"] == 1
+
+@mock_sqs
+@patch('main.record_tag_duration')
+@patch('time.sleep', return_value=None)
+def test_lambda_handler_defers_coalesced_units_that_miss_the_deadline(sleep, record_tag_duration, aws_credentials, monkeypatch):
+    # TEST SETUP ---------------------------------------------------------------------------
+    monkeypatch.setenv("COALESCE_MAX_TAGS", "10")
+    monkeypatch.setenv("TAG_SECONDS_ESTIMATE", "2")
+    monkeypatch.setenv("SAFETY_MARGIN_MS", "3000")
+    records = create_queued_1_tag_records([ "i-1", "i-2", "i-1" ])
+    # RUN TEST -----------------------------------------------------------------------------
+    out = lambda_handler({ "Records": records }, FakeContext(4000)) # time for no tags
+    # VALIDATE RESULTS ---------------------------------------------------------------------
+    assert out["batchItemFailures"] == [ { "itemIdentifier": "message-1" } ], \
+        "Expecting lambda to process the first unit so as to make progress, and defer the other"
+    assert out["count"] == 2
+    assert sleep.call_count == 1
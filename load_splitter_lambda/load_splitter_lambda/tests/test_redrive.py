@@ -0,0 +1,140 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the dead letter queue redrive tool in "tools/redrive.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+import boto3
+import pytest
+from moto import mock_sqs
+
+REGION_NAME = "us-west-1"
+PREFIX      = "MY_PREFIX"
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+sys.path.append("load_splitter_lambda/tools")
+from redrive import Redrive, message_matches
+from transport import reset_transports
+
+
+def generate_event(key, event_name="CreateTags", lane=None):
+    event = {
+        "detail": {
+            "eventName": event_name,
+            "requestParameters": {
+                "resourcesSet": { "items": [ { "resourceId": "i-00000000000000000" } ] },
+                "tagSet": { "items": [ { "key": key, "value": "tag-value" } ] }
+            },
+        }
+    }
+    if lane:
+        event["loadSplitter"] = { "lane": lane }
+    return event
+
+@pytest.fixture(scope="function")
+def queues(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", REGION_NAME)
+    monkeypatch.setenv("QUEUE_NAME", PREFIX)
+    monkeypatch.delenv("LANE_QUEUES", raising=False)
+    reset_transports()
+    with mock_sqs():
+        sqs = boto3.resource("sqs")
+        yield sqs.create_queue(QueueName=PREFIX), sqs.create_queue(QueueName=f"{PREFIX}_deadletter")
+    reset_transports()
+
+def fill(queue, events):
+    for i in range(0, len(events), 10):
+        queue.send_messages(Entries=[ { "Id": str(j), "MessageBody": json.dumps(event), "MessageAttributes": {
+            "ContentType": { "DataType": "String", "StringValue": "application/json" } } }
+                                      for j, event in enumerate(events[i:i + 10]) ])
+
+def receive_all(queue):
+    messages = []
+    while True:
+        batch = queue.receive_messages(MaxNumberOfMessages=10, MessageAttributeNames=["All"])
+        if not batch:
+            return messages
+        messages.extend(batch)
+
+def test_message_filters():
+    event = generate_event("Backup-Daily")
+    assert message_matches(event)
+    assert message_matches(event, event_names=[ "Create*" ], tag_keys=[ "Backup-*" ])
+    assert not message_matches(event, event_names=[ "DeleteTags" ])
+    assert not message_matches(event, tag_keys=[ "Owner" ])
+    assert not message_matches(None, tag_keys=[ "Owner" ])
+
+def test_redrive_enqueues_messages_in_parallel(queues):
+    queue, dlq = queues
+    fill(dlq, [ generate_event(f"tag-key-{i}") for i in range(35) ])
+    stats = Redrive(f"{PREFIX}_deadletter", concurrency=4, wait_seconds=0).run()
+    assert stats["received"] - stats["duplicates"] == stats["replayed"] == stats["deleted"] == 35
+    assert stats["failed"] == stats["skipped"] == 0
+    messages = receive_all(queue)
+    assert sorted(json.loads(message.body)["detail"]["requestParameters"]["tagSet"]["items"][0]["key"] for message in messages) == \
+        sorted(f"tag-key-{i}" for i in range(35)), "Expecting every message to be sent back to the queue once"
+    assert messages[0].message_attributes["ContentType"]["StringValue"] == "application/json"
+    assert not receive_all(dlq), "Expecting the replayed messages to be deleted from the dead letter queue"
+
+def test_redrive_filters_and_limits_messages(queues):
+    queue, dlq = queues
+    fill(dlq, [ generate_event("Backup-Daily"), generate_event("Owner"), generate_event("Backup-Weekly", "DeleteTags") ])
+    stats = Redrive(f"{PREFIX}_deadletter", event_names=[ "CreateTags" ], tag_keys=[ "Backup-*" ], wait_seconds=0).run()
+    assert (stats["received"], stats["replayed"], stats["skipped"]) == (3, 1, 2)
+    assert [ json.loads(message.body) for message in receive_all(queue) ] == [ generate_event("Backup-Daily") ]
+    fill(dlq, [ generate_event(f"tag-key-{i}") for i in range(15) ])
+    stats = Redrive(f"{PREFIX}_deadletter", max_messages=12, concurrency=2, wait_seconds=0).run()
+    assert stats["received"] == 12
+
+def test_redrive_routes_messages_to_their_lane(queues, monkeypatch):
+    queue, dlq = queues
+    bulk_queue = boto3.resource("sqs").create_queue(QueueName=f"{PREFIX}_bulk")
+    monkeypatch.setenv("LANE_QUEUES", json.dumps({ "bulk": f"{PREFIX}_bulk" }))
+    fill(dlq, [ generate_event("a", lane="bulk"), generate_event("b") ])
+    Redrive(f"{PREFIX}_deadletter", wait_seconds=0).run()
+    assert [ json.loads(message.body)["loadSplitter"]["lane"] for message in receive_all(bulk_queue) ] == [ "bulk" ]
+    assert len(receive_all(queue)) == 1
+
+def test_redrive_replays_locally(queues):
+    queue, dlq = queues
+    fill(dlq, [ generate_event(f"tag-key-{i}") for i in range(5) ])
+    handled = []
+    def handler(event, context):
+        failures = []
+        for record in event["Records"]:
+            key = json.loads(record["body"])["detail"]["requestParameters"]["tagSet"]["items"][0]["key"]
+            handled.append(key)
+            if key == "tag-key-3":
+                failures.append({ "itemIdentifier": record["messageId"] })
+        return { "batchItemFailures": failures }
+    stats = Redrive(f"{PREFIX}_deadletter", mode="local", handler=handler, wait_seconds=0).run()
+    assert sorted(handled) == [ f"tag-key-{i}" for i in range(5) ]
+    assert (stats["replayed"], stats["failed"], stats["deleted"]) == (4, 1, 4)
+    assert not receive_all(queue), "Expecting nothing to be sent back to the queue when replaying locally"
+
+def test_unknown_mode_is_rejected(queues):
+    with pytest.raises(ValueError):
+        Redrive(f"{PREFIX}_deadletter", mode="carrier-pigeon")
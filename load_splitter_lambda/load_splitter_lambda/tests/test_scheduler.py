@@ -0,0 +1,64 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the deadline-aware scheduler in "scheduler.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from scheduler import (get_remaining_time_ms, get_tag_seconds_estimate, record_tag_duration,
+                       reset_tag_duration_estimate, tags_that_fit)
+
+
+class FakeContext():
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+@pytest.fixture(scope="function")
+def scheduler(monkeypatch):
+    monkeypatch.setenv("TAG_SECONDS_ESTIMATE", "2")
+    monkeypatch.setenv("SAFETY_MARGIN_MS", "1000")
+    reset_tag_duration_estimate()
+    yield
+    reset_tag_duration_estimate()
+
+class TestScheduler():
+    def test_initial_estimate_comes_from_environment(self, scheduler):
+        assert(get_tag_seconds_estimate() == 2.0)
+    def test_estimate_is_moving_average(self, scheduler):
+        record_tag_duration(1.0)
+        assert(get_tag_seconds_estimate() == 1.0)
+        record_tag_duration(2.0, alpha=0.5)
+        assert(get_tag_seconds_estimate() == 1.5)
+    def test_tags_that_fit(self, scheduler):
+        assert(tags_that_fit(7000) == 3)            # (7000 - 1000) ms / 2 s per tag
+        assert(tags_that_fit(7000, workers=4) == 12)
+        assert(tags_that_fit(500) == 0)
+    def test_remaining_time_from_context(self):
+        assert(get_remaining_time_ms(FakeContext(1234)) == 1234)
+        assert(get_remaining_time_ms({}) is None)
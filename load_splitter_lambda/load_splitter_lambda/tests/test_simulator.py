@@ -0,0 +1,71 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the fan-out simulator in "tools/simulator.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+sys.path.append("load_splitter_lambda/tools")
+from simulator import DEFAULT_PARAMETERS, Simulation, generate_events, parse_strategy
+
+
+NO_LATENCY = DEFAULT_PARAMETERS._replace(cold_start_seconds=0, send_batch_seconds=0, poll_delay_seconds=0)
+ONE_TAG_FITS = NO_LATENCY._replace(timeout_seconds=8, safety_margin_seconds=3, tag_seconds_estimate=5) # (8 - 3) / 5 = 1 tag
+
+class TestSimulator():
+    def test_parse_strategy(self):
+        strategy = parse_strategy("chunk=5,tree=10")
+        assert((strategy.chunk_size, strategy.max_cost, strategy.branching_factor, strategy.max_depth) == (5, None, 10, 3))
+        with pytest.raises(ValueError):
+            parse_strategy("chunks=5")
+    def test_one_tag_is_processed_inline(self):
+        out = Simulation(parse_strategy("chunk=1"), NO_LATENCY).run([ (0.0, [ 5.0 ]) ])
+        assert((out["invocations"], out["messagesSent"], out["makespanSeconds"]) == (1, 0, 5.0))
+    def test_tags_that_fit_before_the_deadline_are_processed_inline(self):
+        out = Simulation(parse_strategy("chunk=1"), NO_LATENCY).run([ (0.0, [ 5.0 ] * 3) ]) # (60 - 3) / 5 = 11 tags fit
+        assert((out["invocations"], out["messagesSent"], out["makespanSeconds"]) == (1, 0, 15.0))
+    def test_tags_are_split_and_processed_in_parallel(self):
+        out = Simulation(parse_strategy("chunk=1"), ONE_TAG_FITS._replace(batch_size=1)).run([ (0.0, [ 5.0 ] * 3) ])
+        assert((out["invocations"], out["messagesSent"], out["makespanSeconds"]) == (3, 2, 5.0))
+        assert(out["p50TagSeconds"] == out["p99TagSeconds"] == 5.0)
+    def test_tags_not_started_within_the_budget_are_queued(self):
+        parameters = NO_LATENCY._replace(timeout_seconds=13, safety_margin_seconds=3, tag_seconds_estimate=1, batch_size=1) # 10 tags fit
+        out = Simulation(parse_strategy("chunk=1"), parameters).run([ (0.0, [ 2.0 ] * 20) ])
+        assert(out["messagesSent"] == 10 + 5), "Expecting the tags that take longer than estimated to spill over"
+        assert(out["tags"] == 20)
+    def test_concurrency_limit_is_respected(self):
+        parameters = ONE_TAG_FITS._replace(batch_size=1, concurrency=2)
+        out = Simulation(parse_strategy("chunk=1"), parameters).run([ (0.0, [ 5.0 ] * 4) ])
+        assert(out["peakConcurrency"] == 2)
+        assert(out["makespanSeconds"] == 10.0)
+    def test_tree_fan_out_follows_the_split_policy(self):
+        # 1 tag is processed inline, then 3 range messages, 9 range messages, and 1 message per tag
+        out = Simulation(parse_strategy("chunk=1,tree=3"), ONE_TAG_FITS).run([ (0.0, [ 0.0 ] * 25) ])
+        assert(out["messagesSent"] == 3 + 9 + 24)
+        assert(out["tags"] == 25)
+    def test_generated_events_are_repeatable(self):
+        assert(generate_events(10, [ 1, 5 ], 5.0, 0.5, 60, seed=1) == generate_events(10, [ 1, 5 ], 5.0, 0.5, 60, seed=1))
@@ -0,0 +1,73 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the split policy in "split_policy.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import json
+import sys
+
+from mock import patch
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from split_policy import chunk_items, fits_in_one_chunk, group_chunks_for_tree
+
+
+def tags(*keys):
+    return [ { "key": key, "value": "value" } for key in keys ]
+
+class TestSplitPolicy():
+    def test_default_is_one_item_per_chunk(self, monkeypatch):
+        monkeypatch.delenv("CHUNK_SIZE", raising=False)
+        monkeypatch.delenv("CHUNK_MAX_COST", raising=False)
+        assert(chunk_items([1, 2, 3]) == [[1], [2], [3]])
+        assert(fits_in_one_chunk([1]))
+        assert(not fits_in_one_chunk([1, 2]))
+    def test_chunk_size_from_argument(self):
+        assert(chunk_items([1, 2, 3, 4, 5], chunk_size=2) == [[1, 2], [3, 4], [5]])
+    def test_chunk_size_from_environment(self, monkeypatch):
+        monkeypatch.setenv("CHUNK_SIZE", "3")
+        assert(chunk_items([1, 2, 3, 4]) == [[1, 2, 3], [4]])
+        assert(fits_in_one_chunk([1, 2, 3]))
+    def test_chunks_by_cost(self, monkeypatch):
+        monkeypatch.setenv("TAG_COST_ESTIMATES", '{"big": 4, "small": 0.5}')
+        items = tags("small", "small", "other", "big", "small", "huge")
+        chunks = chunk_items(items, max_cost=2, cost_of=None)
+        assert([[tag["key"] for tag in chunk] for chunk in chunks] ==
+               [["small", "small", "other"], ["big"], ["small", "huge"]])
+    def test_cost_estimates_are_parsed_once(self, monkeypatch):
+        monkeypatch.setenv("TAG_COST_ESTIMATES", '{"big": 4}')
+        with patch("split_policy.json.loads", wraps=json.loads) as loads:
+            chunk_items(tags(*["big", "small"] * 50), max_cost=8)
+        assert(loads.call_count == 1)
+    def test_item_costing_more_than_maximum_gets_own_chunk(self):
+        chunks = chunk_items([5, 1, 1], max_cost=2, cost_of=lambda item: item)
+        assert(chunks == [[5], [1, 1]])
+    def test_tree_is_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("TREE_BRANCHING_FACTOR", raising=False)
+        assert(group_chunks_for_tree([[i] for i in range(100)], depth=0) is None)
+    def test_tree_groups_chunks_into_ranges(self):
+        chunks = [ [i] for i in range(7) ]
+        assert(group_chunks_for_tree(chunks, depth=0, branching_factor=3) == [[0, 1, 2], [3, 4, 5], [6]])
+        assert(group_chunks_for_tree(chunks[:3], depth=0, branching_factor=3) is None)
+        assert(group_chunks_for_tree(chunks, depth=2, branching_factor=3, max_depth=2) is None)
@@ -0,0 +1,96 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the structured logging and metrics in "telemetry.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import io
+import json
+import logging
+import sys
+
+import pytest
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from telemetry import (EMF_MAX_VALUES_PER_METRIC, METRIC_FAN_OUT_SIZE, METRIC_PROCESS_TAG_DURATION,
+                       StructuredMessage, flush_metrics, log_event_sample, put_metric, reset_metrics)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    reset_metrics()
+    yield
+    reset_metrics()
+
+class Unformattable():
+    def __str__(self):
+        raise AssertionError("Expecting the message never to be formatted")
+
+class TestStructuredLogging():
+    def test_message_is_json(self):
+        message = StructuredMessage("===> SUCCESS", statusCode=200, tag="tag-key-1")
+        assert(json.loads(str(message)) == { "message": "===> SUCCESS", "statusCode": 200, "tag": "tag-key-1" })
+    def test_message_is_formatted_lazily(self):
+        logger = logging.getLogger("telemetry-test")
+        logger.setLevel(logging.WARNING)
+        logger.info(StructuredMessage("===> not emitted", value=Unformattable()))
+    def test_event_sample_rate(self, monkeypatch):
+        logging.getLogger().setLevel(logging.INFO)
+        monkeypatch.setenv("LOG_EVENT_SAMPLE_RATE", "0")
+        assert(not any(log_event_sample({ "detail": {} }) for i in range(100)))
+        monkeypatch.setenv("LOG_EVENT_SAMPLE_RATE", "1")
+        assert(all(log_event_sample({ "detail": {} }) for i in range(100)))
+
+class TestEmbeddedMetrics():
+    def test_flush_writes_one_emf_document(self):
+        put_metric(METRIC_FAN_OUT_SIZE, 25)
+        put_metric(METRIC_PROCESS_TAG_DURATION, 5.0)
+        put_metric(METRIC_PROCESS_TAG_DURATION, 7.0)
+        stream = io.StringIO()
+        flush_metrics({ "FunctionName": "my_lambda" }, stream)
+        documents = [ json.loads(line) for line in stream.getvalue().splitlines() ]
+        assert(len(documents) == 1)
+        directive = documents[0]["_aws"]["CloudWatchMetrics"][0]
+        assert(directive["Namespace"] == "LoadSplitter")
+        assert(directive["Dimensions"] == [ [ "FunctionName" ] ])
+        assert(directive["Metrics"] == [ { "Name": "FanOutSize", "Unit": "Count" },
+                                         { "Name": "ProcessTagDuration", "Unit": "Milliseconds" } ])
+        assert(documents[0]["FunctionName"] == "my_lambda")
+        assert(documents[0]["FanOutSize"] == 25)
+        assert(documents[0]["ProcessTagDuration"] == [ 5.0, 7.0 ])
+    def test_flush_empties_the_buffer(self):
+        put_metric(METRIC_FAN_OUT_SIZE, 25)
+        assert(len(flush_metrics(stream=io.StringIO())) == 1)
+        assert(flush_metrics(stream=io.StringIO()) == [])
+    def test_many_values_are_split_across_documents(self):
+        for i in range(EMF_MAX_VALUES_PER_METRIC + 1):
+            put_metric(METRIC_PROCESS_TAG_DURATION, i)
+        documents = flush_metrics(stream=io.StringIO())
+        assert([ len(document["ProcessTagDuration"]) if isinstance(document["ProcessTagDuration"], list) else 1
+                 for document in documents ] == [ EMF_MAX_VALUES_PER_METRIC, 1 ])
+    def test_metrics_can_be_turned_off(self, monkeypatch):
+        monkeypatch.setenv("METRICS_NAMESPACE", "none")
+        put_metric(METRIC_FAN_OUT_SIZE, 25)
+        stream = io.StringIO()
+        assert(flush_metrics(stream=stream) == [])
+        assert(stream.getvalue() == "")
@@ -0,0 +1,119 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This file provides unit tests for the cached SQS transport in "transport.py"
+#
+# To run this test, execute it from the parent directory where your lambda code under test resides:
+#   python -m pytest tests/*.py
+#
+# References:
+#   https://docs.pytest.org/en/stable/index.html
+
+import os
+import subprocess
+import sys
+
+import boto3
+import pytest
+from mock import patch
+from moto import mock_sqs
+
+REGION_NAME = "us-west-1"
+PREFIX      = "MY_PREFIX"
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from transport import (InProcessTransport, get_sqs_client, get_transport, prewarm_transport, receive_again,
+                       reset_transports)
+
+
+@pytest.fixture(scope="function")
+def aws_credentials():
+    os.environ["AWS_DEFAULT_REGION"] = REGION_NAME
+    os.environ["QUEUE_NAME"]         = PREFIX
+    os.environ.pop("QUEUE_URL", None)
+    reset_transports()
+
+@mock_sqs
+def test_transport_is_cached_and_resolves_queue_url_once(aws_credentials):
+    queue = boto3.resource("sqs").create_queue(QueueName=PREFIX)
+    transport = get_transport()
+    assert get_transport() is transport, "Expecting the transport to be reused"
+    with patch.object(get_sqs_client(), "get_queue_url", wraps=get_sqs_client().get_queue_url) as get_queue_url:
+        for i in range(3):
+            transport.send_message_batch([ { "Id": "0", "MessageBody": f"message {i}" } ])
+        assert get_queue_url.call_count == 1, "Expecting the queue URL to be resolved just once"
+    assert len(queue.receive_messages(MaxNumberOfMessages=10)) == 3
+
+@mock_sqs
+def test_transport_recovers_from_invalid_queue_url(aws_credentials):
+    queue = boto3.resource("sqs").create_queue(QueueName=PREFIX)
+    os.environ["QUEUE_URL"] = queue.url.replace(PREFIX, "QUEUE_THAT_WAS_DELETED")
+    transport = get_transport()
+    transport.send_message("hello")
+    assert transport.queue_url == queue.url, "Expecting the queue URL to be resolved again"
+    assert len(queue.receive_messages(MaxNumberOfMessages=10)) == 1
+    os.environ.pop("QUEUE_URL")
+
+@mock_sqs
+def test_prewarm_creates_client_and_resolves_queue_url(aws_credentials, monkeypatch):
+    boto3.resource("sqs").create_queue(QueueName=PREFIX)
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "my_lambda")
+    monkeypatch.delenv("PREWARM_SQS_CLIENT", raising=False)
+    assert not prewarm_transport(), "Expecting nothing to be prewarmed by default"
+    monkeypatch.setenv("PREWARM_SQS_CLIENT", "true")
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    assert not prewarm_transport(), "Expecting nothing to be prewarmed outside of Lambda"
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "my_lambda")
+    assert prewarm_transport()
+    assert get_transport()._queue_url is not None, "Expecting the queue URL to be resolved"
+
+def test_importing_the_handler_does_not_load_boto3():
+    # a fresh interpreter, so that no other test has loaded boto3 already
+    script = "import sys; sys.path.append('load_splitter_lambda/code'); import main; print('boto3' in sys.modules, 'botocore' in sys.modules)"
+    env = { key: value for key, value in os.environ.items() if key != "AWS_LAMBDA_FUNCTION_NAME" }
+    out = subprocess.run([ sys.executable, "-c", script ], capture_output=True, text=True, env=env, check=True).stdout
+    assert out.split() == [ "False", "False" ]
+
+def test_local_transport_queues_lambda_records(aws_credentials, monkeypatch):
+    monkeypatch.setenv("QUEUE_TRANSPORT", "memory")
+    transport = get_transport()
+    assert isinstance(transport, InProcessTransport)
+    response = transport.send_message_batch([
+        { "Id": "0", "MessageBody": "hello", "MessageAttributes": { "ContentEncoding": { "DataType": "String", "StringValue": "zlib" } } },
+        { "Id": "1", "MessageBody": "world" } ])
+    assert [ entry["Id"] for entry in response["Successful"] ] == [ "0", "1" ]
+    record = transport.records[0]
+    assert record["body"] == "hello"
+    assert record["eventSource"] == "aws:sqs"
+    assert record["attributes"]["ApproximateReceiveCount"] == "1"
+    assert record["messageAttributes"] == { "ContentEncoding": { "stringValue": "zlib", "dataType": "String" } }
+    assert receive_again(record)["attributes"]["ApproximateReceiveCount"] == "2"
+    assert record["attributes"]["ApproximateReceiveCount"] == "1", "Expecting the record itself to be left as it is"
+    handled = []
+    def handler(event, context):
+        handled.extend(record["body"] for record in event["Records"])
+        return { "batchItemFailures": [] }
+    assert transport.drain(handler, batch_size=1) == 2
+    assert handled == [ "hello", "world" ]
+    monkeypatch.setenv("PREWARM_SQS_CLIENT", "true")
+    assert not prewarm_transport(force=True), "Expecting no SQS client to be prewarmed for local transports"
+
+def test_unknown_transport_is_rejected(aws_credentials, monkeypatch):
+    monkeypatch.setenv("QUEUE_TRANSPORT", "carrier-pigeon")
+    with pytest.raises(ValueError):
+        get_transport()
@@ -0,0 +1,342 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+
+# This tool reprocesses the messages that landed in the dead letter queue after failing
+# too many times. It drains the dead letter queue with ReceiveMessage (10 messages per
+# call, with long polling), replays each batch of messages, and deletes the ones that were
+# replayed with DeleteMessageBatch. Messages are replayed in one of two modes:
+#
+#   - "enqueue" (the default): sent back to a queue, by default the queue of their priority
+#     lane (see lanes.py), or else the one named by "QUEUE_NAME", to be processed by the
+#     deployed Lambda again. The bodies and message attributes are sent as they are, so
+#     compressed and claim-checked messages (see codec.py) stay valid.
+#   - "local": handed to the Lambda handler in this process, as a batch of SQS records, as
+#     the event source mapping would. Only the messages that the handler doesn't list in
+#     its "batchItemFailures" are deleted.
+#
+# Several workers, each receiving, replaying and deleting batches of its own, run in
+# parallel, up to the given concurrency. Messages can be filtered by the event name and by
+# the keys of their tags (shell-style patterns); those that don't match are left in the
+# dead letter queue, hidden from this run by the visibility timeout of the receive. The
+# run ends once the queue is found empty (or after the given number of messages), and
+# reports how many messages were received, replayed, skipped and failed, and the
+# throughput achieved. A message received more than once in a run (as SQS may deliver a
+# message again) is replayed just once.
+#
+# To run it, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/tools/redrive.py --dlq MY_PREFIX_queue_deadletter --concurrency 8 --tag-key 'Backup*'
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from event_queue import decode_queue_record, get_reference_to_embedded_list, get_split_metadata
+from lanes import get_lane_queue_name
+from transport import get_sqs_client
+
+logger = logging.getLogger()
+
+SQS_MAX_RECEIVE_MESSAGES      = 10  # ReceiveMessage returns at most 10 messages per call
+DEFAULT_WAIT_SECONDS          = 2   # long polling, which also tells an empty queue apart
+DEFAULT_VISIBILITY_TIMEOUT    = 300 # long enough for a batch to be replayed before it's received again
+DEFAULT_CONCURRENCY           = 4
+REPLAY_MODES                  = ("enqueue", "local")
+
+def to_lambda_record(message, event_source_arn=None):
+    # -*- coding: utf-8 -*-
+    """This method returns the SQS record that Lambda would hand to the handler for a
+    message returned by ReceiveMessage.
+    """
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": message["Body"],
+        "attributes": dict(message.get("Attributes", {})),
+        "messageAttributes": { name: { "stringValue": attribute.get("StringValue", None), "dataType": attribute["DataType"] }
+                               for name, attribute in message.get("MessageAttributes", {}).items() },
+        "eventSource": "aws:sqs",
+        "eventSourceARN": event_source_arn,
+    }
+
+def get_send_attributes(message):
+    # -*- coding: utf-8 -*-
+    """This method returns the message attributes of a received message, in the format
+    that SendMessageBatch takes them.
+    """
+    attributes = {}
+    for name, attribute in message.get("MessageAttributes", {}).items():
+        attributes[name] = { "DataType": attribute["DataType"] }
+        for value in ("StringValue", "BinaryValue"):
+            if value in attribute:
+                attributes[name][value] = attribute[value]
+    return attributes
+
+def decode_message(message):
+    # -*- coding: utf-8 -*-
+    """This method returns the event held by a received message, or None if it can't be
+    decoded.
+    """
+    try:
+        return decode_queue_record(to_lambda_record(message))
+    except Exception:
+        logger.exception(f"===> EXCEPTION CAUGHT: while decoding message '{message.get('MessageId')}'")
+        return None
+
+def message_matches(event, event_names=None, tag_keys=None):
+    # -*- coding: utf-8 -*-
+    """This method returns True if the event matches the filters: its event name matches
+    one of the 'event_names' patterns, and one of its tags' keys matches one of the
+    'tag_keys' patterns (a filter that is not given always matches).
+    """
+    if not event_names and not tag_keys:
+        return True
+    if not isinstance(event, dict):
+        return False
+    if event_names:
+        event_name = str(event.get("detail", {}).get("eventName", ""))
+        if not any(fnmatch.fnmatchcase(event_name, pattern) for pattern in event_names):
+            return False
+    if tag_keys:
+        keys = [ str(tag.get("key", "")) for tag in get_reference_to_embedded_list(event) if isinstance(tag, dict) ]
+        if not any(fnmatch.fnmatchcase(key, pattern) for key in keys for pattern in tag_keys):
+            return False
+    return True
+
+class Redrive():
+    """Drains a dead letter queue and replays its messages, as described at the top of
+    this file.
+
+    Parameters
+    ----------
+    dlq_name : str
+        The name of the dead letter queue.
+    mode : str, optional
+        "enqueue" or "local" (see REPLAY_MODES).
+    target_queue_name : str, optional
+        In "enqueue" mode, the queue to send every message to, rather than to the queue
+        of its priority lane.
+    concurrency : int, optional
+        The number of workers replaying batches of messages in parallel.
+    event_names, tag_keys : list, optional
+        The patterns of the filters (see message_matches()).
+    max_messages : int, optional
+        The number of messages to receive at most, or None to drain the whole queue.
+    wait_seconds : int, optional
+        The long polling wait of each ReceiveMessage call.
+    visibility_timeout : int, optional
+        How long received messages are hidden from other receives.
+    handler : function, optional
+        In "local" mode, the Lambda handler. Defaults to main.lambda_handler.
+    """
+    def __init__(self, dlq_name, mode="enqueue", target_queue_name=None, concurrency=DEFAULT_CONCURRENCY,
+                 event_names=None, tag_keys=None, max_messages=None, wait_seconds=DEFAULT_WAIT_SECONDS,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, handler=None):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"unknown replay mode '{mode}', expecting one of {REPLAY_MODES}")
+        self.dlq_name = dlq_name
+        self.mode = mode
+        self.target_queue_name = target_queue_name
+        self.concurrency = max(1, concurrency)
+        self.event_names = event_names
+        self.tag_keys = tag_keys
+        self.max_messages = max_messages
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.handler = handler
+        self.client = get_sqs_client()
+        self._queue_urls = {}
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self._seen_message_ids = set()
+        self.stats = { "received": 0, "replayed": 0, "skipped": 0, "failed": 0, "deleted": 0, "duplicates": 0 }
+
+    def get_queue_url(self, queue_name):
+        with self._lock:
+            if queue_name not in self._queue_urls:
+                self._queue_urls[queue_name] = self.client.get_queue_url(QueueName=queue_name)["QueueUrl"]
+            return self._queue_urls[queue_name]
+
+    def count(self, **increments):
+        with self._lock:
+            for name, increment in increments.items():
+                self.stats[name] += increment
+
+    def reserve(self):
+        # -*- coding: utf-8 -*-
+        """This method returns how many messages the next receive may ask for, and sets
+        them aside from 'max_messages' (see receive()), so that the workers never receive
+        more than 'max_messages' between them.
+        """
+        with self._lock:
+            if self.max_messages is None:
+                return SQS_MAX_RECEIVE_MESSAGES
+            count = max(0, min(SQS_MAX_RECEIVE_MESSAGES, self.max_messages - self._reserved))
+            self._reserved += count
+            return count
+
+    def receive(self):
+        # -*- coding: utf-8 -*-
+        """This method receives a batch of messages from the dead letter queue, and returns
+        those that haven't already been received in this run. It returns None once the
+        queue is empty, or 'max_messages' have been received.
+        """
+        count = self.reserve()
+        if not count:
+            return None
+        messages = self.client.receive_message(
+            QueueUrl=self.get_queue_url(self.dlq_name), MaxNumberOfMessages=count, WaitTimeSeconds=self.wait_seconds,
+            VisibilityTimeout=self.visibility_timeout, AttributeNames=["All"], MessageAttributeNames=["All"]).get("Messages", [])
+        with self._lock:
+            self._reserved -= count - len(messages)
+            fresh = [ message for message in messages if message["MessageId"] not in self._seen_message_ids ]
+            self._seen_message_ids.update(message["MessageId"] for message in fresh)
+            self.stats["received"] += len(messages)
+            self.stats["duplicates"] += len(messages) - len(fresh)
+        return fresh if messages else None
+
+    def get_target_queue_name(self, event):
+        if self.target_queue_name:
+            return self.target_queue_name
+        return get_lane_queue_name(get_split_metadata(event).get("lane", None))
+
+    def replay_by_enqueueing(self, messages):
+        # -*- coding: utf-8 -*-
+        """This method sends the messages back to their queues, and returns those that were
+        sent.
+        """
+        by_queue_name = {}
+        for message, event in messages:
+            by_queue_name.setdefault(self.get_target_queue_name(event), []).append(message)
+        replayed = []
+        for queue_name, queue_messages in by_queue_name.items():
+            if not queue_name:
+                logger.error("===> FAIL: no queue to replay messages to, set QUEUE_NAME or the target queue")
+                continue
+            entries = []
+            for index, message in enumerate(queue_messages):
+                entry = { "Id": str(index), "MessageBody": message["Body"] }
+                attributes = get_send_attributes(message)
+                if attributes:
+                    entry["MessageAttributes"] = attributes
+                entries.append(entry)
+            response = self.client.send_message_batch(QueueUrl=self.get_queue_url(queue_name), Entries=entries)
+            for entry in response.get("Failed", []):
+                logger.error(f"===> FAIL: unable to replay message: {entry.get('Code')} {entry.get('Message')}")
+            replayed.extend(queue_messages[int(entry["Id"])] for entry in response.get("Successful", []))
+        return replayed
+
+    def replay_locally(self, messages):
+        # -*- coding: utf-8 -*-
+        """This method hands the messages to the Lambda handler as one batch, and returns
+        those that didn't fail.
+        """
+        if self.handler is None:
+            from main import lambda_handler
+            self.handler = lambda_handler
+        records = [ to_lambda_record(message) for message, event in messages ]
+        try:
+            out = self.handler({ "Records": records }, None)
+        except Exception:
+            logger.exception("===> EXCEPTION CAUGHT: while replaying a batch of messages locally")
+            return []
+        failed_ids = { failure.get("itemIdentifier", None) for failure in (out or {}).get("batchItemFailures", []) }
+        return [ message for message, event in messages if message["MessageId"] not in failed_ids ]
+
+    def delete(self, messages):
+        if not messages:
+            return
+        entries = [ { "Id": str(index), "ReceiptHandle": message["ReceiptHandle"] } for index, message in enumerate(messages) ]
+        response = self.client.delete_message_batch(QueueUrl=self.get_queue_url(self.dlq_name), Entries=entries)
+        for entry in response.get("Failed", []):
+            logger.error(f"===> FAIL: unable to delete replayed message: {entry.get('Code')} {entry.get('Message')}")
+        self.count(deleted=len(response.get("Successful", [])))
+
+    def run_worker(self):
+        # -*- coding: utf-8 -*-
+        """This method receives, replays and deletes batches of messages until the dead
+        letter queue is found empty (or enough messages have been received).
+        """
+        while True:
+            messages = self.receive()
+            if messages is None:
+                return
+            decoded = [ (message, decode_message(message)) for message in messages ]
+            selected = [ (message, event) for message, event in decoded if message_matches(event, self.event_names, self.tag_keys) ]
+            self.count(skipped=len(messages) - len(selected))
+            if not selected:
+                continue
+            replay = self.replay_locally if self.mode == "local" else self.replay_by_enqueueing
+            replayed = replay(selected)
+            self.count(replayed=len(replayed), failed=len(selected) - len(replayed))
+            self.delete(replayed)
+
+    def run(self):
+        # -*- coding: utf-8 -*-
+        """This method runs the workers to completion, and returns the stats of the run:
+        the counts of messages "received", "replayed", "skipped" (by the filters), "failed"
+        (to be replayed), "deleted" and received again ("duplicates"), along with the
+        "seconds" taken and the "messagesPerSecond" replayed.
+        """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [ executor.submit(self.run_worker) for i in range(self.concurrency) ]:
+                future.result()
+        seconds = time.perf_counter() - started
+        stats = dict(self.stats, seconds=round(seconds, 3),
+                     messagesPerSecond=round(self.stats["replayed"] / seconds, 1) if seconds > 0 else None)
+        logger.info(f"===> redrive of '{self.dlq_name}' done: {json.dumps(stats)}")
+        return stats
+
+def get_default_dlq_name():
+    # -*- coding: utf-8 -*-
+    """This method returns the name of the dead letter queue that terraform creates for
+    the queue named by "QUEUE_NAME", or None if that isn't set.
+    """
+    queue_name = os.environ.get("QUEUE_NAME", None)
+    return f"{queue_name}_deadletter" if queue_name else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the messages of the load splitter's dead letter queue")
+    parser.add_argument("--dlq",             default=get_default_dlq_name(), help="name of the dead letter queue (default: QUEUE_NAME + '_deadletter')")
+    parser.add_argument("--mode",            choices=REPLAY_MODES, default="enqueue", help="send the messages back to their queue, or hand them to the handler here")
+    parser.add_argument("--queue",           default=None, help="queue to send every message to, rather than that of its lane")
+    parser.add_argument("--concurrency",     type=int, default=DEFAULT_CONCURRENCY, help="number of batches replayed in parallel")
+    parser.add_argument("--event-name",      action="append", default=None, help="replay only events whose name matches this pattern (repeatable)")
+    parser.add_argument("--tag-key",         action="append", default=None, help="replay only events with a tag key matching this pattern (repeatable)")
+    parser.add_argument("--max-messages",    type=int, default=None, help="number of messages to receive at most")
+    parser.add_argument("--wait-seconds",    type=int, default=DEFAULT_WAIT_SECONDS, help="long polling wait of each receive")
+    parser.add_argument("--visibility-timeout", type=int, default=DEFAULT_VISIBILITY_TIMEOUT, help="how long received messages are hidden")
+    args = parser.parse_args()
+    if not args.dlq:
+        parser.error("the dead letter queue must be given with --dlq, or by QUEUE_NAME")
+    logging.basicConfig(level=logging.INFO)
+    stats = Redrive(args.dlq, args.mode, args.queue, args.concurrency, args.event_name, args.tag_key,
+                    args.max_messages, args.wait_seconds, args.visibility_timeout).run()
+    print(json.dumps(stats))
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
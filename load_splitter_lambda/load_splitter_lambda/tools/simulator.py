@@ -0,0 +1,338 @@
+#######################################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#######################################################################################
+
+# This is a discrete-event simulator of the load splitting loop (a CloudTrail event
+# invokes the Lambda, which queues smaller events to SQS, which invoke the Lambda in
+# batches, ...), for choosing the split strategy, SQS batch size, Lambda timeout and
+# reserved concurrency without deploying anything. It models:
+#
+#   - the events: their arrival over time, and their number of tags, drawn from a given
+#     distribution, each tag taking a given (optionally random) time to process
+#   - the Lambda: the concurrency limit, the cold start latency of new containers, the
+#     reuse of warm containers, and the timeout (invocations running past it are
+#     counted, but not retried)
+#   - the deadline scheduler: how many tags an invocation processes itself, going by the
+#     time left before its timeout, the safety margin and the estimated time per tag
+#   - SQS: the latency of each SendMessageBatch call, the delay before Lambda's pollers
+#     pick up a visible message, and the batch size and batching window
+#
+# How an event is handled follows the Lambda's own code (handle_event() in main.py): the
+# tags that fit before the deadline (see scheduler.py) are processed in the invocation,
+# after the others have been queued, and tags that haven't started when the time budget
+# runs out are queued as well. The chunks and the tree fan-out ranges come from
+# split_policy.py, and messages are sent in batches of event_queue.SQS_MAX_BATCH_ENTRIES.
+# The estimated time per tag is fixed, rather than learnt as the Lambda does, and the
+# local pool processes one tag at a time (LOCAL_MAX_WORKERS isn't modelled).
+#
+# For each split strategy, it predicts the makespan (from the first event's arrival to
+# the last tag being processed), the latency of each tag (from its event's arrival to
+# its processing) and the cost of the Lambda requests, Lambda GB-seconds and SQS
+# requests.
+#
+# To run the simulator, execute it from the parent directory where your lambda code resides:
+#   python load_splitter_lambda/tools/simulator.py --tag-counts 1 10 100 2000 --strategy chunk=1 --strategy chunk=5,tree=10
+
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+from collections import deque, namedtuple
+
+sys.path.append("load_splitter_lambda/code") # needed for aws and pytest
+from event_queue import SQS_MAX_BATCH_ENTRIES
+from scheduler import DEFAULT_SAFETY_MARGIN_MS, DEFAULT_TAG_SECONDS_ESTIMATE
+from split_policy import chunk_items, group_chunks_for_tree
+
+# prices in USD, as of the us-east-1 price lists for x86 Lambda and standard SQS queues
+LAMBDA_PRICE_PER_REQUEST   = 0.20 / 1e6
+LAMBDA_PRICE_PER_GB_SECOND = 0.0000166667
+SQS_PRICE_PER_REQUEST      = 0.40 / 1e6
+
+# How the events are split: at most 'chunk_size' tags per queued message (or, when
+# 'max_cost' is set, as many tags as take at most 'max_cost' seconds to process), and
+# range messages of 'branching_factor' (when at least 2) up to 'max_depth' levels deep.
+Strategy = namedtuple("Strategy", ["name", "chunk_size", "max_cost", "branching_factor", "max_depth"])
+
+# The environment the events are simulated in (see the top of this file). Times are in
+# seconds.
+Parameters = namedtuple("Parameters", [
+    "concurrency", "cold_start_seconds", "timeout_seconds", "memory_mb",
+    "send_batch_seconds", "poll_delay_seconds", "batch_size", "batching_window_seconds",
+    "safety_margin_seconds", "tag_seconds_estimate"])
+
+DEFAULT_PARAMETERS = Parameters(
+    concurrency=1000, cold_start_seconds=0.3, timeout_seconds=60, memory_mb=128,
+    send_batch_seconds=0.02, poll_delay_seconds=0.1, batch_size=10, batching_window_seconds=0,
+    safety_margin_seconds=DEFAULT_SAFETY_MARGIN_MS / 1000.0, tag_seconds_estimate=DEFAULT_TAG_SECONDS_ESTIMATE)
+
+# One piece of work for an invocation: a whole event (depth None) or a queued message.
+Work = namedtuple("Work", ["arrival", "tag_seconds", "depth", "is_range"])
+
+def parse_strategy(text):
+    # -*- coding: utf-8 -*-
+    """This method parses a strategy written as comma separated settings, such as
+    "chunk=5,tree=10,depth=3" or "cost=20", into a Strategy. Settings that are left out
+    take the Lambda's defaults (1 tag per chunk, and no tree fan-out).
+    """
+    settings = dict(setting.split("=", 1) for setting in text.split(",") if setting)
+    unknown = set(settings) - { "chunk", "cost", "tree", "depth" }
+    if unknown:
+        raise ValueError(f"unknown strategy setting(s) {sorted(unknown)} in '{text}'")
+    max_cost = float(settings["cost"]) if "cost" in settings else None
+    return Strategy(text, int(settings.get("chunk", 1)), max_cost, int(settings.get("tree", 0)), int(settings.get("depth", 3)))
+
+def percentile(values, fraction):
+    # -*- coding: utf-8 -*-
+    """This method returns the nearest-rank percentile of the (sorted) 'values', or None
+    if there are none.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+class Simulation():
+    """Simulates the handling of a set of events with one strategy. Call run() once."""
+    def __init__(self, strategy, parameters=DEFAULT_PARAMETERS):
+        self.strategy = strategy
+        self.parameters = parameters
+        self.now = 0.0
+        self._timeline = []           # heap of (time, sequence, action)
+        self._sequence = itertools.count()
+        self._events = deque()        # events waiting for a free Lambda
+        self._messages = []           # heap of (visible time, sequence, Work)
+        self._window_until = None
+        self.running = 0
+        self.idle_containers = 0
+        self.peak_concurrency = 0
+        self.invocations = 0
+        self.cold_starts = 0
+        self.timeouts = 0
+        self.billed_seconds = 0.0
+        self.send_calls = 0
+        self.receive_calls = 0
+        self.messages_sent = 0
+        self.tag_latencies = []
+        self.last_tag_done = 0.0
+
+    def _at(self, time, action):
+        heapq.heappush(self._timeline, (time, next(self._sequence), action))
+
+    def run(self, events):
+        # -*- coding: utf-8 -*-
+        """This method simulates the given 'events', a list of (arrival time, list of
+        per-tag processing times) tuples, and returns the predictions as a dict.
+        """
+        for arrival, tag_seconds in events:
+            self._at(arrival, lambda work=Work(arrival, list(tag_seconds), None, False): self._events.append(work))
+        while self._timeline:
+            self.now, _, action = heapq.heappop(self._timeline)
+            if action:
+                action()
+            self._dispatch()
+        return self.results()
+
+    def _dispatch(self):
+        while self.running < self.parameters.concurrency:
+            if self._events:
+                self._invoke([ self._events.popleft() ], from_queue=False)
+                continue
+            if not self._messages or self._messages[0][0] > self.now:
+                return
+            visible = sum(1 for visible_at, _, work in self._messages if visible_at <= self.now)
+            if visible < self.parameters.batch_size and self.parameters.batching_window_seconds > 0:
+                if self._window_until is None:
+                    self._window_until = self._messages[0][0] + self.parameters.batching_window_seconds
+                    self._at(self._window_until, None)
+                if self.now < self._window_until:
+                    return
+            self._window_until = None
+            batch = [ heapq.heappop(self._messages)[2] for i in range(min(visible, self.parameters.batch_size)) ]
+            self._invoke(batch, from_queue=True)
+
+    def _invoke(self, batch, from_queue):
+        self.running += 1
+        self.invocations += 1
+        self.peak_concurrency = max(self.peak_concurrency, self.running)
+        started = self.now + (self.parameters.poll_delay_seconds if from_queue else 0)
+        if self.idle_containers:
+            self.idle_containers -= 1
+        else:
+            self.cold_starts += 1
+            started += self.parameters.cold_start_seconds
+        if from_queue:
+            self.receive_calls += 2 # ReceiveMessage and DeleteMessageBatch
+        time = started
+        deadline = started + self.parameters.timeout_seconds
+        for index, work in enumerate(batch):
+            # as in handle_queue_records(), the first message always makes progress
+            time = self._handle(work, time, deadline, min_local_tags=1 if index == 0 else 0)
+        if time - started > self.parameters.timeout_seconds:
+            self.timeouts += 1
+        self.billed_seconds += math.ceil((time - started) * 1000) / 1000
+        self._at(time, self._finish)
+
+    def _finish(self):
+        self.running -= 1
+        self.idle_containers += 1
+
+    def _handle(self, work, time, deadline, min_local_tags):
+        # this follows handle_event() in main.py: range messages are split again, and
+        # other events have the tags that fit before the deadline processed here, once
+        # the others have been queued
+        if work.is_range:
+            return self._queue(work, work.tag_seconds, time)
+        budget = max(0.0, deadline - time - self.parameters.safety_margin_seconds)
+        fit = int(budget // max(self.parameters.tag_seconds_estimate, 0.001)) # see scheduler.tags_that_fit()
+        count = min(len(work.tag_seconds), max(fit, min_local_tags))
+        if count > fit:
+            budget = max(budget, self.parameters.tag_seconds_estimate)
+        local_started = time
+        time = self._queue(work, work.tag_seconds[count:], time)
+        budget_ends = time + max(0.0, budget - (time - local_started))
+        spilled = []
+        for index, seconds in enumerate(work.tag_seconds[:count]):
+            if index > 0 and time >= budget_ends:
+                # see local_executor.process_tags_locally(): tags not started in time are queued
+                spilled = work.tag_seconds[index:count]
+                break
+            time += seconds
+            self.tag_latencies.append(time - work.arrival)
+            self.last_tag_done = max(self.last_tag_done, time)
+        return self._queue(work, spilled, time)
+
+    def _queue(self, work, tag_seconds, time):
+        # this follows queue_chunks() in event_queue.py
+        if not tag_seconds:
+            return time
+        chunks = chunk_items(tag_seconds, self.strategy.chunk_size, self.strategy.max_cost, cost_of=float)
+        depth = work.depth or 0
+        ranges = group_chunks_for_tree(chunks, depth, self.strategy.branching_factor, self.strategy.max_depth)
+        pieces = ranges or chunks
+        for i in range(0, len(pieces), SQS_MAX_BATCH_ENTRIES):
+            time += self.parameters.send_batch_seconds
+            self.send_calls += 1
+            for piece in pieces[i:i + SQS_MAX_BATCH_ENTRIES]:
+                message = Work(work.arrival, piece, depth + 1 if ranges else None, bool(ranges))
+                heapq.heappush(self._messages, (time, next(self._sequence), message))
+                self.messages_sent += 1
+            self._at(time, None)
+        return time
+
+    def results(self):
+        # -*- coding: utf-8 -*-
+        """This method returns the predictions, as a dict."""
+        latencies = sorted(self.tag_latencies)
+        lambda_cost = self.invocations * LAMBDA_PRICE_PER_REQUEST + \
+                      self.billed_seconds * self.parameters.memory_mb / 1024 * LAMBDA_PRICE_PER_GB_SECOND
+        sqs_cost = (self.send_calls + self.receive_calls) * SQS_PRICE_PER_REQUEST
+        return {
+            "strategy":        self.strategy.name,
+            "tags":            len(latencies),
+            "makespanSeconds": self.last_tag_done,
+            "p50TagSeconds":   percentile(latencies, 0.50),
+            "p99TagSeconds":   percentile(latencies, 0.99),
+            "invocations":     self.invocations,
+            "coldStarts":      self.cold_starts,
+            "peakConcurrency": self.peak_concurrency,
+            "timeouts":        self.timeouts,
+            "messagesSent":    self.messages_sent,
+            "sqsRequests":     self.send_calls + self.receive_calls,
+            "gbSeconds":       self.billed_seconds * self.parameters.memory_mb / 1024,
+            "lambdaCostUsd":   lambda_cost,
+            "sqsCostUsd":      sqs_cost,
+            "totalCostUsd":    lambda_cost + sqs_cost,
+        }
+
+def generate_events(count, tag_counts, tag_seconds, tag_seconds_sigma=0.0, arrival_seconds=0.0, seed=0):
+    # -*- coding: utf-8 -*-
+    """This method generates 'count' events, as taken by Simulation.run().
+
+    Parameters
+    ----------
+    count : int
+        The number of events.
+    tag_counts : list
+        The distribution of the number of tags per event: each event's tag count is
+        drawn from this list, uniformly.
+    tag_seconds : float
+        The mean time taken to process one tag.
+    tag_seconds_sigma : float, optional
+        When above 0, each tag's processing time is drawn from a log-normal distribution
+        with this sigma (and the given mean).
+    arrival_seconds : float, optional
+        The events arrive uniformly at random over this period.
+    seed : int, optional
+        The seed of the random numbers, so that runs are repeatable.
+    """
+    rng = random.Random(seed)
+    mu = math.log(tag_seconds) - tag_seconds_sigma ** 2 / 2 if tag_seconds > 0 else None
+    def one_tag_seconds():
+        if mu is None or tag_seconds_sigma <= 0:
+            return tag_seconds
+        return rng.lognormvariate(mu, tag_seconds_sigma)
+    events = []
+    for i in range(count):
+        tags = rng.choice(tag_counts)
+        events.append((rng.uniform(0, arrival_seconds), [ one_tag_seconds() for tag in range(tags) ]))
+    return sorted(events, key=lambda event: event[0])
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the load splitting loop for several split strategies")
+    parser.add_argument("--events",            type=int, default=100,   help="number of events")
+    parser.add_argument("--tag-counts",        type=int, nargs="+", default=[ 1, 5, 50, 500 ], help="tag counts to draw each event's tag count from")
+    parser.add_argument("--tag-seconds",       type=float, default=5.0, help="mean time to process one tag")
+    parser.add_argument("--tag-seconds-sigma", type=float, default=0.0, help="log-normal sigma of the time to process one tag")
+    parser.add_argument("--arrival-seconds",   type=float, default=60.0, help="period over which the events arrive")
+    parser.add_argument("--strategy",          action="append", default=None, help="split strategy, e.g. 'chunk=5,tree=10' (repeatable)")
+    parser.add_argument("--concurrency",       type=int, default=DEFAULT_PARAMETERS.concurrency, help="Lambda concurrency limit")
+    parser.add_argument("--cold-start",        type=float, default=DEFAULT_PARAMETERS.cold_start_seconds, help="cold start latency")
+    parser.add_argument("--timeout",           type=float, default=DEFAULT_PARAMETERS.timeout_seconds, help="Lambda timeout")
+    parser.add_argument("--safety-margin",     type=float, default=DEFAULT_PARAMETERS.safety_margin_seconds, help="time kept back from the deadline (SAFETY_MARGIN_MS, in seconds)")
+    parser.add_argument("--tag-estimate",      type=float, default=None,  help="estimated time per tag used by the scheduler (defaults to --tag-seconds)")
+    parser.add_argument("--memory-mb",         type=int, default=DEFAULT_PARAMETERS.memory_mb, help="Lambda memory size")
+    parser.add_argument("--send-latency",      type=float, default=DEFAULT_PARAMETERS.send_batch_seconds, help="latency of one SendMessageBatch call")
+    parser.add_argument("--poll-delay",        type=float, default=DEFAULT_PARAMETERS.poll_delay_seconds, help="delay before a visible message is picked up")
+    parser.add_argument("--batch-size",        type=int, default=DEFAULT_PARAMETERS.batch_size, help="SQS event source batch size")
+    parser.add_argument("--batching-window",   type=float, default=DEFAULT_PARAMETERS.batching_window_seconds, help="SQS event source batching window")
+    parser.add_argument("--seed",              type=int, default=0,     help="seed of the random numbers")
+    parser.add_argument("--output",            default=None,            help="file to write the predictions to, as JSON")
+    args = parser.parse_args()
+
+    parameters = Parameters(args.concurrency, args.cold_start, args.timeout, args.memory_mb,
+                            args.send_latency, args.poll_delay, args.batch_size, args.batching_window,
+                            args.safety_margin, args.tag_seconds if args.tag_estimate is None else args.tag_estimate)
+    events = generate_events(args.events, args.tag_counts, args.tag_seconds, args.tag_seconds_sigma,
+                             args.arrival_seconds, args.seed)
+    strategies = [ parse_strategy(text) for text in (args.strategy or [ "chunk=1", "chunk=5", "chunk=1,tree=10" ]) ]
+    results = [ Simulation(strategy, parameters).run(events) for strategy in strategies ]
+    print(f"{'strategy':>18} {'makespan':>9} {'p50 tag':>8} {'p99 tag':>8} {'invokes':>8} {'cold':>5} "
+          f"{'peak':>5} {'t/outs':>6} {'GB-s':>9} {'cost USD':>10}")
+    for row in results:
+        print(f"{row['strategy']:>18} {row['makespanSeconds']:8.1f}s {row['p50TagSeconds'] or 0:7.1f}s "
+              f"{row['p99TagSeconds'] or 0:7.1f}s {row['invocations']:>8} {row['coldStarts']:>5} "
+              f"{row['peakConcurrency']:>5} {row['timeouts']:>6} {row['gbSeconds']:9.1f} {row['totalCostUsd']:10.6f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({ "parameters": parameters._asdict(), "results": results }, output, indent=2)
+        print(f"predictions written to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@
 # The queue to hold the smaller workloads that get created
 resource "aws_sqs_queue" "lambda_invocation_queue" {
   name = "${var.prefix}_queue"
+  # AWS recommends a visibility timeout of at least 6 times the Lambda timeout
+  visibility_timeout_seconds = var.lambda_timeout * 6
   #delay_seconds             = 90
   #message_retention_seconds = 1209600
   #receive_wait_time_seconds = 0
@@ -37,9 +39,38 @@ resource "aws_sqs_queue" "lambda_invocation_queue_deadletter" {
   kms_data_key_reuse_period_seconds = 300
 }
 
+# The queues of the priority lanes other than the default one (see lanes.py), which share
+# the dead letter queue
+resource "aws_sqs_queue" "lane" {
+  for_each                          = var.lanes
+  name                              = "${var.prefix}_${each.key}_queue"
+  visibility_timeout_seconds        = var.lambda_timeout * 6
+  kms_master_key_id                 = "alias/aws/sqs"
+  kms_data_key_reuse_period_seconds = 300
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.lambda_invocation_queue_deadletter.arn
+    maxReceiveCount     = 4
+  })
+}
+
 # Connect the Queue to the Lambda (auto flow of queue msgs to the lambda)
 resource "aws_lambda_event_source_mapping" "sqs" {
   event_source_arn = aws_sqs_queue.lambda_invocation_queue.arn
   function_name    = aws_lambda_function.load_splitter.arn
-  batch_size       = 1
+  batch_size       = var.sqs_batch_size
+  # a batch size above 10 requires a batching window
+  maximum_batching_window_in_seconds = var.sqs_batching_window_seconds
+  # let the Lambda report which messages of a batch failed, so only those are redriven
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Connect the queue of each priority lane to the Lambda, with the lane's own batching, so
+# that each lane is polled independently of the others
+resource "aws_lambda_event_source_mapping" "lane" {
+  for_each                           = var.lanes
+  event_source_arn                   = aws_sqs_queue.lane[each.key].arn
+  function_name                      = aws_lambda_function.load_splitter.arn
+  batch_size                         = each.value.batch_size
+  maximum_batching_window_in_seconds = each.value.batching_window_seconds
+  function_response_types            = ["ReportBatchItemFailures"]
 }
@@ -21,3 +21,84 @@ variable "prefix" {
   type        = string
   default     = "MY_PREFIX"
 }
+
+variable "chunk_size" {
+  description = "The maximum number of tags placed in each queued message when a large event is split."
+  type        = number
+  default     = 1
+}
+
+variable "lambda_timeout" {
+  description = "The Lambda timeout in seconds. It must allow for processing a whole batch of queued messages."
+  type        = number
+  default     = 60
+}
+
+variable "sqs_batch_size" {
+  description = "The maximum number of queued messages handed to the Lambda in one invocation."
+  type        = number
+  default     = 10
+}
+
+variable "sqs_batching_window_seconds" {
+  description = "How long to wait to gather a batch of queued messages. Required to be above 0 when sqs_batch_size is above 10."
+  type        = number
+  default     = 0
+}
+
+variable "local_max_workers" {
+  description = "When above 0, the number of threads the Lambda uses to process tags itself before queueing the rest."
+  type        = number
+  default     = 0
+}
+
+variable "tree_branching_factor" {
+  description = "When at least 2, the number of range messages a very large event is split into, each of which is split again in turn."
+  type        = number
+  default     = 0
+}
+
+variable "coalesce_max_tags" {
+  description = "When at least 2, the tags of small queued events for the same resources are processed together, in units of up to this many tags."
+  type        = number
+  default     = 0
+}
+
+variable "claim_check_bucket" {
+  description = "When true, queued messages too large for SQS are moved to an S3 bucket, and only their key is queued."
+  type        = bool
+  default     = false
+}
+
+variable "claim_check_expiration_days" {
+  description = "How many days the messages moved to the claim check bucket are kept."
+  type        = number
+  default     = 14
+}
+
+variable "idempotency_table" {
+  description = "When true, processed tags are recorded in a DynamoDB table, so that repeat deliveries are skipped by every Lambda container."
+  type        = bool
+  default     = false
+}
+
+variable "lanes" {
+  description = "The priority lanes other than the default one, by name, each with a queue of its own and the batch size and batching window of its event source mapping."
+  type = map(object({
+    batch_size              = number
+    batching_window_seconds = number
+  }))
+  default = {}
+}
+
+variable "lane_rules" {
+  description = "The rules assigning events to lanes, as a JSON list (see lanes.py), e.g. [{\"lane\": \"bulk\", \"minFanOut\": 100}]."
+  type        = string
+  default     = "[]"
+}
+
+variable "job_tracking" {
+  description = "When true, the progress of each split event is counted down in a DynamoDB table, and a completion event is sent to the default EventBridge bus once all its tags are processed."
+  type        = bool
+  default     = false
+}